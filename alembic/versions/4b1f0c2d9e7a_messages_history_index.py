@@ -0,0 +1,32 @@
+"""Messages history index
+
+Revision ID: 4b1f0c2d9e7a
+Revises: 370ed91d0ff5
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b1f0c2d9e7a'
+down_revision: Union[str, None] = '370ed91d0ff5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY не блокирует запись в messages, но не работает внутри транзакции
+    with op.get_context().autocommit_block():
+        op.create_index('ix_messages_chat_id_timestamp_id', 'messages', ['chat_id', 'timestamp', 'id'],
+                        unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_messages_chat_id_timestamp_id', table_name='messages',
+                      postgresql_concurrently=True, if_exists=True)
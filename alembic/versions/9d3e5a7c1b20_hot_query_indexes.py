@@ -0,0 +1,43 @@
+"""Hot query indexes
+
+Revision ID: 9d3e5a7c1b20
+Revises: 4b1f0c2d9e7a
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d3e5a7c1b20'
+down_revision: Union[str, None] = '4b1f0c2d9e7a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# имя индекса, таблица, колонки, условие частичного индекса
+INDEXES = [
+    ('ix_group_members_chat_id_user_id', 'group_members', ['chat_id', 'user_id'], None),
+    ('ix_group_members_chat_id_admins', 'group_members', ['chat_id', 'user_id'], 'is_admin'),
+    ('ix_tokens_user_id_device_id', 'tokens', ['user_id', 'device_id'], None),
+    ('ix_tokens_revoked_jti', 'tokens', ['jti'], 'revoked'),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY не блокирует запись в таблицы, но не работает внутри транзакции
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            op.create_index(name, table, columns, unique=False, if_not_exists=True,
+                            postgresql_concurrently=True,
+                            postgresql_where=sa.text(where) if where else None)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,46 @@
+"""Message archives
+
+Revision ID: a8d2f6c4e1b9
+Revises: f3a9c1e7b5d2
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8d2f6c4e1b9'
+down_revision: Union[str, None] = 'f3a9c1e7b5d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # индекс файлов архива старых сообщений
+    op.create_table(
+        'message_archives',
+        sa.Column('chat_id', sa.Uuid(), nullable=False),
+        sa.Column('first_timestamp', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('last_timestamp', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('key', sa.String(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('id', sa.Uuid(), nullable=False),
+        sa.ForeignKeyConstraint(['chat_id'], ['chats.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_message_archives_id'), 'message_archives', ['id'], unique=False)
+    op.create_index('ix_message_archives_chat_id_last_timestamp', 'message_archives',
+                    ['chat_id', 'last_timestamp'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # сообщения из файлов архива в messages не возвращаются
+    op.drop_index('ix_message_archives_chat_id_last_timestamp', table_name='message_archives')
+    op.drop_index(op.f('ix_message_archives_id'), table_name='message_archives')
+    op.drop_table('message_archives')
@@ -0,0 +1,44 @@
+"""Message reads primary key
+
+Revision ID: b2e6d4a8c3f1
+Revises: a8d2f6c4e1b9
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2e6d4a8c3f1'
+down_revision: Union[str, None] = 'a8d2f6c4e1b9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 370ed91d0ff5 удалил колонку id вместе с первичным ключом (message_id, user_id, id): у message_reads
+    # не осталось ни ключа, ни индекса, и повторные отметки о прочтении записывались заново.
+    # Таблица, созданная create_all, ключ уже имеет
+    if sa.inspect(op.get_bind()).get_pk_constraint('message_reads')['constrained_columns']:
+        return
+    # счетчик прочтений был увеличен и за повторы: пересчитываем по уникальным читателям
+    op.execute("""
+        UPDATE messages m SET read_count = r.readers
+        FROM (SELECT message_id, count(DISTINCT user_id) AS readers FROM message_reads
+              GROUP BY message_id HAVING count(*) > count(DISTINCT user_id)) r
+        WHERE m.id = r.message_id
+    """)
+    op.execute("""
+        DELETE FROM message_reads r USING message_reads d
+        WHERE r.message_id = d.message_id AND r.user_id = d.user_id AND r.ctid > d.ctid
+    """)
+    op.create_primary_key('message_reads_pkey', 'message_reads', ['message_id', 'user_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('message_reads_pkey', 'message_reads', type_='primary')
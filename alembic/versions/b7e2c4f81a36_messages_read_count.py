@@ -0,0 +1,34 @@
+"""Messages read count
+
+Revision ID: b7e2c4f81a36
+Revises: 9d3e5a7c1b20
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e2c4f81a36'
+down_revision: Union[str, None] = '9d3e5a7c1b20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('messages', sa.Column('read_count', sa.Integer(), server_default='0', nullable=False))
+    # счетчик для уже существующих прочтений
+    op.execute("""
+        UPDATE messages m SET read_count = r.cnt
+        FROM (SELECT message_id, count(*) AS cnt FROM message_reads GROUP BY message_id) r
+        WHERE m.id = r.message_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('messages', 'read_count')
@@ -0,0 +1,36 @@
+"""Group members read watermark
+
+Revision ID: d41a8e6b2c59
+Revises: b7e2c4f81a36
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd41a8e6b2c59'
+down_revision: Union[str, None] = 'b7e2c4f81a36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('group_members', sa.Column('last_read_at', sa.DateTime(timezone=True), nullable=True))
+    # начальный водяной знак - самое позднее сообщение чата, отмеченное участником прочитанным
+    op.execute("""
+        UPDATE group_members g SET last_read_at = r.read_until
+        FROM (SELECT m.chat_id, mr.user_id, max(m.timestamp) AS read_until
+              FROM message_reads mr JOIN messages m ON m.id = mr.message_id
+              GROUP BY m.chat_id, mr.user_id) r
+        WHERE g.chat_id = r.chat_id AND g.user_id = r.user_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('group_members', 'last_read_at')
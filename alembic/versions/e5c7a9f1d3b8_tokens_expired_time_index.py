@@ -0,0 +1,32 @@
+"""Tokens expired_time index
+
+Revision ID: e5c7a9f1d3b8
+Revises: d41a8e6b2c59
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5c7a9f1d3b8'
+down_revision: Union[str, None] = 'd41a8e6b2c59'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # уборщик истекших токенов выбирает пакеты по expired_time
+    with op.get_context().autocommit_block():
+        op.create_index('ix_tokens_expired_time', 'tokens', ['expired_time'],
+                        unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_tokens_expired_time', table_name='tokens',
+                      postgresql_concurrently=True, if_exists=True)
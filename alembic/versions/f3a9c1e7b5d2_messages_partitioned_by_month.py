@@ -0,0 +1,137 @@
+"""Messages partitioned by month
+
+Revision ID: f3a9c1e7b5d2
+Revises: e5c7a9f1d3b8
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from datetime import UTC, datetime
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3a9c1e7b5d2'
+down_revision: Union[str, None] = 'e5c7a9f1d3b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 3
+COLUMNS = "id, chat_id, sender_id, text, timestamp, is_read, read_count"
+
+
+def months(first: datetime, last: datetime):
+    index, end = first.year * 12 + first.month - 1, last.year * 12 + last.month - 1
+    while index <= end + 1:
+        yield datetime(index // 12, index % 12 + 1, 1, tzinfo=UTC)
+        index += 1
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.drop_constraint('message_reads_message_id_fkey', 'message_reads', type_='foreignkey')
+    op.rename_table('messages', 'messages_unpartitioned')
+    op.execute("ALTER INDEX ix_messages_id RENAME TO ix_messages_unpartitioned_id")
+    op.execute("ALTER INDEX IF EXISTS ix_messages_chat_id_timestamp_id "
+               "RENAME TO ix_messages_unpartitioned_chat_id_timestamp_id")
+    op.execute("ALTER TABLE messages_unpartitioned RENAME CONSTRAINT messages_pkey TO messages_unpartitioned_pkey")
+
+    # уникальность id и цель внешнего ключа message_reads
+    op.create_table(
+        'message_keys',
+        sa.Column('id', sa.Uuid(), nullable=False),
+        sa.Column('chat_id', sa.Uuid(), nullable=True),
+        sa.Column('timestamp', sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(['chat_id'], ['chats.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_table(
+        'messages',
+        sa.Column('id', sa.Uuid(), nullable=False),
+        sa.Column('chat_id', sa.Uuid(), nullable=True),
+        sa.Column('sender_id', sa.Uuid(), nullable=True),
+        sa.Column('text', sa.Text(), nullable=True),
+        sa.Column('timestamp', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('is_read', sa.Boolean(), nullable=True),
+        sa.Column('read_count', sa.Integer(), server_default='0', nullable=False),
+        sa.ForeignKeyConstraint(['chat_id'], ['chats.id']),
+        sa.ForeignKeyConstraint(['sender_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id', 'timestamp'),
+        postgresql_partition_by='RANGE (timestamp)',
+    )
+
+    # секции: от месяца самого старого сообщения до MONTHS_AHEAD месяцев вперед
+    now = datetime.now(UTC)
+    oldest = op.get_bind().scalar(sa.text("SELECT min(timestamp) FROM messages_unpartitioned")) or now
+    last = datetime(now.year + (now.month + MONTHS_AHEAD - 1) // 12, (now.month + MONTHS_AHEAD - 1) % 12 + 1, 1,
+                    tzinfo=UTC)
+    op.execute("CREATE TABLE messages_default PARTITION OF messages DEFAULT")
+    bounds = list(months(oldest.astimezone(UTC), last))
+    for lo, hi in zip(bounds, bounds[1:]):
+        op.execute(f"CREATE TABLE messages_p{lo.year:04d}_{lo.month:02d} PARTITION OF messages "
+                   f"FOR VALUES FROM ('{lo.isoformat()}') TO ('{hi.isoformat()}')")
+
+    # у старых сообщений timestamp мог быть NULL: в ключ секционирования он нужен
+    op.execute(f"""
+        INSERT INTO messages ({COLUMNS})
+        SELECT id, chat_id, sender_id, text, coalesce(timestamp, now()), is_read, read_count
+        FROM messages_unpartitioned
+    """)
+    op.execute("INSERT INTO message_keys (id, chat_id, timestamp) SELECT id, chat_id, timestamp FROM messages")
+    # индексы после копирования строк: так быстрее, чем обновлять их на каждую вставку
+    op.create_index('ix_messages_chat_id_timestamp_id', 'messages', ['chat_id', 'timestamp', 'id'], unique=False)
+    op.create_index('ix_message_keys_timestamp', 'message_keys', ['timestamp'], unique=False)
+    op.create_foreign_key('message_reads_message_id_fkey', 'message_reads', 'message_keys',
+                          ['message_id'], ['id'], ondelete='CASCADE')
+    op.drop_table('messages_unpartitioned')
+
+    # повтор id при вставке пропускается (ON CONFLICT (id) у секционированной таблицы невозможен)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION messages_claim_key() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO message_keys (id, chat_id, timestamp) VALUES (NEW.id, NEW.chat_id, NEW.timestamp)
+            ON CONFLICT (id) DO NOTHING;
+            IF NOT FOUND THEN
+                RETURN NULL;
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("CREATE TRIGGER messages_claim_key BEFORE INSERT ON messages "
+               "FOR EACH ROW EXECUTE FUNCTION messages_claim_key()")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # отсоединенные секции (TG_PARTITIONS_RETENTION) в обычную таблицу не возвращаются
+    op.execute("DROP TRIGGER messages_claim_key ON messages")
+    op.execute("DROP FUNCTION messages_claim_key()")
+    op.drop_constraint('message_reads_message_id_fkey', 'message_reads', type_='foreignkey')
+    op.rename_table('messages', 'messages_partitioned')
+    op.execute("ALTER INDEX ix_messages_chat_id_timestamp_id RENAME TO ix_messages_partitioned_chat_id_timestamp_id")
+    op.execute("ALTER TABLE messages_partitioned RENAME CONSTRAINT messages_pkey TO messages_partitioned_pkey")
+    op.create_table(
+        'messages',
+        sa.Column('chat_id', sa.Uuid(), nullable=True),
+        sa.Column('sender_id', sa.Uuid(), nullable=True),
+        sa.Column('text', sa.Text(), nullable=True),
+        sa.Column('timestamp', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('is_read', sa.Boolean(), nullable=True),
+        sa.Column('id', sa.Uuid(), nullable=False),
+        sa.Column('read_count', sa.Integer(), server_default='0', nullable=False),
+        sa.ForeignKeyConstraint(['chat_id'], ['chats.id']),
+        sa.ForeignKeyConstraint(['sender_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.execute(f"INSERT INTO messages ({COLUMNS}) SELECT {COLUMNS} FROM messages_partitioned")
+    op.create_index('ix_messages_id', 'messages', ['id'], unique=False)
+    op.create_index('ix_messages_chat_id_timestamp_id', 'messages', ['chat_id', 'timestamp', 'id'], unique=False)
+    # отметки о прочтении сообщений из отсоединенных секций ссылаются на уже несуществующие строки
+    op.execute("DELETE FROM message_reads WHERE message_id NOT IN (SELECT id FROM messages)")
+    op.create_foreign_key('message_reads_message_id_fkey', 'message_reads', 'messages', ['message_id'], ['id'])
+    op.drop_table('messages_partitioned')  # вместе с секциями
+    op.drop_index('ix_message_keys_timestamp', table_name='message_keys')
+    op.drop_table('message_keys')
@@ -2,21 +2,28 @@
 from fastapi import Depends, HTTPException
 from jose import JWTError, jwt
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
 from starlette import status
 
+from app.auth.cache import token_cache
 from app.auth.token import get_token, get_ws_token
+from app.auth.utils import check_revoked
 from app.config import settings
-from app.database import get_db
+from app.database import get_db, get_session_factory, session_scope
 from app.models.models import User
 from app.tools import validate_uuid
 
 
-async def get_current_user(token: str = Depends(get_token),
-                           session: AsyncSession = Depends(get_db)) -> User:
-    """Получить пользователя по токену"""
+async def authenticate(token: str, session: AsyncSession) -> tuple[User, dict]:
+    """
+    Пользователь и claims токена. Токен, уже проверенный раньше, берется из кеша:
+    без повторной проверки подписи и без запроса пользователя в базу.
+    """
+    if (cached := token_cache.get(token)) is not None:
+        return await session.merge(cached.user(), load=False), cached.payload
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-    except JWTError as ex:
+    except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Токен не валидный!')
 
     user_id = validate_uuid(payload.get('sub'),
@@ -24,39 +31,43 @@ async def get_current_user(token: str = Depends(get_token),
                             er_msg="Не найден ID пользователя")
     if not user_id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Не найден ID пользователя')
-    return await User.get_or_404(id=user_id, session=session, er_status=status.HTTP_401_UNAUTHORIZED)
+    # отозванный токен не должен жить в кеше до exp
+    if payload.get('jti') and await check_revoked(payload['jti'], session=session):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Токен отозван')
+    user = await User.get_or_404(id=user_id, session=session, er_status=status.HTTP_401_UNAUTHORIZED)
+    token_cache.set(token, payload, user)
+    return user, payload
+
+
+async def get_current_user(token: str = Depends(get_token),
+                           session: AsyncSession = Depends(get_db)) -> User:
+    """Получить пользователя по токену"""
+    user, _ = await authenticate(token, session)
+    return user
 
 
 async def get_current_user_and_device(token: str = Depends(get_token),
                                       session: AsyncSession = Depends(get_db)) -> tuple[User, str]:
     """Получить пользователя по токену"""
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-    except JWTError:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Токен не валидный!')
-
     # получаем пользователя и устройство пользователя из токена
-    user_id = validate_uuid(payload.get('sub'))
-    device_id = payload.get('device_id')
-    if not user_id:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Не найден ID пользователя')
-    if not device_id:
+    user, payload = await authenticate(token, session)
+    if not (device_id := payload.get('device_id')):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Не найден ID устройства')
-    user = await User.get_or_404(id=user_id, session=session, er_status=status.HTTP_401_UNAUTHORIZED)
     return user, device_id
 
 
 async def get_current_ws_user(token: str = Depends(get_ws_token),
-                              session: AsyncSession = Depends(get_db)) -> User:
-    """Получить пользователя по токену для веб-сокета"""
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-    except JWTError:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Токен не валидный!')
-    user_id = validate_uuid(payload.get('sub'))
-    if not user_id:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Не найден ID пользователя')
-    return await User.get_or_404(id=user_id, session=session, er_status=status.HTTP_401_UNAUTHORIZED)
+                              session_factory: sessionmaker = Depends(get_session_factory)) -> User:
+    """
+    Получить пользователя по токену для веб-сокета.
+    Сессия открывается только на запрос пользователя, а не на все время жизни сокета,
+    а для токена из кеша не открывается вовсе.
+    """
+    if (cached := token_cache.get(token)) is not None:
+        return cached.user()
+    async with session_scope(session_factory) as session:
+        user, _ = await authenticate(token, session)
+        return user
 
 
 async def get_admin_user(token: str = Depends(get_token),
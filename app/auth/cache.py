@@ -0,0 +1,94 @@
+"""
+Кеш проверенных access-токенов.
+
+Клиент отправляет один и тот же access-токен сотни раз за время его жизни, и каждый раз
+проверялась подпись и запрашивался пользователь. Кеш по sha256 токена хранит claims и
+колонки пользователя до exp токена, но не дольше TG_AUTH_CACHE_TTL. Выход с устройства
+и отзыв токенов (AuthService.logout, update_tokens) сбрасывают записи явно, изменение
+или удаление пользователя - тоже. Отзывы из других процессов приходят через индекс
+отозванных токенов (app/auth/revocation.py), изменения пользователя в других
+воркерах станут видны не позже чем через TTL.
+"""
+import time
+from dataclasses import dataclass
+from hashlib import sha256
+from typing import Any, Collection, Dict
+from uuid import UUID
+
+from sqlalchemy.orm import make_transient_to_detached
+
+from app.config import settings
+from app.models.models import User
+from app.services.cache import TTLCache
+
+
+@dataclass(frozen=True)
+class CachedToken:
+    """Проверенный токен: его claims и пользователь на момент проверки"""
+    payload: Dict[str, Any]
+    user_id: UUID
+    device_id: str | None
+    jti: UUID | None
+    user_values: Dict[str, Any]
+    exp: float | None  # unix-время окончания токена
+
+    def user(self) -> User:
+        """Пользователь без сессии, в состоянии "загружен из базы" (можно session.merge(user, load=False))"""
+        user = User(**self.user_values)
+        make_transient_to_detached(user)
+        return user
+
+
+class TokenCache:
+
+    def __init__(self,
+                 maxsize: int = settings.TG_AUTH_CACHE_SIZE,
+                 ttl: float = settings.TG_AUTH_CACHE_TTL) -> None:
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, token: str) -> CachedToken | None:
+        key = self._key(token)
+        cached = self._cache.get(key)
+        if cached is not None and cached.exp is not None and cached.exp <= time.time():
+            self._cache.pop(key)
+            return None
+        return cached
+
+    def set(self, token: str, payload: Dict[str, Any], user: User):
+        """Запомнить токен, прошедший проверку подписи и отзыва"""
+        self._cache.set(self._key(token), CachedToken(
+            payload=payload,
+            user_id=user.id,
+            device_id=payload.get("device_id"),
+            jti=UUID(payload["jti"]) if payload.get("jti") else None,
+            user_values={column.key: getattr(user, column.key) for column in User.__table__.columns},
+            exp=payload.get("exp"),
+        ))
+
+    def invalidate_device(self, user_id: UUID, device_id: str):
+        """Сбросить токены устройства пользователя (выход, обновление токенов)"""
+        self._drop(lambda cached: cached.user_id == user_id and cached.device_id == str(device_id))
+
+    def invalidate_user(self, user_id: UUID):
+        """Сбросить все токены пользователя (отзыв всех токенов, изменение или удаление пользователя)"""
+        self._drop(lambda cached: cached.user_id == user_id)
+
+    def invalidate_jti(self, jtis: Collection[UUID]):
+        """Сбросить токены, отозванные в другом процессе"""
+        self._drop(lambda cached: cached.jti in jtis)
+
+    def clear(self):
+        self._cache.clear()
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return sha256(token.encode()).hexdigest()
+
+    def _drop(self, predicate):
+        # сбросы редки, а кеш ограничен по размеру: проще пройти его целиком, чем вести обратный индекс
+        for key, cached in self._cache.items():
+            if predicate(cached):
+                self._cache.pop(key)
+
+
+token_cache = TokenCache()
@@ -1,8 +1,32 @@
+"""
+Хеширование паролей.
+
+pbkdf2 считается десятки миллисекунд, и синхронный вызов в async-обработчике
+останавливал на это время цикл событий: вместе с ним стояли все сокеты воркера.
+Асинхронные hash_password и check_password считают хеш в пуле потоков
+(hashlib.pbkdf2_hmac отпускает GIL). Пул ограничен TG_PASSWORD_WORKERS потоками,
+очередь ожидающих - TG_PASSWORD_QUEUE_SIZE; при полной очереди запрос получает 503,
+а не ждет неограниченно. Стоимость хеша задает TG_PASSWORD_ROUNDS: при входе хеш
+с другим числом итераций или устаревшей схемы (django_pbkdf2_sha256) пересчитывается,
+так что смена стоимости постепенно доходит до всех пользователей.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
 from passlib.context import CryptContext
+from starlette import status
+from starlette.exceptions import HTTPException
+
+from app.config import settings
 
 pwd_context = CryptContext(
     schemes=["pbkdf2_sha256", "django_pbkdf2_sha256"],  # Django-совместимый + другие
     deprecated="auto",
+    pbkdf2_sha256__default_rounds=settings.TG_PASSWORD_ROUNDS,
+    # хеш с любым другим числом итераций считается устаревшим
+    pbkdf2_sha256__min_rounds=settings.TG_PASSWORD_ROUNDS,
+    pbkdf2_sha256__max_rounds=settings.TG_PASSWORD_ROUNDS,
 )
 
 
@@ -15,3 +39,52 @@ def verify_password(plain_password: str,
                     hashed_password: str) -> bool:
     """Проверка пароля"""
     return pwd_context.verify(plain_password, hashed_password)
+
+
+def verify_and_update_password(plain_password: str,
+                               hashed_password: str) -> tuple[bool, str | None]:
+    """Проверка пароля и новый хеш, если старый устарел (None - не устарел или пароль неверный)"""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+class PasswordPool:
+    """Пул потоков для хеширования с ограниченной очередью"""
+
+    def __init__(self,
+                 workers: int = settings.TG_PASSWORD_WORKERS,
+                 queue_size: int = settings.TG_PASSWORD_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.pending = 0  # выполняются и ждут потока
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password")
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        if self.pending >= self.workers + self.queue_size:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail='Сервер перегружен, повторите позже',
+                                headers={"Retry-After": "1"})
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self.pending -= 1
+
+
+password_pool = PasswordPool()
+
+
+async def hash_password(password: str) -> str:
+    """Хеширование пароля вне цикла событий"""
+    return await password_pool.run(get_password_hash, password)
+
+
+async def check_password(plain_password: str,
+                         hashed_password: str) -> bool:
+    """Проверка пароля вне цикла событий"""
+    return await password_pool.run(verify_password, plain_password, hashed_password)
+
+
+async def check_and_update_password(plain_password: str,
+                                    hashed_password: str) -> tuple[bool, str | None]:
+    """Проверка пароля с пересчетом устаревшего хеша, вне цикла событий"""
+    return await password_pool.run(verify_and_update_password, plain_password, hashed_password)
@@ -0,0 +1,115 @@
+"""
+Индекс отозванных токенов в памяти процесса.
+
+Проверка "токен отозван" шла запросом в tokens на каждый вызов. Индекс держит
+множество jti отозванных, но еще не истекших токенов: при старте приложения оно
+загружается из базы, при выходе и обновлении токенов (AuthService.logout, update_tokens)
+дополняется, а другим процессам изменения уходят через брокер (TG_BROKER).
+Частый ответ "не отозван" не требует похода в базу. Пока индекс не загружен
+(старт не прошел, база была недоступна) или брокер не связывает процессы (TG_BROKER=memory:
+отзыв в соседнем воркере сюда не дойдет), check_revoked спрашивает базу, как раньше.
+"""
+import json
+import logging
+import time
+from datetime import UTC, datetime
+from typing import Dict, Iterable, Tuple
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from app.auth.cache import token_cache
+from app.database import AsyncSessionLocal
+from app.models.models import IssuedJWTToken
+from app.services.broker import Broker, create_broker
+from app.tools import json_dumps
+
+logger = logging.getLogger(__name__)
+
+
+class RevocationIndex:
+    CHANNEL = "auth:revoked"
+    PUBLISH_CHUNK = 100  # jti в одном сообщении брокера: NOTIFY ограничен 8000 байт
+    PRUNE_INTERVAL = 60.0  # в секундах, как часто выбрасывать истекшие jti
+
+    def __init__(self,
+                 broker: Broker | None = None,
+                 session_factory: sessionmaker = AsyncSessionLocal):
+        self.broker = broker or create_broker()
+        self.broker.set_handler(self._on_broker_message)
+        self.session_factory = session_factory
+        self.loaded = False
+        self._revoked: Dict[UUID, float] = {}  # jti -> exp (unix-время)
+        self._next_prune = 0.0
+
+    async def start(self):
+        """Подписаться на отзывы других процессов и загрузить отозванные токены из базы"""
+        try:
+            await self.broker.start()
+            # подписка до загрузки: отзыв, случившийся во время загрузки, не потеряется
+            await self.broker.subscribe(self.CHANNEL)
+            await self.load()
+        except Exception as e:
+            logger.error(f"🛑 revocation index не загружен, проверка отзыва идет через базу {e=}")
+
+    async def stop(self):
+        self.loaded = False
+        await self.broker.stop()
+
+    async def load(self):
+        now = datetime.now(UTC)
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(IssuedJWTToken.jti, IssuedJWTToken.expired_time)
+                .where(IssuedJWTToken.revoked, IssuedJWTToken.expired_time > now)
+            )
+            self._revoked = {jti: expired_time.timestamp() for jti, expired_time in result.all()}
+        self.loaded = True
+        logger.info(f"✅✅ revocation index: {len(self._revoked)} отозванных токенов")
+
+    @property
+    def authoritative(self) -> bool:
+        """Можно ли отвечать по индексу без базы: он загружен и получает отзывы других процессов"""
+        return self.loaded and self.broker.shared
+
+    def clear(self):
+        """Забыть загруженное: до следующей загрузки проверки идут через базу"""
+        self.loaded = False
+        self._revoked = {}
+
+    def is_revoked(self, jti: UUID) -> bool:
+        return jti in self._revoked
+
+    async def revoke(self, tokens: Iterable[Tuple[UUID, datetime]]):
+        """
+        Добавить отозванные токены и сообщить о них другим процессам.
+        Вызывать после коммита отзыва в базе.
+        :param tokens: пары (jti, expired_time)
+        """
+        revoked = {jti: expired_time.timestamp() for jti, expired_time in tokens}
+        if not revoked:
+            return
+        self._add(revoked)
+        items = list(revoked.items())
+        for start in range(0, len(items), self.PUBLISH_CHUNK):
+            chunk = items[start:start + self.PUBLISH_CHUNK]
+            try:
+                await self.broker.publish(self.CHANNEL, json_dumps({str(jti): exp for jti, exp in chunk}))
+            except Exception as e:
+                logger.error(f"🛑 revocation publish {e=}")
+
+    def _add(self, revoked: Dict[UUID, float]):
+        self._revoked.update(revoked)
+        if (now := time.time()) >= self._next_prune:
+            self._revoked = {jti: exp for jti, exp in self._revoked.items() if exp > now}
+            self._next_prune = now + self.PRUNE_INTERVAL
+
+    async def _on_broker_message(self, channel: str, data: str):
+        """Отзыв в другом процессе: дополнить индекс и сбросить эти токены из кеша проверенных"""
+        revoked = {UUID(jti): exp for jti, exp in json.loads(data).items()}
+        self._add(revoked)
+        token_cache.invalidate_jti(revoked)
+
+
+revocation_index = RevocationIndex()
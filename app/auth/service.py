@@ -8,8 +8,10 @@ from starlette import status
 from starlette.exceptions import HTTPException
 
 from app.config import settings
+from app.auth.cache import token_cache
 from app.auth.my_jwt import JWTAuth
-from app.auth.password import get_password_hash, verify_password
+from app.auth.revocation import revocation_index
+from app.auth.password import check_and_update_password, hash_password
 from app.auth.types import TokenType
 from app.auth.utils import check_revoked, generate_device_id
 from app.database import get_db
@@ -34,7 +36,7 @@ class AuthService:
             raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='CONFLICT')
 
         user = User(id=uuid.uuid4(), email=data.email, username=data.username,
-                    password=get_password_hash(data.password))
+                    password=await hash_password(data.password))
         session.add(user)
         await session.flush()  # <== Заставляет SQLAlchemy сгенерировать ID и выполнить INSERT в БД
 
@@ -55,12 +57,17 @@ class AuthService:
         user = await User.get_or_404(email=data.email,
                                      session=session,
                                      er_status=status.HTTP_401_UNAUTHORIZED)
-        if not verify_password(data.password, user.password):
+        valid, new_hash = await check_and_update_password(data.password, user.password)
+        if not valid:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='HTTP_401_UNAUTHORIZED')
+        if new_hash:  # устаревшая схема или стоимость: сохраняется вместе с токенами
+            user.password = new_hash
         access_token, refresh_token, notes = self._issue_tokens_for_user(user=user)  # создать пользователя
         for note in notes:
             session.add(note)
         await session.commit()
+        if new_hash:
+            token_cache.invalidate_user(user.id)
         return TokensDTO(
             user_id=str(user.id),
             role=user.role,
@@ -80,13 +87,17 @@ class AuthService:
         :param device_id: устройство, с которого вошел пользователь, выход выполняется только для него.
         :return:
         """
-        await session.execute((
+        result = await session.execute((
             update(IssuedJWTToken)
             .where(IssuedJWTToken.user_id == user.id,
                    IssuedJWTToken.device_id == device_id)
             .values(revoked=True)
+            .returning(IssuedJWTToken.jti, IssuedJWTToken.expired_time)
         ))
+        revoked = result.all()
         await session.commit()
+        token_cache.invalidate_device(user.id, device_id)
+        await revocation_index.revoke(revoked)
 
     async def update_tokens(self,
                             user: User,
@@ -104,25 +115,33 @@ class AuthService:
         user = await User.first(id=user_id, session=session)
 
         if await check_revoked(payload['jti'], session=session):
-            await session.execute((
+            result = await session.execute((
                 update(IssuedJWTToken)
                 .where(IssuedJWTToken.user_id == user.id)
                 .values(revoked=True)
+                .returning(IssuedJWTToken.jti, IssuedJWTToken.expired_time)
             ))
+            revoked = result.all()
             await session.commit()
+            token_cache.invalidate_user(user.id)
+            await revocation_index.revoke(revoked)
             return None
 
         device_id = payload['device_id']
-        await session.execute((
+        result = await session.execute((
             update(IssuedJWTToken)
             .where(IssuedJWTToken.user_id == user.id,
                    IssuedJWTToken.device_id == device_id)
             .values(revoked=True)
+            .returning(IssuedJWTToken.jti, IssuedJWTToken.expired_time)
         ))
+        revoked = result.all()
         access_token, refresh_token, notes = self._issue_tokens_for_user(user, device_id)  # создать новые токены
         for note in notes:
             session.add(note)
         await session.commit()
+        token_cache.invalidate_device(user.id, device_id)
+        await revocation_index.revoke(revoked)
         return TokensDTO(
             user_id=payload['sub'],
             role=user.role,
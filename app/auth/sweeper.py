@@ -0,0 +1,122 @@
+"""
+Уборка истекших токенов.
+
+Каждый вход, регистрация и обновление токенов добавляют в tokens две строки, и раньше
+они не удалялись никогда: таблица и ее индексы росли, а с ними - проверки отзыва
+и UPDATE ... WHERE user_id AND device_id при выходе и обновлении токенов.
+Фоновая задача раз в TG_TOKEN_GC_INTERVAL секунд удаляет токены, истекшие больше
+TG_TOKEN_GC_GRACE секунд назад, пакетами по TG_TOKEN_GC_BATCH строк - каждый пакет
+в своей короткой транзакции, чтобы не держать блокировки и не раздувать WAL одним DELETE.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import sessionmaker
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models.models import IssuedJWTToken
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SweepStats:
+    """Метрики уборки"""
+    runs: int = 0
+    errors: int = 0
+    deleted_total: int = 0
+    last_deleted: int = 0
+    last_batches: int = 0
+    last_duration: float = 0.0  # в секундах
+    last_run_at: datetime | None = None
+
+
+class TokenSweeper:
+    """
+    Периодическое удаление истекших токенов.
+    start() запускает задачу из lifespan приложения, sweep() - один проход (для тестов и ручного запуска).
+    """
+
+    def __init__(self,
+                 session_factory: sessionmaker = AsyncSessionLocal,
+                 interval: float = settings.TG_TOKEN_GC_INTERVAL,
+                 batch_size: int = settings.TG_TOKEN_GC_BATCH,
+                 max_batches: int = settings.TG_TOKEN_GC_MAX_BATCHES,
+                 grace: float = settings.TG_TOKEN_GC_GRACE):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.grace = grace
+        self.stats = SweepStats()
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def sweep(self) -> int:
+        """
+        Один проход: удалить истекшие токены, не больше max_batches пакетов.
+        Остаток, если он есть, уйдет в следующий проход.
+        :return: сколько строк удалено
+        """
+        started = time.perf_counter()
+        cutoff = datetime.now(UTC) - timedelta(seconds=self.grace)
+        deleted = batches = 0
+        while batches < self.max_batches:
+            count = await self._delete_batch(cutoff)
+            deleted += count
+            batches += 1
+            if count < self.batch_size:
+                break
+            await asyncio.sleep(0)  # между пакетами отдаем цикл событий запросам
+        stats = self.stats
+        stats.runs += 1
+        stats.deleted_total += deleted
+        stats.last_deleted = deleted
+        stats.last_batches = batches
+        stats.last_duration = time.perf_counter() - started
+        stats.last_run_at = datetime.now(UTC)
+        logger.info(f"✅✅ token gc: удалено {deleted} токенов за {batches} пакетов, {stats.last_duration:.3f} c")
+        return deleted
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                self.stats.errors += 1
+                logger.error(f"🛑 token gc {e=}")
+            await asyncio.sleep(self.interval)
+
+    async def _delete_batch(self, cutoff: datetime) -> int:
+        # SKIP LOCKED: уборщики нескольких воркеров делят строки, а не ждут друг друга
+        batch = (
+            select(IssuedJWTToken.jti)
+            .where(IssuedJWTToken.expired_time < cutoff)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        async with self.session_factory() as session:
+            result = await session.execute(delete(IssuedJWTToken).where(IssuedJWTToken.jti.in_(batch)))
+            await session.commit()
+        return result.rowcount
+
+
+token_sweeper = TokenSweeper()
@@ -1,3 +1,4 @@
+import time
 import uuid
 from calendar import timegm
 from datetime import datetime, timezone
@@ -11,6 +12,7 @@ from starlette.exceptions import HTTPException
 from datetime import timedelta
 
 from app.config import settings
+from app.auth.revocation import revocation_index
 from app.auth.types import TokenType
 from app.models.models import IssuedJWTToken
 from app.models.models import User
@@ -24,14 +26,19 @@ def generate_device_id() -> str:
     return str(uuid.uuid4())
 
 
-async def check_revoked(jti: str | uuid.UUID, session) -> bool:
+async def check_revoked(jti: str | uuid.UUID, session, exp: float | None = None) -> bool:
     """
-
+    Отозван ли токен. Ответ берется из индекса отозванных токенов в памяти,
+    в базу проверка идет, если индекс не загружен, не получает отзывы других процессов (TG_BROKER=memory)
+    или токен уже истек (из индекса он выброшен).
     :param jti:
+    :param exp: unix-время окончания токена, если известно
     :return:
     """
     if isinstance(jti, str):
         jti = uuid.UUID(jti)
+    if revocation_index.authoritative and (exp is None or exp > time.time()):
+        return revocation_index.is_revoked(jti)
     note = await IssuedJWTToken.first(jti=jti, revoked=True, session=session)
     return bool(note)
 
@@ -96,7 +103,7 @@ async def check_access_token(request: Request,
             detail="Invalid or malformed token"
         )
 
-    if await check_revoked(payload['jti'], session=session):
+    if await check_revoked(payload['jti'], session=session, exp=payload.get('exp')):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token has been revoked"
@@ -11,6 +11,18 @@ class Settings(BaseSettings):
     TG_DB_HOST: str
     TG_DB_PORT: str
     TG_DB_TEST_NAME: str
+    TG_DB_ECHO: bool = False  # выводить SQL в лог
+    TG_DB_REPLICA_URL: str = ""  # реплика для чтения: postgresql+asyncpg://...; пусто - читать с основной базы
+
+    # Пул соединений с базой
+    TG_DB_POOL_SIZE: int = 10  # постоянных соединений на процесс
+    TG_DB_MAX_OVERFLOW: int = 10  # временных соединений сверх pool_size
+    TG_DB_POOL_TIMEOUT: float = 10.0  # в секундах, ожидание свободного соединения
+    TG_DB_POOL_RECYCLE: int = 1800  # в секундах, соединение старше пересоздается
+    TG_DB_POOL_PRE_PING: bool = True  # проверять соединение перед выдачей из пула
+    TG_DB_CONNECT_TIMEOUT: float = 10.0  # в секундах, на установку соединения
+    TG_DB_COMMAND_TIMEOUT: float = 30.0  # в секундах, на один запрос
+    TG_DB_PGBOUNCER: bool = False  # подключение через pgbouncer в режиме transaction: NullPool, без prepared statements
 
     # JWT settings
     TG_SECRET_KEY: str
@@ -18,6 +30,68 @@ class Settings(BaseSettings):
     TG_ACCESS_TOKEN_TTL: int  # в секундах
     TG_REFRESH_TOKEN_TTL: int
 
+    # WebSocket settings
+    TG_WS_SEND_TIMEOUT: float = 2.0  # в секундах, на одну отправку в сокет
+    TG_WS_FANOUT_CONCURRENCY: int = 256  # сколько сокетов пишем одновременно при рассылке
+    TG_WS_QUEUE_SIZE: int = 256  # предел очереди исходящих сообщений одного соединения
+    TG_WS_OVERFLOW_POLICY: str = "drop_oldest"  # drop_oldest | coalesce_receipts | disconnect
+    TG_WS_READ_BATCH_MAX: int = 500  # максимум message_ids в одном действии messages_read
+
+    # Пакетная запись сообщений (group commit)
+    TG_INGEST_MAX_DELAY: float = 0.005  # в секундах, сколько копим пакет с момента первого сообщения
+    TG_INGEST_MAX_BATCH: int = 500  # пакет пишется сразу, как только набралось столько сообщений
+
+    # Склейка уведомлений о прочтении
+    TG_RECEIPT_FLUSH_INTERVAL: float = 0.05  # в секундах, сколько копим отметки с момента первой
+    TG_RECEIPT_MAX_BATCH: int = 100  # событие уходит сразу, как только набралось столько message_ids
+    TG_READ_BY_ALL_MAX: int = 500  # больше read_by_all за одно продвижение водяного знака не рассылается
+
+    # История чата
+    TG_HISTORY_MAX_LIMIT: int = 100  # максимум сообщений на страницу
+    TG_HISTORY_TOTAL_TTL: float = 30.0  # в секундах, сколько кешируется общее число сообщений чата
+
+    # Кеш участников чатов для проверок доступа
+    TG_MEMBERSHIP_CACHE_TTL: float = 30.0  # в секундах
+    TG_MEMBERSHIP_CACHE_LOCAL_TTL: float = 5.0  # в секундах, TTL без общего брокера (TG_BROKER=memory)
+    TG_MEMBERSHIP_CACHE_SIZE: int = 10_000  # сколько чатов держать в кеше
+
+    # Хеширование паролей
+    TG_PASSWORD_ROUNDS: int = 29000  # итераций pbkdf2_sha256, хеши с другим числом пересчитываются при входе
+    TG_PASSWORD_WORKERS: int = 4  # потоков, считающих хеши
+    TG_PASSWORD_QUEUE_SIZE: int = 64  # сколько хешей может ждать потока, сверх - 503
+
+    # Кеш проверенных access-токенов
+    TG_AUTH_CACHE_TTL: float = 60.0  # в секундах, не дольше exp токена
+    TG_AUTH_CACHE_SIZE: int = 10_000  # сколько токенов держать в кеше
+
+    # Уборка истекших токенов
+    TG_TOKEN_GC_INTERVAL: float = 3600.0  # в секундах между проходами, 0 - не убирать
+    TG_TOKEN_GC_BATCH: int = 1000  # строк в одном DELETE
+    TG_TOKEN_GC_MAX_BATCHES: int = 100  # пакетов за проход, остаток - в следующий проход
+    TG_TOKEN_GC_GRACE: float = 86400.0  # в секундах, сколько хранить токен после истечения
+
+    # Месячные секции messages
+    TG_PARTITIONS_AHEAD: int = 3  # на сколько месяцев вперед создавать секции
+    TG_PARTITIONS_RETENTION: int = 0  # сколько месяцев держать в messages, 0 - не отсоединять старые секции
+    TG_PARTITIONS_DROP_DETACHED: bool = False  # удалять отсоединенные секции, а не оставлять отдельной таблицей
+    TG_PARTITIONS_INTERVAL: float = 86400.0  # в секундах между проходами, 0 - не обслуживать
+
+    # Архив старых сообщений: local | s3
+    TG_ARCHIVE_AFTER_DAYS: int = 0  # сообщения старше стольких дней уходят в архив, 0 - не архивировать
+    TG_ARCHIVE_CHUNK_SIZE: int = 1000  # сообщений в одном файле архива
+    TG_ARCHIVE_MAX_CHUNKS: int = 100  # файлов за проход, остаток - в следующий проход
+    TG_ARCHIVE_INTERVAL: float = 3600.0  # в секундах между проходами
+    TG_ARCHIVE_CACHE_SIZE: int = 64  # сколько распакованных файлов держать в памяти для чтения истории
+    TG_ARCHIVE_STORE: str = "local"
+    TG_ARCHIVE_PATH: str = "archive"  # каталог для local
+    TG_ARCHIVE_S3_BUCKET: str = ""
+    TG_ARCHIVE_S3_ENDPOINT: str = ""  # S3-совместимое хранилище (MinIO и т.п.), пусто - AWS
+    TG_ARCHIVE_S3_PREFIX: str = "messages/"
+
+    # Брокер сообщений между процессами: memory | postgres | redis
+    TG_BROKER: str = "memory"
+    TG_BROKER_URL: str = ""  # redis://host:6379 или postgresql://... (по умолчанию - база приложения)
+
     model_config = SettingsConfigDict(
         env_file=".env",
         extra="ignore"
@@ -1,8 +1,14 @@
 import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from uuid import uuid4
 
 from dotenv import load_dotenv
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
+from fastapi import Depends
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import NullPool
 from app.config import settings as s
 
 load_dotenv()
@@ -17,8 +23,88 @@ DATABASE_URL = (
     f"{s.TG_DB_TEST_NAME if IS_TESTING else s.TG_DB_NAME}"
 )
 
-engine = create_async_engine(DATABASE_URL, echo=True)
-AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+def engine_options(settings=s) -> dict:
+    """
+    Параметры движка из настроек.
+    Обычный режим - свой пул соединений приложения (TG_DB_POOL_*).
+    TG_DB_PGBOUNCER - подключение через pgbouncer в режиме transaction: пул держит pgbouncer,
+    поэтому у приложения NullPool, а подготовленные выражения asyncpg отключены - следующая
+    транзакция может попасть на другое серверное соединение, где их нет.
+    """
+    connect_args = {
+        "timeout": settings.TG_DB_CONNECT_TIMEOUT,
+        "command_timeout": settings.TG_DB_COMMAND_TIMEOUT,
+    }
+    options = {"echo": settings.TG_DB_ECHO, "connect_args": connect_args}
+    if settings.TG_DB_PGBOUNCER:
+        connect_args.update(
+            statement_cache_size=0,  # кеш подготовленных выражений asyncpg
+            prepared_statement_cache_size=0,  # кеш подготовленных выражений SQLAlchemy
+            # безымянные выражения на соединении pgbouncer могут совпасть по имени у разных клиентов
+            prepared_statement_name_func=lambda: f"__asyncpg_{uuid4()}__",
+        )
+        options["poolclass"] = NullPool
+    else:
+        options.update(
+            pool_size=settings.TG_DB_POOL_SIZE,
+            max_overflow=settings.TG_DB_MAX_OVERFLOW,
+            pool_timeout=settings.TG_DB_POOL_TIMEOUT,
+            pool_recycle=settings.TG_DB_POOL_RECYCLE,
+            pool_pre_ping=settings.TG_DB_POOL_PRE_PING,
+        )
+    return options
+
+
+# опция выполнения запроса: SELECT можно отдать реплике, select(...).execution_options(replica_ok=True)
+# или Base.first/list/list_rows(replica_ok=True). Только для чтений, которым не важна задержка репликации
+# (история, списки, состав чата на страницах чтения); проверки перед записью и авторизация читают с основной базы
+REPLICA_OK = "replica_ok"
+# ключ session.info: сессия только для чтения (get_read_db), все SELECT - на реплику
+READ_ONLY = "read_only"
+# ключ session.info: в сессии была запись, дальше читаем только с основной базы
+WROTE = "wrote"
+# ключ session.info у сессии только для чтения: сессия запроса (get_db), после записи в ней читаем с основной базы
+WRITER = "writer"
+
+
+class RoutingSession(Session):
+    """
+    Сессия, выбирающая движок на каждый запрос.
+    SELECT уходит на реплику, если сессия только для чтения или запрос помечен REPLICA_OK.
+    Запись, SELECT ... FOR UPDATE и текстовые запросы идут на основную базу. После первой
+    записи сессия "прилипает" к основной базе (read-your-writes): реплика могла еще не получить изменения.
+    """
+
+    def __init__(self, primary: AsyncEngine, replica: AsyncEngine | None = None, **kwargs):
+        super().__init__(**kwargs)
+        self.engines = (primary, replica)
+        self.primary = primary.sync_engine
+        self.replica = (replica or primary).sync_engine
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or not isinstance(clause, Select) or clause._for_update_arg is not None:
+            self.info[WROTE] = True
+            return self.primary
+        if not self.wrote() and (self.info.get(READ_ONLY) or clause.get_execution_options().get(REPLICA_OK)):
+            return self.replica
+        return self.primary
+
+    def wrote(self) -> bool:
+        """Была ли запись в этой сессии или в сессии запроса, к которой привязана сессия только для чтения"""
+        writer = self.info.get(WRITER)
+        return bool(self.info.get(WROTE) or (writer is not None and writer.info.get(WROTE)))
+
+
+def routing_sessionmaker(primary: AsyncEngine, replica: AsyncEngine | None = None) -> sessionmaker:
+    return sessionmaker(class_=AsyncSession, sync_session_class=RoutingSession,
+                        primary=primary, replica=replica, expire_on_commit=False)
+
+
+engine = create_async_engine(DATABASE_URL, **engine_options())
+# реплика для чтения; без TG_DB_REPLICA_URL все запросы идут в основную базу
+replica_engine = create_async_engine(s.TG_DB_REPLICA_URL, **engine_options()) if s.TG_DB_REPLICA_URL else None
+AsyncSessionLocal = routing_sessionmaker(engine, replica_engine)
 
 
 async def get_db() -> AsyncSessionLocal:
@@ -31,3 +117,47 @@ async def get_db() -> AsyncSessionLocal:
             raise
         finally:
             await db.close()
+
+
+def read_only_session(writer: AsyncSession | None = None) -> AsyncSession:
+    """
+    Отдельная сессия, все SELECT которой идут на реплику.
+    :param writer: сессия запроса: новая сессия берет ее базы, а после записи в ней тоже читает
+        с основной базы (read-your-writes)
+    """
+    if writer is None:
+        return AsyncSessionLocal(info={READ_ONLY: True})
+    info = {READ_ONLY: True, WRITER: writer.sync_session}
+    if isinstance(writer.sync_session, RoutingSession):
+        return routing_sessionmaker(*writer.sync_session.engines)(info=info)
+    # обычная сессия (тесты подменяют get_db): та же база, реплики нет
+    return AsyncSession(bind=writer.bind, expire_on_commit=False, info=info)
+
+
+async def get_read_db(db: AsyncSession = Depends(get_db)) -> AsyncIterator[AsyncSession]:
+    """
+    Сессия для чтения с реплики (история, списки). Своя, а не общая сессия get_db:
+    авторизация и проверки перед записью в том же запросе по-прежнему читают с основной базы.
+    """
+    async with read_only_session(db) as read_db:
+        yield read_db
+
+
+def get_session_factory() -> sessionmaker:
+    """
+    Фабрика сессий для долгоживущих соединений (веб-сокетов).
+    В отличие от get_db не держит сессию на все время запроса: сессия открывается на одно действие.
+    """
+    return AsyncSessionLocal
+
+
+@asynccontextmanager
+async def session_scope(session_factory: sessionmaker = AsyncSessionLocal) -> AsyncIterator[AsyncSession]:
+    """Короткая сессия на одно действие: коммит при успехе, откат при ошибке, соединение сразу возвращается в пул"""
+    async with session_factory() as db:
+        try:
+            yield db
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import List, Optional
 
 from pydantic import BaseModel, ConfigDict
@@ -30,8 +31,15 @@ class MessageDTO(BaseModel):
 
 
 class MessageHistoryDTO(BaseModel):
-    messages: List[MessageDTO]
-    total: int
+    messages: List[MessageDTO]  # от новых к старым
+    total: Optional[int] = None  # общее число сообщений чата (с кешем), если запрошено with_total
+    next_cursor: Optional[str] = None  # передать в before, чтобы получить более старые сообщения
+    prev_cursor: Optional[str] = None  # передать в after, чтобы получить более новые сообщения
+
+
+class UnreadDTO(BaseModel):
+    unread: int  # сколько чужих сообщений новее водяного знака
+    read_until: Optional[datetime] = None  # водяной знак прочтения участника
 
 
 class ChatCreateDTO(BaseModel):
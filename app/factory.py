@@ -3,9 +3,17 @@ from contextlib import asynccontextmanager
 
 from starlette.middleware.cors import CORSMiddleware
 
+from app.auth.revocation import revocation_index
+from app.auth.sweeper import token_sweeper
 from app.database import engine
 from app.models.base import Base
 from app.routes import user, websocket, chat
+from app.services.archive import message_archiver
+from app.services.ingest import message_ingest
+from app.services.membership import membership_cache
+from app.services.partitions import partition_manager
+from app.services.receipts import receipt_aggregator
+from app.services.websocket import connection_manager
 
 
 def create_app() -> FastAPI:
@@ -13,7 +21,21 @@ def create_app() -> FastAPI:
     async def lifespan(app: FastAPI):
         async with engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
+        await connection_manager.start()
+        await revocation_index.start()
+        await membership_cache.start()
+        token_sweeper.start()
+        partition_manager.start()
+        message_archiver.start()
         yield
+        await message_archiver.stop()
+        await partition_manager.stop()
+        await token_sweeper.stop()
+        await message_ingest.stop()  # дописываем накопленные сообщения до закрытия пула
+        await receipt_aggregator.stop()  # и рассылаем накопленные уведомления о прочтении
+        await connection_manager.stop()
+        await revocation_index.stop()
+        await membership_cache.stop()
         await engine.dispose()
 
     app = FastAPI(lifespan=lifespan)
@@ -3,10 +3,15 @@ from datetime import UTC, datetime
 from uuid import UUID
 
 from fastapi import HTTPException
-from sqlalchemy import func, select
-from starlette import status
+from sqlalchemy import func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert
 
+from app.config import settings
 from app.models.models import Chat, GroupMember, Message, MessageRead, User
+from app.services.ingest import message_ingest
+from app.services.membership import membership_cache
+from app.services.receipts import receipt_aggregator
+from app.services.watermarks import advance
 from app.services.websocket import connection_manager as cm
 from app.tools import validate_uuid
 
@@ -17,55 +22,67 @@ async def send_message(websocket, session, user: User, data: dict, chat: Chat):
     message_text = data.get("text")
     message_uuid = validate_uuid(data.get("message_id"))
     if not message_text or not message_uuid:
-        await cm.send_message({"error": "🛑 Требуются поля text и uuid"}, recipient_id=user.id)
+        await cm.send_to_user({"error": "🛑 Требуются поля text и uuid"}, user.id, chat_id=chat.id)
         return
-    try:
-        message = Message(
-            id=message_uuid,
-            chat_id=chat.id,
-            sender_id=user.id,
-            text=message_text,
-            timestamp=datetime.now(UTC),
-            is_read=False
-        )
-        session.add(message)
-        await session.commit()  # Явно фиксируем изменения
-        logger.info(f"✅✅ {message.id=} SAVE")
-    except HTTPException as e:
-        logger.error(f"HTTPException {e=}")
-        if e.status_code == status.HTTP_409_CONFLICT:
-            await cm.send_message({"error": "Сообщение уже существует", "message_id": data.get("message_id")}, recipient_id=user.id)
+    message = Message(
+        id=message_uuid,
+        chat_id=chat.id,
+        sender_id=user.id,
+        text=message_text,
+        timestamp=datetime.now(UTC),
+        is_read=False,
+        read_count=0
+    )
+    # запись идет пакетом вместе с сообщениями других сокетов, ответ - только после коммита пакета
+    result = await message_ingest.submit(message_values(message))
+    if not result.created:
+        # повторная отправка (клиент не дождался ответа): подтверждаем исходным сообщением, ничего не пишем
+        stored = Message(**result.values) if result.values else None
+        if stored is None or stored.chat_id != chat.id or stored.sender_id != user.id:
+            await cm.send_to_user({"error": "Сообщение уже существует", "message_id": data.get("message_id")}, user.id,
+                                  chat_id=chat.id)
             return
-        raise
-    except Exception as e:
-        logger.error(f"🛑 Exception {e=}")
-        await session.rollback()  # Откат при других ошибках
-        raise
+        logger.info(f"✅✅ {stored.id=} уже сохранено, повтор")
+        await cm.send_to_user(message_event(stored), user.id, chat_id=chat.id)
+        return
+    logger.info(f"✅✅ {message.id=} SAVE")
     try:
         logger.info(f"▶️▶️ {message.id=} Отправляем")
-        data = message.to_dict()
-        del data["id"]
-        data["message_id"] = str(message.id)
-        await cm.send_message(data, chat.id)
+        await cm.send_message(message_event(message), chat.id)
         logger.info(f"✅✅ {message.id=} Отправлено!")
     except Exception as e:
         logger.error(f"🛑 connection_manager {e=}")
-        await session.rollback()  # Откат, если отправка провалилась
         raise
 
 
+def message_event(message: Message) -> dict:
+    """Сообщение в том виде, в каком оно уходит в сокеты"""
+    data = message.to_dict()
+    del data["id"]
+    data["message_id"] = str(message.id)
+    return data
+
+
+def message_values(message: Message) -> dict:
+    """Значения колонок сообщения для пакетного INSERT"""
+    return {column.key: getattr(message, column.key) for column in Message.__table__.columns}
+
+
 async def read_message(websocket, session, user: User, data: dict, chat: Chat) -> bool | None:
     message_id = validate_uuid(data.get("message_id"))
     if not message_id:
-        await cm.send_message({"error": "Требуется поле message_id", "message_id": data.get("message_id")}, chat.id, recipient_id=user.id)
+        await cm.send_to_user({"error": "Требуется поле message_id", "message_id": data.get("message_id")}, user.id,
+                              chat_id=chat.id)
         return False
     try:
         message = await Message.first(id=message_id, session=session)
         if not message:
-            await cm.send_message({"error": "Сообщение не найдено", "message_id": data.get("message_id")}, chat.id)
+            await cm.send_to_user({"error": "Сообщение не найдено", "message_id": data.get("message_id")}, user.id,
+                                  chat_id=chat.id)
             return False
         if message.chat_id != chat.id:
-            await cm.send_message({"error": "Сообщение не принадлежит этому чату", "message_id": data.get("message_id")})
+            await cm.send_to_user({"error": "Сообщение не принадлежит этому чату", "message_id": data.get("message_id")},
+                                  user.id, chat_id=chat.id)
             return False
         if not chat.is_group:
             return await read_in_person_chat(session, user, message, chat.id)
@@ -78,71 +95,180 @@ async def read_message(websocket, session, user: User, data: dict, chat: Chat) -
         return False
 
 
+async def read_messages(websocket, session, user: User, data: dict, chat: Chat) -> bool:
+    """
+    Отметка о прочтении пачки сообщений: {"action": "messages_read", "message_ids": [...]}.
+    Все отметки пишутся одним запросом, водяной знак читателя сдвигается до самого нового из них.
+    В ответ - одно событие messages_read на каждого отправителя
+    (и одно read_by_all на все сообщения группы, которые этим стали прочитанными всеми).
+    """
+    raw_ids = data.get("message_ids")
+    if not isinstance(raw_ids, list) or not raw_ids or len(raw_ids) > settings.TG_WS_READ_BATCH_MAX:
+        await cm.send_to_user({"error": f"Требуется список message_ids (до {settings.TG_WS_READ_BATCH_MAX})"},
+                              user.id, chat_id=chat.id)
+        return False
+    try:
+        message_ids = {UUID(str(message_id)) for message_id in raw_ids}
+    except ValueError:
+        await cm.send_to_user({"error": "Некорректный message_id", "message_ids": raw_ids}, user.id, chat_id=chat.id)
+        return False
+
+    # чужие сообщения этого чата из списка; остальные id молча пропускаются
+    readable = (Message.id.in_(message_ids), Message.chat_id == chat.id, Message.sender_id != user.id)
+    try:
+        if not chat.is_group:
+            result = await session.execute(
+                update(Message)
+                .where(*readable, Message.is_read.is_not(True))
+                .values(is_read=True)
+                .returning(Message.id, Message.sender_id, Message.timestamp)
+            )
+        else:
+            inserted = (
+                insert(MessageRead)
+                .from_select(["message_id", "user_id", "read_at"],
+                             select(Message.id, literal(user.id, MessageRead.user_id.type), func.now())
+                             .where(*readable))
+                .on_conflict_do_nothing(index_elements=[MessageRead.message_id, MessageRead.user_id])
+                .returning(MessageRead.message_id)
+                .cte("inserted")
+            )
+            result = await session.execute(
+                update(Message)
+                .where(Message.id == inserted.c.message_id)
+                .values(read_count=Message.read_count + 1)
+                .returning(Message.id, Message.sender_id, Message.timestamp)
+            )
+        rows = result.all()
+        if rows:
+            advanced = await advance(chat.id, user.id, max(row.timestamp for row in rows), session,
+                                     read_by_all=chat.is_group)
+        await session.commit()
+    except Exception as e:
+        logger.error(f"🛑 read_messages save {e=}")
+        await session.rollback()
+        raise
+    if not rows:
+        return False
+
+    by_sender: dict[UUID, list[str]] = {}
+    for row in rows:
+        by_sender.setdefault(row.sender_id, []).append(str(row.id))
+    for sender_id, ids in by_sender.items():
+        event = {
+            "action": "messages_read",
+            "chat_id": str(chat.id),
+            "read_by_user_id": str(user.id),
+            "message_ids": ids
+        }
+        if chat.is_group:
+            await cm.send_to_user(event, sender_id)
+        else:
+            await cm.send_message(event, chat.id)
+            await cm.send_to_user(event, sender_id, exclude_chat_id=chat.id)
+
+    if advanced.read_by_all:
+        await cm.send_message({
+            "action": "messages_read",
+            "chat_id": str(chat.id),
+            "message_ids": [str(row.id) for row in advanced.read_by_all],
+            "read_by_all": True
+        }, chat.id)
+    return True
+
+
+async def mark_read_until(websocket, session, user: User, data: dict, chat: Chat) -> bool:
+    """
+    Прочитано все до сообщения message_id включительно.
+    Двигает водяной знак участника (group_members.last_read_at) только вперед, одним UPDATE,
+    и рассылает одно событие read_until вместо отметки на каждое сообщение.
+    В группе сообщения, которые этим сдвигом прочитали все, уходят как read_by_all
+    (статус в истории считается по тем же водяным знакам).
+    """
+    message_id = validate_uuid(data.get("message_id"))
+    if not message_id:
+        await cm.send_to_user({"error": "Требуется поле message_id", "message_id": data.get("message_id")}, user.id,
+                              chat_id=chat.id)
+        return False
+    message = await Message.first(id=message_id, session=session)
+    if not message or message.chat_id != chat.id:
+        await cm.send_to_user({"error": "Сообщение не найдено", "message_id": data.get("message_id")}, user.id,
+                              chat_id=chat.id)
+        return False
+    try:
+        advanced = await advance(chat.id, user.id, message.timestamp, session, read_by_all=chat.is_group)
+        await session.commit()
+    except Exception as e:
+        logger.error(f"🛑 mark_read_until save {e=}")
+        await session.rollback()
+        raise
+    read_until = advanced.read_until
+    if read_until is None:  # водяной знак уже дальше
+        return False
+
+    event = {
+        "action": "read_until",
+        "chat_id": str(chat.id),
+        "message_id": str(message.id),
+        "read_until": read_until.isoformat(),
+        "read_by_user_id": str(user.id)
+    }
+    await cm.send_message(event, chat.id)
+    if not chat.is_group:
+        # собеседник узнает о прочтении, даже если этот чат у него сейчас не открыт
+        membership = await membership_cache.get(chat.id, session)
+        for member_id in (membership.members - {user.id}) if membership else ():
+            await cm.send_to_user(event, member_id, exclude_chat_id=chat.id)
+    for row in advanced.read_by_all:
+        receipt_aggregator.add(chat.id, row.id, row.sender_id)
+    return True
+
+
 async def read_in_person_chat(session, user: User, message: Message, chat_id: UUID):
     if message.sender_id != user.id and not message.is_read:
         message.is_read = True
         try:
             await message.save(session=session, update_fields=["is_read"])
+            await advance(chat_id, user.id, message.timestamp, session, read_by_all=False)
             await session.commit()
         except Exception as e:
             logger.error(f"🛑 read_in_person_chat save {e=}")
             await session.rollback()
             raise
 
-        try:
-            await cm.send_message(
-                {
-                    "action": "message_read",
-                    "message_id": str(message.id),
-                    "chat_id": str(chat_id),
-                    "read_by_user_id": str(user.id)
-                },
-                chat_id
-            )
-        except Exception as e:
-            logger.error(f"🛑 read_in_person_chat {e=}")
-            await session.rollback()
-            raise
+        # событие уйдет вместе с остальными отметками этого читателя за окно склейки
+        receipt_aggregator.add(chat_id, message.id, message.sender_id, read_by_user_id=user.id)
 
 
 async def read_in_group_chat(session, user: User, message: Message, chat: Chat):
-    existing_read = await MessageRead.first(
-        session=session,
-        message_id=message.id,
-        user_id=user.id
-    )
-    if not existing_read and message.sender_id != user.id:
-        try:
-            obj = MessageRead(
-                message_id=message.id,
-                user_id=user.id
-            )
-            session.add(obj)
-            await session.commit()
-        except Exception as e:
-            logger.error(f"🛑 read_in_group_chat save {e=}")
-            await session.rollback()
-            raise
+    """
+    Отметка о прочтении в группе. Запись в message_reads, счетчик messages.read_count
+    и водяной знак читателя меняются в одной транзакции. "Прочитали все" считается по водяным знакам,
+    как статус в истории: событие read_by_all уходит и для более ранних сообщений, которые этим дочитаны всеми.
+    """
+    if message.sender_id == user.id:
+        return
+    try:
+        inserted = await session.scalar(
+            insert(MessageRead)
+            .values(message_id=message.id, user_id=user.id, read_at=datetime.now(UTC))
+            # без ключа (message_id, user_id) запрос падает, а не пишет повторную отметку
+            .on_conflict_do_nothing(index_elements=[MessageRead.message_id, MessageRead.user_id])
+            .returning(MessageRead.message_id)
+        )
+        if inserted is None:  # уже прочитано этим пользователем
+            return
+        await session.execute(
+            update(Message)
+            .where(Message.id == message.id, Message.timestamp == message.timestamp)  # timestamp - одна секция
+            .values(read_count=Message.read_count + 1)
+        )
+        advanced = await advance(chat.id, user.id, message.timestamp, session)
+        await session.commit()
+    except Exception as e:
+        logger.error(f"🛑 read_in_group_chat save {e=}")
+        await session.rollback()
+        raise
 
-        try:
-            read_count = await session.scalar(
-                select(func.count()).select_from(MessageRead).where(MessageRead.message_id == message.id)
-            )
-            members = await GroupMember.list(chat_id=chat.id, session=session)
-            member_count = len([m for m in members if m.user_id != message.sender_id])
-            if read_count >= member_count:
-                await cm.send_message(
-                    {
-                        "action": "message_read",
-                        "message_id": str(message.id),
-                        "chat_id": str(chat.id),
-                        "read_by_all": True
-                    },
-                    chat.id
-                )
-            else:
-                logger.error(f"🛑 read_count < member_count")
-        except Exception as e:
-            logger.error(f"🛑 read_in_person_chat save {e=}")
-            await session.rollback()
-            raise
+    for row in advanced.read_by_all:
+        receipt_aggregator.add(chat.id, row.id, row.sender_id)
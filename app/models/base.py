@@ -38,36 +38,40 @@ class Base(AsyncAttrs, DeclarativeBase):
 
     @classmethod
     async def first(cls,
-                    session: Optional[AsyncSession] = None, **kwargs) -> Self:
+                    session: Optional[AsyncSession] = None, replica_ok: bool = False, **kwargs) -> Self:
         """
         Возвращает первый объект, соответствующий фильтру, или None.
+        replica_ok=True - можно читать с реплики (только если задержка репликации не важна).
         Пример: await User.first(email="alice@example.com")
         """
-        result = await session.execute(select(cls).filter_by(**kwargs))
+        result = await session.execute(select(cls).filter_by(**kwargs).execution_options(replica_ok=replica_ok))
         return result.scalar_one_or_none()
 
     @classmethod
-    async def list_rows(cls, session: Optional[AsyncSession] = None, **kwargs) -> List[dict]:
+    async def list_rows(cls, session: Optional[AsyncSession] = None, replica_ok: bool = False,
+                        **kwargs) -> List[dict]:
         """
         Возвращает список словарей напрямую из базы данных, соответствующих фильтру.
+        replica_ok=True - можно читать с реплики.
         Пример: await User.list_rows(is_active=True)
         """
         # Получаем столбцы из fields
         columns = [getattr(cls, field) for field in cls().fields]
         # Формируем запрос с указанными столбцами
-        query = select(*columns).filter_by(**kwargs)
+        query = select(*columns).filter_by(**kwargs).execution_options(replica_ok=replica_ok)
         result = await session.execute(query)
         # Преобразуем результат в список словарей
         return [dict(row) for row in result.mappings()]
 
     @classmethod
-    async def list(cls, session: Optional[AsyncSession] = None, **kwargs) -> Sequence[
+    async def list(cls, session: Optional[AsyncSession] = None, replica_ok: bool = False, **kwargs) -> Sequence[
                                                                                  Row[Any] | RowMapping | Any] | Any:
         """
         Возвращает список объектов, соответствующих фильтру.
+        replica_ok=True - можно читать с реплики.
         Пример: await User.list(is_active=True)
         """
-        result = await session.execute(select(cls).filter_by(**kwargs))
+        result = await session.execute(select(cls).filter_by(**kwargs).execution_options(replica_ok=replica_ok))
         return result.scalars().all()
 
     async def delete(self, session: AsyncSession = None):
@@ -1,6 +1,8 @@
+import uuid
 from datetime import UTC, datetime, timedelta
 
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String, Text, Uuid, delete
+from sqlalchemy import (DDL, Boolean, Column, DateTime, ForeignKey, Index, Integer, PrimaryKeyConstraint, String,
+                        Text, Uuid, delete, event, text)
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import relationship
 
@@ -37,6 +39,15 @@ class IssuedJWTToken(Base):
     revoked = Column(Boolean, default=False)
     expired_time = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC) + timedelta(hours=1))
 
+    __table_args__ = (
+        # выход с устройства и обновление токенов: WHERE user_id = ? AND device_id = ?
+        Index("ix_tokens_user_id_device_id", "user_id", "device_id"),
+        # check_revoked: WHERE jti = ? AND revoked - в индексе только отозванные токены
+        Index("ix_tokens_revoked_jti", "jti", postgresql_where=text("revoked")),
+        # уборка истекших токенов: WHERE expired_time < ? LIMIT ?
+        Index("ix_tokens_expired_time", "expired_time"),
+    )
+
     @property
     def fields(self):
         return super().fields + ("jti", "user_id", "device_id", "revoked", "expired_time")
@@ -70,6 +81,16 @@ class GroupMember(Base):
     user_id = Column(Uuid, ForeignKey("users.id"), primary_key=True)
     chat_id = Column(Uuid, ForeignKey("chats.id"), primary_key=True)
     is_admin = Column(Boolean, default=False)
+    # участник прочитал все сообщения чата с timestamp <= last_read_at (водяной знак прочтения)
+    last_read_at = Column(DateTime(timezone=True), nullable=True)
+
+    # первичный ключ (user_id, chat_id) покрывает поиск по user_id, для поиска по чату нужен обратный порядок
+    __table_args__ = (
+        # участники чата и проверка участия: WHERE chat_id = ? [AND user_id ...]
+        Index("ix_group_members_chat_id_user_id", "chat_id", "user_id"),
+        # администраторы чата: WHERE chat_id = ? AND is_admin
+        Index("ix_group_members_chat_id_admins", "chat_id", "user_id", postgresql_where=text("is_admin")),
+    )
 
     @property
     def fields(self):
@@ -77,17 +98,34 @@ class GroupMember(Base):
 
 
 class Message(BaseId):
+    """
+    Сообщение чата. Таблица секционирована по месяцам timestamp (RANGE), история читает
+    только свежие секции, а старые отсоединяются целиком (app/services/partitions.py).
+    Уникальный индекс секционированной таблицы обязан включать ключ секционирования,
+    поэтому первичный ключ - (id, timestamp), а уникальность id держит message_keys.
+    """
     __tablename__ = "messages"
-
+    __table_args__ = (
+        # история чата: WHERE chat_id = ? AND (timestamp, id) < (?, ?) ORDER BY timestamp, id
+        Index("ix_messages_chat_id_timestamp_id", "chat_id", "timestamp", "id"),
+        # поиск по id идет по первичному ключу, отдельный индекс по id не нужен
+        PrimaryKeyConstraint("id", "timestamp"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+
+    id = Column(Uuid, primary_key=True, default=uuid.uuid4)
     chat_id = Column(Uuid, ForeignKey("chats.id"))
     sender_id = Column(Uuid, ForeignKey("users.id"))
     text = Column(Text)
-    timestamp = Column(DateTime(timezone=True), default=datetime.now(UTC))
+    timestamp = Column(DateTime(timezone=True), primary_key=True, default=lambda: datetime.now(UTC))
     is_read = Column(Boolean, default=False)
+    # сколько участников прочитали сообщение; увеличивается атомарно вместе с записью в message_reads
+    read_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     chat = relationship("Chat", back_populates="messages")
     sender = relationship("User", back_populates="messages")
-    read_by = relationship("MessageRead", back_populates="message", cascade="all, delete-orphan")
+    read_by = relationship("MessageRead", back_populates="message", cascade="all, delete-orphan",
+                           primaryjoin="Message.id == foreign(MessageRead.message_id)")
 
     @property
     def timestamp_str(self) -> str:
@@ -104,14 +142,52 @@ class Message(BaseId):
         return super().fields + ("chat_id", "sender_id", "text", "timestamp_str", "is_read")
 
 
+class MessageKey(Base):
+    """
+    id всех сообщений: уникальность id в секционированной messages и цель внешних ключей
+    message_reads. Строку добавляет триггер на вставку в messages; вставка сообщения
+    с уже существующим id пропускается (как ON CONFLICT DO NOTHING).
+    """
+    __tablename__ = "message_keys"
+    __table_args__ = (
+        # удаление ключей отсоединенных секций: WHERE timestamp >= ? AND timestamp < ?
+        Index("ix_message_keys_timestamp", "timestamp"),
+    )
+
+    id = Column(Uuid, primary_key=True)
+    chat_id = Column(Uuid, ForeignKey("chats.id", ondelete="CASCADE"))
+    timestamp = Column(DateTime(timezone=True), nullable=False)
+
+
+class MessageArchive(BaseId):
+    """
+    Файл архива: сообщения одного чата, упорядоченные по (timestamp, id), вынесенные из messages
+    (app/services/archive.py). Файлы одного чата не пересекаются по времени.
+    """
+    __tablename__ = "message_archives"
+    __table_args__ = (
+        # архивная история чата: WHERE chat_id = ? AND last_timestamp ... ORDER BY last_timestamp
+        Index("ix_message_archives_chat_id_last_timestamp", "chat_id", "last_timestamp"),
+    )
+
+    chat_id = Column(Uuid, ForeignKey("chats.id", ondelete="CASCADE"), nullable=False)
+    first_timestamp = Column(DateTime(timezone=True), nullable=False)
+    last_timestamp = Column(DateTime(timezone=True), nullable=False)
+    count = Column(Integer, nullable=False)
+    key = Column(String, nullable=False)  # путь файла в хранилище
+    created_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(UTC))
+
+
 class MessageRead(Base):
     __tablename__ = "message_reads"
 
-    message_id = Column(Uuid, ForeignKey("messages.id"), primary_key=True)
+    message_id = Column(Uuid, ForeignKey("message_keys.id", ondelete="CASCADE"), primary_key=True)
     user_id = Column(Uuid, ForeignKey("users.id"), primary_key=True)
     read_at = Column(DateTime(timezone=True), default=datetime.now(UTC))
+    # отдельный индекс по message_id не нужен: первичный ключ (message_id, user_id) начинается с него
 
-    message = relationship("Message", back_populates="read_by")
+    message = relationship("Message", back_populates="read_by",
+                           primaryjoin="foreign(MessageRead.message_id) == Message.id")
     user = relationship("User")
 
     @property
@@ -128,3 +204,23 @@ class MessageRead(Base):
     def fields(self):
         return super().fields + ("message_id", "user_id", "read_at_str")
 
+
+# секция по умолчанию принимает строки, для месяца которых секция еще не создана
+MESSAGES_DEFAULT_PARTITION = DDL("CREATE TABLE IF NOT EXISTS messages_default PARTITION OF messages DEFAULT")
+MESSAGES_CLAIM_KEY_FUNCTION = DDL("""
+CREATE OR REPLACE FUNCTION messages_claim_key() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO message_keys (id, chat_id, timestamp) VALUES (NEW.id, NEW.chat_id, NEW.timestamp)
+    ON CONFLICT (id) DO NOTHING;
+    IF NOT FOUND THEN
+        RETURN NULL;  -- сообщение с таким id уже записано: строка пропускается
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql
+""")
+MESSAGES_CLAIM_KEY_TRIGGER = DDL(
+    "CREATE TRIGGER messages_claim_key BEFORE INSERT ON messages FOR EACH ROW EXECUTE FUNCTION messages_claim_key()"
+)
+for ddl in (MESSAGES_DEFAULT_PARTITION, MESSAGES_CLAIM_KEY_FUNCTION, MESSAGES_CLAIM_KEY_TRIGGER):
+    event.listen(Message.__table__, "after_create", ddl.execute_if(dialect="postgresql"))
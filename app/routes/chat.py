@@ -1,14 +1,19 @@
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException, Response, status
-from sqlalchemy import delete, func, select
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy import delete, func, select, tuple_
 from sqlalchemy.exc import IntegrityError
 
 from app.auth.auth import get_current_user
-from app.database import AsyncSessionLocal, get_db
-from app.dto import ChatCreateDTO, ChatDTO, MemberAddDTO, MembersIdsDTO, MessageHistoryDTO
-from app.models.models import Chat, GroupMember, Message, User
-from app.tools import validate_uuid
+from app.config import settings
+from app.database import AsyncSessionLocal, get_db, get_read_db
+from app.dto import ChatCreateDTO, ChatDTO, MemberAddDTO, MembersIdsDTO, MessageHistoryDTO, UnreadDTO
+from app.models.models import Chat, GroupMember, Message, MessageArchive, User
+from app.services.archive import message_archiver
+from app.services.cache import TTLCache
+from app.services.membership import membership_cache
+from app.services.watermarks import read_floor
+from app.tools import decode_cursor, encode_cursor, validate_uuid
 
 router = APIRouter(tags=["chat"])
 
@@ -72,6 +77,7 @@ async def router_delete_chat(
                             detail="Только создатель может удалить групповой чат")
 
     await chat.delete(session=session)  # удаляются и сообщения чата
+    await membership_cache.invalidate(chat.id)
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
@@ -105,6 +111,8 @@ async def router_add_member(
     except IntegrityError:
         await session.rollback()
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Пользователь уже в чате")
+    finally:
+        await membership_cache.invalidate(chat.id)
     return chat.to_dict()
 
 
@@ -134,6 +142,7 @@ async def router_add_member(
 
     session.add(GroupMember(user_id=new_member.id, chat_id=chat.id))
     await session.commit()
+    await membership_cache.invalidate(chat.id)
     return chat.to_dict()
 
 
@@ -211,48 +220,126 @@ async def remove_chat_members(
         )
     )
     await session.commit()
+    await membership_cache.invalidate(chat.id)
     return removed_members
 
 
-@router.post("/chat/{chat_id}/history/",
-             response_model=MessageHistoryDTO)
-async def router_history(
+@router.get("/chat/{chat_id}/unread/",
+            response_model=UnreadDTO)
+async def router_unread(
         chat_id: str,
-        limit: int = 10,
-        offset: int = 0,
         user: User = Depends(get_current_user),
-        session=Depends(get_db)
+        session=Depends(get_read_db)
 ) -> dict:
+    """
+    Число непрочитанных сообщений чата. Считается по водяному знаку участника
+    (последнее mark_read_until), а не по отметкам на каждое сообщение.
+    Читается с реплики: счетчик может на мгновение отстать от только что отправленной отметки.
+    """
     chat_id = validate_uuid(chat_id)
-    result = await session.execute(
-        select(Message)
-        .filter(Message.chat_id == chat_id)
-        .order_by(Message.timestamp.asc())
-        .offset(offset)
-        .limit(limit)
+    chat = await Chat.get_or_404(id=chat_id, session=session)
+    await is_user_in_chat(user, chat, session, replica_ok=True)
+    read_until = await session.scalar(
+        select(GroupMember.last_read_at).where(GroupMember.chat_id == chat_id, GroupMember.user_id == user.id)
     )
-    messages = result.scalars().all()
+    stmt = select(func.count()).select_from(Message).where(Message.chat_id == chat_id, Message.sender_id != user.id)
+    if read_until is not None:
+        stmt = stmt.where(Message.timestamp > read_until)
+    return {"unread": await session.scalar(stmt), "read_until": read_until}
 
-    # Получаем общее количество сообщений
-    count_result = await session.execute(
-        select(func.count()).select_from(Message).filter(Message.chat_id == chat_id)
-    )
-    total = count_result.scalar_one()
 
+@router.post("/chat/{chat_id}/history/",
+             response_model=MessageHistoryDTO)
+async def router_history(
+        chat_id: str,
+        limit: int = Query(10, ge=1, le=settings.TG_HISTORY_MAX_LIMIT),
+        before: str | None = None,
+        after: str | None = None,
+        with_total: bool = True,
+        user: User = Depends(get_current_user),
+        session=Depends(get_read_db)
+) -> dict:
+    """
+    История чата от новых сообщений к старым, постранично по курсору.
+    Без курсора - самые новые сообщения. before=next_cursor - страница более старых,
+    after=prev_cursor - страница более новых. Страница выбирается по индексу
+    (chat_id, timestamp, id), поэтому любая страница стоит столько же, сколько первая.
+    Сообщения, вынесенные в архив (app/services/archive.py), читаются из его файлов.
+    is_read - сообщение прочитали все получатели: отметкой или водяным знаком mark_read_until.
+    :param with_total: вернуть общее число сообщений чата (считается не чаще раза в TG_HISTORY_TOTAL_TTL)
+    """
+    chat_id = validate_uuid(chat_id)
+    if before and after:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Нужно указать только один курсор: before или after")
+    key = tuple_(Message.timestamp, Message.id)
+    stmt = select(Message).filter(Message.chat_id == chat_id)
+    if after:
+        cursor = decode_cursor(after)
+        # более новые: идем по индексу вперед от курсора, потом разворачиваем
+        stmt = stmt.filter(key > tuple_(*cursor)).order_by(Message.timestamp.asc(), Message.id.asc())
+    else:
+        cursor = decode_cursor(before) if before else None
+        if cursor:
+            stmt = stmt.filter(key < tuple_(*cursor))
+        stmt = stmt.order_by(Message.timestamp.desc(), Message.id.desc())
+    # лишняя строка - признак следующей страницы
+    messages = list((await session.execute(stmt.limit(limit + 1))).scalars().all())
+    # Граница между базой и архивом - самое старое сообщение, которое вернула база (или курсор):
+    # из архива берутся только сообщения старше нее. Перенос в архив идет от старых сообщений к новым
+    # и удаляет строки в той же транзакции, где появляется файл, поэтому сообщение, перенесенное
+    # между двумя чтениями, не попадет на страницу дважды и не пропадет.
+    if after:
+        # курсор в архивной части истории: сначала более новые архивные сообщения (все они старше messages)
+        boundary = (messages[0].timestamp, messages[0].id) if messages else None
+        archived = await message_archiver.read(session, chat_id, after=cursor, before=boundary, limit=limit + 1)
+        messages = (archived + messages)[:limit + 1]
+    elif len(messages) <= limit:
+        # сообщения в базе кончились: продолжаем из архива
+        boundary = (messages[-1].timestamp, messages[-1].id) if messages else cursor
+        messages += await message_archiver.read(session, chat_id, before=boundary, limit=limit + 1 - len(messages))
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if after:
+        messages.reverse()
+
+    # прочитано ли сообщение, считается и по водяным знакам участников (mark_read_until)
+    floor = await read_floor(chat_id, session)
+    older_exist = has_more if not after else bool(messages)
+    newer_exist = has_more if after else bool(before)
     return {
-        "messages": [message.to_dict() for message in messages],
-        "total": total
+        "messages": [message.to_dict() | {"is_read": bool(message.is_read) or floor.read_by_all(message)}
+                     for message in messages],
+        "total": await chat_total(chat_id, session) if with_total else None,
+        "next_cursor": encode_cursor(messages[-1].timestamp, messages[-1].id) if messages and older_exist else None,
+        "prev_cursor": encode_cursor(messages[0].timestamp, messages[0].id) if messages and newer_exist else None,
     }
 
 
-async def is_user_in_chat(user: User, chat: Chat, session) -> List[GroupMember]:
-    members = await GroupMember.list(session=session, chat_id=chat.id)
-    member_ids = [member.user_id for member in members]
-    if user.id not in member_ids:
+history_totals = TTLCache(ttl=settings.TG_HISTORY_TOTAL_TTL)  # chat_id -> число сообщений
+
+
+async def chat_total(chat_id, session) -> int:
+    """Общее число сообщений чата. count(*) по большому чату дорогой, поэтому результат кешируется."""
+    if (total := history_totals.get(chat_id)) is not None:
+        return total
+    total = await session.scalar(select(func.count()).select_from(Message).filter(Message.chat_id == chat_id))
+    archived = await session.scalar(select(func.sum(MessageArchive.count)).filter(MessageArchive.chat_id == chat_id))
+    total += archived or 0
+    history_totals.set(chat_id, total)
+    return total
+
+
+async def is_user_in_chat(user: User, chat: Chat, session, replica_ok: bool = False) -> List[GroupMember]:
+    """
+    Проверить, что пользователь - участник чата, и вернуть участников (состав берется из кеша).
+    :param replica_ok: состав можно загрузить с реплики (роуты только для чтения)
+    """
+    membership = await membership_cache.get(chat.id, session, replica_ok=replica_ok)
+    if membership is None or user.id not in membership.members:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Вы не участник этого чата")
-    return members
+    return membership.group_members()
 
 
 async def user_is_admin_chat(user: User, chat: Chat, session) -> bool:
-    admins = await GroupMember.list(session=session, is_admin=True, chat_id=chat.id)
-    return user.id in [a.user_id for a in admins]
\ No newline at end of file
+    return await membership_cache.is_admin(chat.id, user.id, session)
\ No newline at end of file
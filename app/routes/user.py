@@ -11,11 +11,12 @@ from starlette.exceptions import HTTPException
 from starlette.responses import Response
 
 from app.auth.auth import get_current_user, get_current_user_and_device
+from app.auth.cache import token_cache
 from app.config import settings
 from app.auth.init import get_auth_service
 from app.auth.service import AuthService
 from app.auth.token import del_tokens, get_token, set_tokens
-from app.database import AsyncSessionLocal, get_db
+from app.database import AsyncSessionLocal, get_db, get_read_db
 from app.dto import RTokenDTO, TokensDTO, UserDTO, UserPwdDTO
 from app.models.models import User
 from app.tools import validate_uuid
@@ -108,9 +109,9 @@ async def route_token_refresh(response: Response,
             tags=USER_ROUTES)
 async def route_get_user(response: Response,
                          admin: User = Depends(get_current_user),
-                         session=Depends(get_db)) -> list[dict]:
+                         session=Depends(get_read_db)) -> list[dict]:
     """Получение данных пользователя. Без токена авторизации."""
-    users_data = await User.list_rows(session=session)
+    users_data = await User.list_rows(session=session, replica_ok=True)
     response.status_code = 200
     return users_data
 
@@ -156,6 +157,7 @@ async def route_edit_user(response: Response,
     user = await User.get_or_404(id=item_id, session=session)
     user.username = user_data.username
     await user.save(update_fields=["username"], session=session)
+    token_cache.invalidate_user(item_id)
     response.status_code = 200
     return user.to_dict()
 
@@ -170,5 +172,6 @@ async def route_delete_user(response: Response,
     item_id = validate_uuid(item_id)
     user = await User.get_or_404(id=item_id, session=session)
     await user.delete(session=session)
+    token_cache.invalidate_user(item_id)
     response.status_code = 200
     return response
@@ -2,15 +2,16 @@ import logging
 import uuid
 
 from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
-from sqlalchemy import join, select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
 from starlette.exceptions import HTTPException
 from starlette.status import HTTP_403_FORBIDDEN, HTTP_404_NOT_FOUND
 
 from app.auth.auth import get_current_ws_user
-from app.database import get_db
-from app.handlers.ws_chat import read_message, send_message
-from app.models.models import Chat, GroupMember, User
+from app.database import get_session_factory, session_scope
+from app.handlers.ws_chat import mark_read_until, read_message, read_messages, send_message
+from app.models.models import Chat, User
+from app.services.membership import membership_cache
 from app.services.websocket import connection_manager
 from app.tools import validate_uuid
 
@@ -24,11 +25,16 @@ async def websocket_chat(
         websocket: WebSocket,
         chat_id: str,
         user: User = Depends(get_current_ws_user),
-        session: AsyncSession = Depends(get_db)
+        session_factory: sessionmaker = Depends(get_session_factory)
 ):
+    """
+    Сокет одного чата. Сессия БД не держится все время жизни сокета:
+    каждое действие выполняется в своей короткой сессии, простаивающий сокет соединений с базой не занимает.
+    """
     chat_id = validate_uuid(chat_id)
     try:
-        chat = await get_chat_with_membership_check(chat_id, user.id, session)
+        async with session_scope(session_factory) as session:
+            chat = await get_chat_with_membership_check(chat_id, user.id, session)
     except HTTPException:
         logger.error(f"🛑 Сообщение из другого чата")
         await websocket.close(code=1008)
@@ -42,51 +48,107 @@ async def websocket_chat(
             if data.get("chat_id") != str(chat_id):
                 logger.warning(f"🛑 Сообщение из другого чата")
                 continue
+            await handle_action(websocket, session_factory, user, data, chat)
+
+    except WebSocketDisconnect as ex:
+        logger.error(f"🛑 WebSocket disconnected for user {user.id} in chat {chat_id} {ex=}")
+    except Exception as e:
+        logger.error(f"🛑 Unexpected error in WebSocket: {e}")
+    finally:
+        # Снимаем соединение с рассылки и останавливаем его задачу-писателя
+        connection_manager.disconnect(websocket)
+
+
+@router.websocket("/ws")
+async def websocket_multiplexed(
+        websocket: WebSocket,
+        user: User = Depends(get_current_ws_user),
+        session_factory: sessionmaker = Depends(get_session_factory)
+):
+    """
+    Один сокет на клиента для всех чатов.
+    Клиент подписывается на чаты действием {"action": "subscribe", "chat_id": ...}
+    (членство проверяется на каждую подписку) и отписывается {"action": "unsubscribe", "chat_id": ...}.
+    Остальные действия те же, что и в /ws/{chat_id}, чат определяется по полю chat_id.
+    """
+    await connection_manager.register(websocket, user.id)
+    chats: dict[uuid.UUID, Chat] = {}  # чаты, на которые подписан сокет
+    try:
+        while True:
+            data = await websocket.receive_json()
+            logger.info(str(data) + f" ⬇️ принято {user.id=}")
             try:
-                match data.get("action"):
-                    case "send_message":
-                        await send_message(websocket, session, user, data, chat)
-                    case "message_read":
-                        await read_message(websocket, session, user, data, chat)
-            except WebSocketDisconnect as ex:
-                logger.error(f"🛑 Unexpected error in WebSocket: {ex=}")
-                raise
-            except Exception as ex:
-                logger.error(f"🛑 Unexpected error in WebSocket: {ex=}")
+                chat_id = validate_uuid(data.get("chat_id"), er_msg="Некорректный chat_id")
+            except HTTPException as ex:
+                await connection_manager.send_to_socket({"error": ex.detail, "chat_id": data.get("chat_id")}, websocket)
                 continue
+            match data.get("action"):
+                case "subscribe":
+                    try:
+                        async with session_scope(session_factory) as session:
+                            chat = await get_chat_with_membership_check(chat_id, user.id, session)
+                    except HTTPException as ex:
+                        await connection_manager.send_to_socket({"error": ex.detail, "chat_id": str(chat_id)}, websocket)
+                        continue
+                    chats[chat.id] = chat
+                    await connection_manager.subscribe(websocket, chat.id)
+                    await connection_manager.send_to_socket({"action": "subscribed", "chat_id": str(chat.id)}, websocket)
+                case "unsubscribe":
+                    chats.pop(chat_id, None)
+                    connection_manager.unsubscribe(websocket, chat_id)
+                    await connection_manager.send_to_socket({"action": "unsubscribed", "chat_id": str(chat_id)}, websocket)
+                case _:
+                    if not (chat := chats.get(chat_id)):
+                        await connection_manager.send_to_socket(
+                            {"error": "Нет подписки на этот чат", "chat_id": data.get("chat_id")}, websocket)
+                        continue
+                    await handle_action(websocket, session_factory, user, data, chat)
 
     except WebSocketDisconnect as ex:
-        logger.error(f"🛑 WebSocket disconnected for user {user.id} in chat {chat_id} {ex=}")
-        connection_manager.disconnect(websocket, chat_id, user.id)
+        logger.error(f"🛑 WebSocket disconnected for user {user.id} {ex=}")
     except Exception as e:
         logger.error(f"🛑 Unexpected error in WebSocket: {e}")
-        connection_manager.disconnect(websocket, chat_id, user.id)
     finally:
-        # Убедимся, что сессия закрывается корректно
-        await session.commit()  # Завершаем транзакцию, если есть незавершённые изменения
-        await session.close()
+        connection_manager.disconnect(websocket)
+
+
+async def handle_action(websocket: WebSocket,
+                        session_factory: sessionmaker,
+                        user: User,
+                        data: dict,
+                        chat: Chat):
+    """
+    Выполнить действие клиента в чате в отдельной короткой сессии.
+    Ошибки действия не рвут соединение.
+    """
+    try:
+        async with session_scope(session_factory) as session:
+            match data.get("action"):
+                case "send_message":
+                    await send_message(websocket, session, user, data, chat)
+                case "message_read":
+                    await read_message(websocket, session, user, data, chat)
+                case "messages_read":
+                    await read_messages(websocket, session, user, data, chat)
+                case "mark_read_until":
+                    await mark_read_until(websocket, session, user, data, chat)
+    except WebSocketDisconnect as ex:
+        logger.error(f"🛑 Unexpected error in WebSocket: {ex=}")
+        raise
+    except Exception as ex:
+        logger.error(f"🛑 Unexpected error in WebSocket: {ex=}")
 
 
 async def get_chat_with_membership_check(chat_id: uuid.UUID,
                                          user_id: uuid.UUID,
                                          session: AsyncSession) -> Chat:
     """
-    Получает чат и проверяет, является ли пользователь участником, одним запросом.
+    Получает чат и проверяет, является ли пользователь участником.
+    Состав чата берется из кеша, в базу идем только при промахе - одним запросом.
     """
-    stmt = (
-        select(Chat)
-        .select_from(join(Chat, GroupMember, Chat.id == GroupMember.chat_id))
-        .where(Chat.id == chat_id)
-        .where(GroupMember.user_id == user_id)
-    )
-    result = await session.execute(stmt)
-    chat: Chat = result.scalars().first()
-
-    if not chat:
-        # Проверяем, существует ли чат вообще
-        stmt_exists = select(Chat).where(Chat.id == chat_id)
-        result_exists = await session.execute(stmt_exists)
-        if not result_exists.scalars().first():
-            raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Чат не найден")
+    membership = await membership_cache.get(chat_id, session)
+    if membership is None:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Чат не найден")
+    if user_id not in membership.members:
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="Вы не участник этого чата")
-    return chat
+    return membership.chat()
@@ -0,0 +1,277 @@
+"""
+Архив старых сообщений.
+
+Сообщения старше TG_ARCHIVE_AFTER_DAYS дней выносятся из messages в сжатые файлы
+по TG_ARCHIVE_CHUNK_SIZE сообщений одного чата: на локальный диск (TG_ARCHIVE_PATH)
+или в S3-совместимое хранилище. Файл хранит колонки отдельными списками (id, sender_id, text, ...)
+и сжат gzip: повторяющиеся chat_id и sender_id почти ничего не занимают.
+Индекс файлов - таблица message_archives (chat_id, диапазон времени). История чата
+(router_history) читает из архива, когда курсор уходит дальше самых старых сообщений в базе.
+
+Ключи сообщений (message_keys) и отметки о прочтении остаются в базе: id архивных сообщений
+не могут быть заняты заново.
+
+Сообщения чата переносятся от старых к новым, а строки удаляются в той транзакции, где появляется
+файл: в любой момент архив - это самые старые сообщения чата, база - все более новые. Проход, перенесший
+все до cutoff, запоминает его (archived_until), и следующие проходы не просматривают старые секции.
+Сообщения, записанные задним числом старше archived_until, подхватятся после перезапуска процесса.
+"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from typing import List
+from uuid import UUID, uuid4
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models.models import Message, MessageArchive
+from app.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("id", "chat_id", "sender_id", "text", "timestamp", "is_read", "read_count")
+UUID_COLUMNS = ("id", "chat_id", "sender_id")
+FORMAT_VERSION = 1
+
+
+def encode_chunk(rows: List[dict]) -> bytes:
+    """Строки messages (по возрастанию (timestamp, id)) в сжатый файл по колонкам"""
+    columns = {name: [row[name] for row in rows] for name in COLUMNS}
+    for name in UUID_COLUMNS:
+        columns[name] = [str(value) if value is not None else None for value in columns[name]]
+    columns["timestamp"] = [value.isoformat() for value in columns["timestamp"]]
+    raw = json.dumps({"version": FORMAT_VERSION, "columns": columns}, ensure_ascii=False)
+    return gzip.compress(raw.encode())
+
+
+def decode_chunk(data: bytes) -> List[dict]:
+    """Файл encode_chunk обратно в строки"""
+    columns = json.loads(gzip.decompress(data))["columns"]
+    for name in UUID_COLUMNS:
+        columns[name] = [UUID(value) if value is not None else None for value in columns[name]]
+    columns["timestamp"] = [datetime.fromisoformat(value) for value in columns["timestamp"]]
+    return [dict(zip(COLUMNS, values)) for values in zip(*(columns[name] for name in COLUMNS))]
+
+
+class ArchiveStore:
+    """Хранилище файлов архива по ключу"""
+
+    async def put(self, key: str, data: bytes):
+        raise NotImplementedError
+
+    async def get(self, key: str) -> bytes:
+        raise NotImplementedError
+
+
+class LocalArchiveStore(ArchiveStore):
+    """Файлы в каталоге на диске"""
+
+    def __init__(self, root: str | Path) -> None:
+        self.root = Path(root)
+
+    async def put(self, key: str, data: bytes):
+        await asyncio.to_thread(self._write, self.root / key, data)
+
+    async def get(self, key: str) -> bytes:
+        return await asyncio.to_thread((self.root / key).read_bytes)
+
+    @staticmethod
+    def _write(path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)  # файл появляется целиком или не появляется
+
+
+class S3ArchiveStore(ArchiveStore):
+    """
+    S3-совместимое хранилище (AWS S3, MinIO). Нужен пакет boto3, ключи доступа -
+    обычные переменные окружения AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY.
+    """
+
+    def __init__(self, bucket: str, endpoint_url: str = "", prefix: str = "") -> None:
+        import boto3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url or None)
+
+    async def put(self, key: str, data: bytes):
+        await asyncio.to_thread(self.client.put_object, Bucket=self.bucket, Key=self.prefix + key, Body=data)
+
+    async def get(self, key: str) -> bytes:
+        def read() -> bytes:
+            return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)["Body"].read()
+        return await asyncio.to_thread(read)
+
+
+def create_archive_store() -> ArchiveStore:
+    """Хранилище по настройкам TG_ARCHIVE_STORE"""
+    if settings.TG_ARCHIVE_STORE.lower() == "s3":
+        return S3ArchiveStore(settings.TG_ARCHIVE_S3_BUCKET, settings.TG_ARCHIVE_S3_ENDPOINT,
+                              settings.TG_ARCHIVE_S3_PREFIX)
+    return LocalArchiveStore(settings.TG_ARCHIVE_PATH)
+
+
+class MessageArchiver:
+    """
+    Перенос старых сообщений в архив и чтение архивной истории.
+    start() запускает задачу из lifespan приложения, archive() - один проход (для тестов и ручного запуска).
+    """
+
+    def __init__(self,
+                 session_factory: sessionmaker = AsyncSessionLocal,
+                 store: ArchiveStore | None = None,
+                 after_days: int = settings.TG_ARCHIVE_AFTER_DAYS,
+                 chunk_size: int = settings.TG_ARCHIVE_CHUNK_SIZE,
+                 max_chunks: int = settings.TG_ARCHIVE_MAX_CHUNKS,
+                 interval: float = settings.TG_ARCHIVE_INTERVAL,
+                 cache_size: int = settings.TG_ARCHIVE_CACHE_SIZE):
+        self.session_factory = session_factory
+        self.store = store or create_archive_store()
+        self.after_days = after_days
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.interval = interval
+        # файлы не меняются: распакованные строки можно держать, пока их читают
+        self._chunks = TTLCache(maxsize=cache_size, ttl=3600)
+        self._task: asyncio.Task | None = None
+        # все сообщения старше уже в архиве: следующий проход не просматривает эти секции messages
+        self.archived_until: datetime | None = None
+
+    def start(self):
+        if self.after_days > 0 and self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def archive(self, now: datetime | None = None) -> int:
+        """
+        Один проход: перенести в архив сообщения старше after_days, не больше max_chunks файлов.
+        :return: сколько сообщений перенесено
+        """
+        cutoff = (now or datetime.now(UTC)) - timedelta(days=self.after_days)
+        stmt = select(Message.chat_id).where(Message.timestamp < cutoff)
+        if self.archived_until is not None:
+            # просматриваются только секции между прошлым и нынешним cutoff, уже перенесенные - нет
+            stmt = stmt.where(Message.timestamp >= self.archived_until)
+        async with self.session_factory() as session:
+            chat_ids = list(await session.scalars(stmt.distinct()))
+        archived = chunks = 0
+        complete = True  # все чаты перенесены до cutoff целиком
+        for chat_id in chat_ids:
+            while True:
+                if chunks >= self.max_chunks:
+                    complete = False
+                    break
+                count = await self._archive_chunk(chat_id, cutoff)
+                if count is None:  # чат переносит другой воркер
+                    complete = False
+                    break
+                archived += count
+                chunks += 1 if count else 0
+                if count < self.chunk_size:
+                    break
+                await asyncio.sleep(0)  # между файлами отдаем цикл событий запросам
+        if complete:
+            self.archived_until = max(cutoff, self.archived_until or cutoff)
+        if archived:
+            logger.info(f"✅✅ archive: перенесено {archived} сообщений в {chunks} файлов")
+        return archived
+
+    async def read(self,
+                   session: AsyncSession,
+                   chat_id: UUID,
+                   before: tuple[datetime, UUID] | None = None,
+                   after: tuple[datetime, UUID] | None = None,
+                   limit: int = 10) -> List[Message]:
+        """
+        Архивная история чата, как страница router_history.
+        before - сообщения старше ключа (timestamp, id), от новых к старым (без курсоров - самые новые из архива);
+        after - новее ключа, от старых к новым (вместе с before - между ключами).
+        :return: несохраняемые объекты Message
+        """
+        stmt = select(MessageArchive.key).where(MessageArchive.chat_id == chat_id)
+        if before:
+            stmt = stmt.where(MessageArchive.first_timestamp <= before[0])
+        if after:
+            stmt = stmt.where(MessageArchive.last_timestamp >= after[0]).order_by(MessageArchive.last_timestamp.asc())
+        else:
+            stmt = stmt.order_by(MessageArchive.last_timestamp.desc())
+        # в каждом файле есть хотя бы одно сообщение, плюс файл на границе курсора
+        keys = await session.scalars(stmt.limit(limit + 1).execution_options(replica_ok=True))
+        rows = []
+        for key in keys:
+            chunk = await self._load(key)
+            for row in (chunk if after else reversed(chunk)):
+                position = (row["timestamp"], row["id"])
+                if (after and position <= after) or (before and position >= before):
+                    continue
+                rows.append(row)
+                if len(rows) == limit:
+                    return [Message(**row) for row in rows]
+        return [Message(**row) for row in rows]
+
+    async def _run(self):
+        while True:
+            try:
+                await self.archive()
+            except Exception as e:
+                logger.error(f"🛑 archive {e=}")
+            await asyncio.sleep(self.interval)
+
+    async def _load(self, key: str) -> List[dict]:
+        if (chunk := self._chunks.get(key)) is None:
+            chunk = decode_chunk(await self.store.get(key))
+            self._chunks.set(key, chunk)
+        return chunk
+
+    async def _archive_chunk(self, chat_id: UUID, cutoff: datetime) -> int | None:
+        """
+        Один файл: самые старые сообщения чата до cutoff. Файл пишется до коммита: если транзакция
+        не пройдет, останется лишний файл, на который ничего не ссылается, но сообщения не потеряются.
+        :return: сколько сообщений перенесено; None - чат сейчас переносит другой воркер
+        """
+        async with self.session_factory() as session:
+            # чат обрабатывает один воркер, остальные его пропускают
+            if not await session.scalar(text("SELECT pg_try_advisory_xact_lock(hashtext(:key))"),
+                                        {"key": f"messages_archive:{chat_id}"}):
+                return None
+            result = await session.execute(
+                select(*Message.__table__.columns)
+                .where(Message.chat_id == chat_id, Message.timestamp < cutoff)
+                .order_by(Message.timestamp.asc(), Message.id.asc())
+                .limit(self.chunk_size)
+            )
+            rows = [dict(row) for row in result.mappings()]
+            if not rows:
+                return 0
+            first, last = rows[0]["timestamp"], rows[-1]["timestamp"]
+            key = f"{chat_id}/{first:%Y%m%dT%H%M%S%f}-{uuid4().hex}.json.gz"
+            await self.store.put(key, encode_chunk(rows))
+            session.add(MessageArchive(chat_id=chat_id, first_timestamp=first, last_timestamp=last,
+                                       count=len(rows), key=key))
+            await session.execute(
+                delete(Message).where(Message.id.in_([row["id"] for row in rows]),
+                                      Message.timestamp >= first, Message.timestamp <= last)  # только нужные секции
+            )
+            await session.commit()
+        return len(rows)
+
+
+message_archiver = MessageArchiver()
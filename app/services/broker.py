@@ -0,0 +1,358 @@
+"""
+Брокер сообщений между процессами (воркерами uvicorn, контейнерами).
+
+ConnectionManager рассылает сообщение своим сокетам сам, а через брокер публикует его
+в канал чата. Каждый процесс подписан только на каналы чатов, для которых у него есть
+локальные сокеты, и доставляет полученные сообщения своим соединениям.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Set
+from urllib.parse import unquote, urlparse
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[str, str], Awaitable[None]]
+
+
+class Broker:
+    """Базовый брокер: публикация строк в каналы и подписка на каналы"""
+    # публикации получают другие процессы; False - процесс один и публиковать некому
+    shared = True
+
+    def __init__(self) -> None:
+        self.channels: Set[str] = set()  # каналы, на которые подписан процесс
+        self._handler: Handler | None = None
+
+    def set_handler(self, handler: Handler):
+        """Обработчик сообщений из подписанных каналов: handler(channel, data)"""
+        self._handler = handler
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, channel: str, data: str):
+        raise NotImplementedError
+
+    async def subscribe(self, channel: str):
+        raise NotImplementedError
+
+    async def unsubscribe(self, channel: str):
+        raise NotImplementedError
+
+    async def _dispatch(self, channel: str, data: str):
+        if self._handler is None or channel not in self.channels:
+            return
+        try:
+            await self._handler(channel, data)
+        except Exception as e:
+            logger.error(f"🛑 broker handler {channel=} {e=}")
+
+
+class InProcessBroker(Broker):
+    """
+    Брокер в памяти процесса. Для одного процесса публиковать некому, поэтому
+    по умолчанию у каждого брокера своя шина. Брокеры с общей шиной (bus)
+    обмениваются сообщениями как разные процессы - удобно для тестов.
+    """
+
+    def __init__(self, bus: Dict[str, Set["InProcessBroker"]] | None = None) -> None:
+        super().__init__()
+        self._bus = bus if bus is not None else {}
+        self.shared = bus is not None
+
+    async def publish(self, channel: str, data: str):
+        for broker in list(self._bus.get(channel, ())):
+            if broker is not self:
+                await broker._dispatch(channel, data)
+
+    async def subscribe(self, channel: str):
+        self._bus.setdefault(channel, set()).add(self)
+        self.channels.add(channel)
+
+    async def unsubscribe(self, channel: str):
+        self.channels.discard(channel)
+        if channel in self._bus:
+            self._bus[channel].discard(self)
+            if not self._bus[channel]:
+                del self._bus[channel]
+
+
+class PostgresBroker(Broker):
+    """
+    Брокер на LISTEN/NOTIFY PostgreSQL.
+    LISTEN держит сессию, поэтому подключаться надо к самой базе, а не к pgbouncer в режиме transaction.
+    Размер payload у NOTIFY ограничен 8000 байт, более длинные сообщения другим процессам не уходят.
+    Оборванное соединение LISTEN переоткрывается с подпиской на все каналы процесса.
+    """
+    MAX_PAYLOAD = 7999
+    RECONNECT_DELAY = 1.0
+    PING_INTERVAL = 5.0  # как часто проверять соединение LISTEN, секунды
+
+    def __init__(self, dsn: str) -> None:
+        super().__init__()
+        self.dsn = dsn
+        self._listen_conn = None
+        self._pool = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._watcher: asyncio.Task | None = None
+        self._lost = asyncio.Event()
+
+    async def start(self):
+        import asyncpg
+        self._listen_conn = await self._open_listener()
+        self._pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=4)
+        self._watcher = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+        for task in self._tasks:
+            task.cancel()
+        if self._listen_conn is not None:
+            await self._listen_conn.close()
+            self._listen_conn = None
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+        self.channels.clear()
+        self._lost.clear()
+
+    async def publish(self, channel: str, data: str):
+        if len(data.encode()) > self.MAX_PAYLOAD:
+            logger.error(f"🛑 {channel=} сообщение больше {self.MAX_PAYLOAD} байт, NOTIFY невозможен")
+            return
+        await self._pool.execute("SELECT pg_notify($1, $2)", channel, data)
+
+    async def subscribe(self, channel: str):
+        # канал запоминается до LISTEN: если соединение оборвано, его подпишет переподключение
+        self.channels.add(channel)
+        if self._listen_conn is not None:
+            await self._listen_conn.add_listener(channel, self._on_notify)
+
+    async def unsubscribe(self, channel: str):
+        self.channels.discard(channel)
+        if self._listen_conn is not None:
+            await self._listen_conn.remove_listener(channel, self._on_notify)
+
+    async def _open_listener(self):
+        """Соединение для LISTEN, подписанное на все каналы процесса"""
+        import asyncpg
+        conn = await asyncpg.connect(self.dsn)
+        try:
+            # каналы, добавленные, пока шли LISTEN, тоже подписываются
+            listening: Set[str] = set()
+            while pending := self.channels - listening:
+                for channel in pending:
+                    await conn.add_listener(channel, self._on_notify)
+                    listening.add(channel)
+        except BaseException:
+            conn.terminate()
+            raise
+        conn.add_termination_listener(self._on_terminate)
+        return conn
+
+    async def _watch(self):
+        """
+        Следит за соединением LISTEN: обрыв замечает asyncpg (termination listener)
+        или периодический запрос. Потерянное соединение открывается заново и подписывается на все каналы,
+        уведомления за время обрыва не восстанавливаются.
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self._lost.wait(), timeout=self.PING_INTERVAL)
+            except asyncio.TimeoutError:
+                try:
+                    await asyncio.wait_for(self._listen_conn.execute("SELECT 1"), timeout=self.PING_INTERVAL)
+                    continue
+                except Exception as e:
+                    logger.warning(f"🛑 postgres listen: соединение не отвечает {e=}")
+            else:
+                logger.warning(f"🛑 postgres listen: соединение потеряно")
+            await self._reconnect_listener()
+
+    async def _reconnect_listener(self):
+        conn, self._listen_conn = self._listen_conn, None
+        if conn is not None:
+            conn.remove_termination_listener(self._on_terminate)
+            conn.terminate()
+        while True:
+            await asyncio.sleep(self.RECONNECT_DELAY)
+            self._lost.clear()
+            try:
+                self._listen_conn = await self._open_listener()
+                return
+            except Exception as e:
+                logger.warning(f"🛑 postgres listen: не удалось переподключиться {e=}")
+
+    def _on_terminate(self, connection):
+        if connection is self._listen_conn:
+            self._listen_conn = None  # подписки до переподключения только запоминаются
+            self._lost.set()
+
+    def _on_notify(self, connection, pid: int, channel: str, payload: str):
+        task = asyncio.create_task(self._dispatch(channel, payload))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+class RedisBroker(Broker):
+    """
+    Брокер на Redis Pub/Sub. Свой минимальный клиент протокола RESP поверх asyncio,
+    поэтому подойдет любой сервер, понимающий PUBLISH/SUBSCRIBE (Redis, Valkey, KeyDB, тестовая заглушка).
+    Одно соединение для публикации, второе - в режиме подписки.
+    """
+    RECONNECT_DELAY = 1.0
+
+    def __init__(self, url: str) -> None:
+        super().__init__()
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self._pub: tuple[asyncio.StreamReader, asyncio.StreamWriter] | None = None
+        self._sub: tuple[asyncio.StreamReader, asyncio.StreamWriter] | None = None
+        self._pub_lock = asyncio.Lock()
+        self._listener: asyncio.Task | None = None
+
+    async def start(self):
+        self._pub = await self._open()
+        self._sub = await self._open()
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        for conn in (self._pub, self._sub):
+            if conn is not None:
+                conn[1].close()
+        self._pub = self._sub = None
+        self.channels.clear()
+
+    async def publish(self, channel: str, data: str):
+        async with self._pub_lock:
+            try:
+                await self._command(self._pub, "PUBLISH", channel, data)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                logger.warning(f"🛑 redis publish: соединение потеряно, переподключаемся")
+                self._pub = await self._open()
+                await self._command(self._pub, "PUBLISH", channel, data)
+
+    async def subscribe(self, channel: str):
+        self.channels.add(channel)
+        await self._send(self._sub[1], "SUBSCRIBE", channel)
+
+    async def unsubscribe(self, channel: str):
+        self.channels.discard(channel)
+        await self._send(self._sub[1], "UNSUBSCRIBE", channel)
+
+    async def _open(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        conn = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            try:
+                await self._command(conn, "AUTH", self.password)
+            except BaseException:
+                conn[1].close()
+                raise
+        return conn
+
+    async def _listen(self):
+        """
+        Читает сообщения из соединения подписки, при обрыве переподключается и подписывается заново.
+        Ответ-ошибка (например, -LOADING после рестарта Redis: SUBSCRIBE не выполнен) и неразборчивый
+        ответ тоже ведут к переподключению, а не к тихой остановке задачи и потере подписок.
+        """
+        while True:
+            try:
+                reply = await read_reply(self._sub[0])
+                if isinstance(reply, RedisError):
+                    raise reply
+            except (ConnectionError, asyncio.IncompleteReadError, RedisError) as e:
+                logger.warning(f"🛑 redis subscribe: соединение потеряно {e=}")
+                await self._reconnect_subscriber()
+                continue
+            except Exception as e:  # неразборчивый ответ: где в потоке следующий - неизвестно
+                logger.error(f"🛑 redis subscribe {e=}")
+                await self._reconnect_subscriber()
+                continue
+            if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                await self._dispatch(reply[1].decode(), reply[2].decode())
+
+    async def _reconnect_subscriber(self):
+        if self._sub is not None:
+            self._sub[1].close()
+        while True:
+            await asyncio.sleep(self.RECONNECT_DELAY)
+            try:
+                self._sub = await self._open()
+                if self.channels:
+                    await self._send(self._sub[1], "SUBSCRIBE", *self.channels)
+                return
+            except (OSError, asyncio.IncompleteReadError, RedisError) as e:
+                logger.warning(f"🛑 redis: не удалось переподключиться {e=}")
+
+    @staticmethod
+    async def _send(writer: asyncio.StreamWriter, *args: str):
+        writer.write(encode_command(*args))
+        await writer.drain()
+
+    async def _command(self, conn: tuple[asyncio.StreamReader, asyncio.StreamWriter], *args: str):
+        await self._send(conn[1], *args)
+        reply = await read_reply(conn[0])
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+
+class RedisError(Exception):
+    pass
+
+
+def encode_command(*args: str) -> bytes:
+    """Команда в формате RESP: массив bulk-строк"""
+    parts = [f"*{len(args)}\r\n".encode()]
+    for arg in args:
+        data = arg.encode() if isinstance(arg, str) else arg
+        parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(parts)
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    """Прочитать один ответ RESP"""
+    line = await reader.readuntil(b"\r\n")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest
+    if kind == b"-":
+        return RedisError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        size = int(rest)
+        if size < 0:
+            return None
+        data = await reader.readexactly(size + 2)
+        return data[:-2]
+    if kind == b"*":
+        size = int(rest)
+        if size < 0:
+            return None
+        return [await read_reply(reader) for _ in range(size)]
+    raise ConnectionError(f"Некорректный ответ RESP: {line!r}")
+
+
+def create_broker() -> Broker:
+    """Брокер по настройкам TG_BROKER / TG_BROKER_URL"""
+    kind = settings.TG_BROKER.lower()
+    if kind == "redis":
+        return RedisBroker(settings.TG_BROKER_URL or "redis://localhost:6379")
+    if kind == "postgres":
+        return PostgresBroker(settings.TG_BROKER_URL or settings.database_url.replace("+asyncpg", ""))
+    return InProcessBroker()
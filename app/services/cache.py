@@ -0,0 +1,55 @@
+"""Небольшой кеш в памяти процесса: время жизни записей (TTL) плюс вытеснение давно не использованных (LRU)"""
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Кеш с ограничением по размеру и времени жизни записей.
+    Не потокобезопасен - рассчитан на один event loop.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 30.0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        """:param ttl: время жизни этой записи, если короче обычного"""
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Удалить запись (явная инвалидация)"""
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def items(self) -> list[tuple[Hashable, Any]]:
+        """Живые записи, без продления их в LRU"""
+        now = time.monotonic()
+        return [(key, value) for key, (expires_at, value) in self._data.items() if expires_at >= now]
+
+    def clear(self):
+        self._data.clear()
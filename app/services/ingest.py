@@ -0,0 +1,146 @@
+"""
+Пакетная запись сообщений чата (group commit).
+
+Сообщения из всех сокетов копятся несколько миллисекунд и пишутся одним
+многострочным INSERT в одной транзакции; повторы id пропускает триггер messages_claim_key
+(аналог ON CONFLICT DO NOTHING для секционированной таблицы). Отправитель
+ждет, пока его пакет закоммитится, и только потом получает подтверждение.
+Так база платит одну транзакцию и один сброс WAL на пакет, а не на каждое сообщение.
+Если пакет не записался из-за данных (например, чат удален, пока сокет был открыт), пакет делится
+пополам, пока плохие строки не останутся поодиночке: ошибку получают только их отправители.
+Если недоступна сама база, ошибку сразу получают все отправители пакета.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Set, Tuple
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import sessionmaker
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models.models import Message
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class IngestResult:
+    """Итог записи сообщения"""
+    created: bool  # False - сообщение с таким id уже было записано раньше (повторная отправка)
+    values: dict  # колонки записанного сообщения, для повтора - исходного
+
+
+class MessageIngest:
+    """
+    Очередь записи сообщений.
+    submit() ставит строку в текущий пакет и ждет его коммита. Пакет пишется,
+    когда прошло max_delay секунд с первого сообщения в нем или набралось max_batch сообщений.
+    """
+
+    def __init__(self,
+                 session_factory: sessionmaker = AsyncSessionLocal,
+                 max_delay: float = settings.TG_INGEST_MAX_DELAY,
+                 max_batch: int = settings.TG_INGEST_MAX_BATCH):
+        self.session_factory = session_factory
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._batch: List[Tuple[dict, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._flushes: Set[asyncio.Task] = set()
+
+    async def submit(self, values: dict) -> IngestResult:
+        """
+        Записать сообщение в составе ближайшего пакета.
+        Повторная отправка с тем же id ничего не пишет и не обрывает транзакцию,
+        а возвращает исходное сообщение.
+        :param values: значения колонок messages, обязательно с id
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._batch.append((values, future))
+        if len(self._batch) >= self.max_batch:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self.flush)
+        return await future
+
+    def flush(self):
+        """Отправить накопленный пакет на запись, не дожидаясь ее"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        task = asyncio.create_task(self._flush(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def stop(self):
+        """Дописать все, что накопилось (при остановке приложения)"""
+        self.flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    async def _flush(self, batch: List[Tuple[dict, asyncio.Future]]):
+        try:
+            inserted, existing = await self._write([values for values, _ in batch])
+        except (IntegrityError, DataError) as e:
+            if len(batch) == 1:
+                self._fail(batch, e)
+                return
+            # ошибка в данных одной из строк: делим пакет пополам, пока плохие строки не останутся поодиночке
+            logger.warning(f"🛑 ingest: пакет из {len(batch)} сообщений не записан {e=}, делим пополам")
+            middle = len(batch) // 2
+            await self._flush(batch[:middle])
+            await self._flush(batch[middle:])
+            return
+        except Exception as e:
+            # база недоступна, таймаут пула: повторы только задержат ответ всем отправителям
+            self._fail(batch, e)
+            return
+        logger.info(f"✅✅ ingest: пакет {len(batch)} сообщений, записано {len(inserted)}")
+        written: Dict[UUID, dict] = {}  # строки, вставленные этим пакетом
+        for values, future in batch:
+            message_id = values["id"]
+            if message_id in inserted and message_id not in written:
+                written[message_id] = values
+                result = IngestResult(created=True, values=values)
+            else:  # повтор id: раньше или в этом же пакете (записана только первая строка)
+                result = IngestResult(created=False, values=written.get(message_id) or existing.get(message_id))
+            if not future.done():  # отправитель мог отключиться, пока ждал
+                future.set_result(result)
+
+    @staticmethod
+    def _fail(batch: List[Tuple[dict, asyncio.Future]], e: Exception):
+        logger.error(f"🛑 ingest: {len(batch)} сообщений не записано {e=}")
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+
+    async def _write(self, rows: List[dict]) -> Tuple[Set[UUID], Dict[UUID, dict]]:
+        """
+        Один INSERT на пакет в одной транзакции.
+        :return: id реально вставленных строк и уже существовавшие строки для повторов
+        """
+        # ON CONFLICT (id) у секционированной messages невозможен: уникален только (id, timestamp).
+        # Строку с уже записанным id пропускает триггер messages_claim_key, в RETURNING ее нет
+        stmt = insert(Message).values(rows).returning(Message.id)
+        async with self.session_factory() as session:
+            result = await session.execute(stmt)
+            inserted = set(result.scalars().all())
+            existing = {}
+            if repeated := {row["id"] for row in rows} - inserted:
+                # повторы редки: дочитываем исходные сообщения тем же соединением, без отката транзакции
+                columns = Message.__table__.columns
+                result = await session.execute(select(*columns).where(Message.id.in_(repeated)))
+                existing = {row["id"]: dict(row) for row in result.mappings()}
+            await session.commit()
+        return inserted, existing
+
+
+message_ingest = MessageIngest()
@@ -0,0 +1,137 @@
+"""
+Кеш участников чатов для проверок доступа.
+
+Проверка "пользователь - участник/администратор чата" нужна на каждое подключение
+веб-сокета и почти в каждом роуте чатов. Кеш хранит для чата множество участников
+и множество администраторов, так что повторная проверка - поиск в множестве, а не запрос в базу.
+Записи живут TTL секунд (TG_MEMBERSHIP_CACHE_TTL), редко используемые вытесняются (LRU).
+Роуты, меняющие состав чата, сбрасывают его запись явно, а другим процессам сброс уходит
+через брокер (TG_BROKER), как отзыв токенов. Если брокер не связывает процессы (TG_BROKER=memory)
+или не запустился, соседние воркеры о сбросе не узнают: тогда записи живут не дольше
+TG_MEMBERSHIP_CACHE_LOCAL_TTL секунд - столько удаленный участник может сохранять доступ в другом воркере.
+"""
+import logging
+from dataclasses import dataclass
+from typing import FrozenSet, List
+from uuid import UUID
+
+from sqlalchemy import select
+
+from app.config import settings
+from app.models.models import Chat, GroupMember
+from app.services.broker import Broker, create_broker
+from app.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ChatMembership:
+    """Чат и его состав на момент загрузки"""
+    chat_id: UUID
+    name: str | None
+    is_group: bool
+    members: FrozenSet[UUID]
+    admins: FrozenSet[UUID]
+
+    def chat(self) -> Chat:
+        """Объект чата, не привязанный к сессии (для обработчиков, которым нужны id и is_group)"""
+        return Chat(id=self.chat_id, name=self.name, is_group=self.is_group)
+
+    def group_members(self) -> List[GroupMember]:
+        return [GroupMember(user_id=user_id, chat_id=self.chat_id, is_admin=user_id in self.admins)
+                for user_id in self.members]
+
+
+class MembershipCache:
+    CHANNEL = "membership:invalidate"
+
+    def __init__(self,
+                 maxsize: int = settings.TG_MEMBERSHIP_CACHE_SIZE,
+                 ttl: float = settings.TG_MEMBERSHIP_CACHE_TTL,
+                 local_ttl: float = settings.TG_MEMBERSHIP_CACHE_LOCAL_TTL,
+                 broker: Broker | None = None) -> None:
+        self.broker = broker or create_broker()
+        self.broker.set_handler(self._on_broker_message)
+        self.local_ttl = local_ttl
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl if self.broker.shared else min(ttl, local_ttl))
+        self._invalidations = 0  # счетчик сбросов: загрузка, пересекшаяся со сбросом, в кеш не попадает
+
+    async def start(self):
+        """Подписаться на сбросы других процессов"""
+        try:
+            await self.broker.start()
+            await self.broker.subscribe(self.CHANNEL)
+        except Exception as e:
+            logger.error(f"🛑 membership cache: сбросы других процессов не приходят, TTL {self.local_ttl} с {e=}")
+            self._cache.ttl = min(self._cache.ttl, self.local_ttl)
+
+    async def stop(self):
+        await self.broker.stop()
+
+    async def get(self, chat_id: UUID, session, replica_ok: bool = False) -> ChatMembership | None:
+        """
+        Состав чата из кеша или одним запросом из базы. None - чата нет.
+        :param replica_ok: загрузить с реплики (роуты только для чтения). Реплика могла еще не получить
+            изменение состава, поэтому такая запись живет не дольше local_ttl
+        """
+        if (membership := self._cache.get(chat_id)) is not None:
+            return membership
+        invalidations = self._invalidations
+        membership = await self._load(chat_id, session, replica_ok=replica_ok)
+        if membership is not None and invalidations == self._invalidations:
+            self._cache.set(chat_id, membership, ttl=min(self._cache.ttl, self.local_ttl) if replica_ok else None)
+        return membership
+
+    async def is_member(self, chat_id: UUID, user_id: UUID, session) -> bool:
+        membership = await self.get(chat_id, session)
+        return membership is not None and user_id in membership.members
+
+    async def is_admin(self, chat_id: UUID, user_id: UUID, session) -> bool:
+        membership = await self.get(chat_id, session)
+        return membership is not None and user_id in membership.admins
+
+    async def invalidate(self, chat_id: UUID):
+        """Сбросить запись чата после изменения состава или удаления чата, здесь и в других процессах"""
+        self._drop(chat_id)
+        if not self.broker.shared:
+            return
+        try:
+            await self.broker.publish(self.CHANNEL, str(chat_id))
+        except Exception as e:
+            logger.error(f"🛑 membership publish {chat_id=} {e=}")
+
+    def _drop(self, chat_id: UUID):
+        self._invalidations += 1
+        self._cache.pop(chat_id)
+
+    async def _on_broker_message(self, channel: str, data: str):
+        """Состав чата изменили в другом процессе"""
+        self._drop(UUID(data))
+
+    def clear(self):
+        self._invalidations += 1
+        self._cache.clear()
+
+    @staticmethod
+    async def _load(chat_id: UUID, session, replica_ok: bool = False) -> ChatMembership | None:
+        result = await session.execute(
+            select(Chat.name, Chat.is_group, GroupMember.user_id, GroupMember.is_admin)
+            .select_from(Chat)
+            .outerjoin(GroupMember, GroupMember.chat_id == Chat.id)
+            .where(Chat.id == chat_id)
+            .execution_options(replica_ok=replica_ok)
+        )
+        rows = result.all()
+        if not rows:
+            return None
+        return ChatMembership(
+            chat_id=chat_id,
+            name=rows[0].name,
+            is_group=bool(rows[0].is_group),
+            members=frozenset(row.user_id for row in rows if row.user_id is not None),
+            admins=frozenset(row.user_id for row in rows if row.user_id is not None and row.is_admin),
+        )
+
+
+membership_cache = MembershipCache()
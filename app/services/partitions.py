@@ -0,0 +1,191 @@
+"""
+Обслуживание месячных секций messages.
+
+messages секционирована по timestamp (RANGE), одна секция - один календарный месяц
+(messages_pYYYY_MM). История чата читает последние сообщения и попадает в одну-две
+свежие секции с маленькими индексами. Фоновая задача раз в TG_PARTITIONS_INTERVAL секунд:
+- создает секции на TG_PARTITIONS_AHEAD месяцев вперед, чтобы вставка не уходила в messages_default;
+  если строки месяца уже попали в messages_default, они переносятся в новую секцию;
+- при TG_PARTITIONS_RETENTION > 0 отсоединяет секции старше стольких месяцев: история их больше
+  не видит, а таблица остается как архив; с TG_PARTITIONS_DROP_DETACHED секция удаляется - удаление
+  месяца стоит один DROP TABLE, а не DELETE по миллионам строк.
+В обоих случаях в том же проходе удаляются ключи (message_keys) сообщений отсоединенной секции,
+а с ними каскадом и отметки о прочтении: иначе они остались бы без сообщений. Ключи сообщений,
+перенесенных в архив (app/services/archive.py), в секции уже нет, и они остаются.
+"""
+import asyncio
+import logging
+import re
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from app.config import settings
+from app.database import engine as default_engine
+
+logger = logging.getLogger(__name__)
+
+PARENT = "messages"
+DEFAULT_PARTITION = "messages_default"
+NAME_RE = re.compile(r"^messages_p(\d{4})_(\d{2})$")
+# один воркер обслуживает секции, остальные пропускают проход
+LOCK_KEY = "messages_partitions"
+
+
+def month_start(moment: datetime) -> datetime:
+    """Начало месяца (UTC), в который попадает moment"""
+    moment = moment.astimezone(UTC) if moment.tzinfo else moment.replace(tzinfo=UTC)
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    """Начало месяца, отстоящего от month на months (может быть отрицательным)"""
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1, day=1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"{PARENT}_p{month.year:04d}_{month.month:02d}"
+
+
+def partition_month(name: str) -> datetime | None:
+    """Месяц секции по ее имени; None - не месячная секция (например, messages_default)"""
+    match = NAME_RE.match(name)
+    if not match:
+        return None
+    return datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=UTC)
+
+
+@dataclass
+class PartitionChanges:
+    """Что изменил проход обслуживания"""
+    created: list[str] = field(default_factory=list)
+    moved: int = 0  # строк перенесено из messages_default
+    detached: list[str] = field(default_factory=list)
+    dropped: list[str] = field(default_factory=list)
+
+
+class PartitionManager:
+    """
+    Создание и отсоединение секций messages.
+    start() запускает задачу из lifespan приложения, maintain() - один проход (для тестов и ручного запуска).
+    """
+
+    def __init__(self,
+                 engine: AsyncEngine = default_engine,
+                 months_ahead: int = settings.TG_PARTITIONS_AHEAD,
+                 retention_months: int = settings.TG_PARTITIONS_RETENTION,
+                 drop_detached: bool = settings.TG_PARTITIONS_DROP_DETACHED,
+                 interval: float = settings.TG_PARTITIONS_INTERVAL):
+        self.engine = engine
+        self.months_ahead = months_ahead
+        self.retention_months = retention_months
+        self.drop_detached = drop_detached
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def plan(self, existing: set[datetime], now: datetime) -> tuple[list[datetime], list[datetime]]:
+        """
+        Какие секции создать и какие отсоединить.
+        :param existing: месяцы существующих секций
+        :return: (месяцы для создания, месяцы для отсоединения)
+        """
+        current = month_start(now)
+        wanted = [add_months(current, offset) for offset in range(self.months_ahead + 1)]
+        create = [month for month in wanted if month not in existing]
+        detach = []
+        if self.retention_months > 0:
+            oldest_kept = add_months(current, -self.retention_months)
+            detach = sorted(month for month in existing if month < oldest_kept)
+        return create, detach
+
+    async def maintain(self, now: datetime | None = None) -> PartitionChanges:
+        """Один проход в одной транзакции; если секции обслуживает другой воркер - ничего не делает"""
+        changes = PartitionChanges()
+        async with self.engine.begin() as conn:
+            if not await conn.scalar(text("SELECT pg_try_advisory_xact_lock(hashtext(:key))"), {"key": LOCK_KEY}):
+                return changes
+            existing = {month for name in await self._partitions(conn) if (month := partition_month(name))}
+            create, detach = self.plan(existing, now or datetime.now(UTC))
+            for month in create:
+                changes.moved += await self._create(conn, month)
+                changes.created.append(partition_name(month))
+            for month in detach:
+                await self._detach(conn, month)
+                changes.detached.append(partition_name(month))
+                if self.drop_detached:
+                    changes.dropped.append(partition_name(month))
+        if changes.created or changes.detached:
+            logger.info(f"✅✅ partitions: создано {changes.created} (перенесено строк {changes.moved}), "
+                        f"отсоединено {changes.detached}, удалено {changes.dropped}")
+        return changes
+
+    async def _run(self):
+        while True:
+            try:
+                await self.maintain()
+            except Exception as e:
+                logger.error(f"🛑 partitions {e=}")
+            await asyncio.sleep(self.interval)
+
+    @staticmethod
+    async def _partitions(conn: AsyncConnection) -> list[str]:
+        result = await conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = CAST(:parent AS regclass)"
+        ), {"parent": PARENT})
+        return list(result.scalars())
+
+    @staticmethod
+    async def _create(conn: AsyncConnection, month: datetime) -> int:
+        """
+        Создать секцию месяца.
+        PARTITION OF при строках этого месяца в messages_default завершится ошибкой, поэтому они
+        переносятся: новая таблица заполняется и только потом присоединяется.
+        :return: сколько строк перенесено
+        """
+        name, bounds = partition_name(month), {"lo": month, "hi": add_months(month, 1)}
+        in_range = "timestamp >= :lo AND timestamp < :hi"
+        if not await conn.scalar(text(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE {in_range})"), bounds):
+            await conn.execute(text(
+                f"CREATE TABLE {name} PARTITION OF {PARENT} FOR VALUES FROM ('{bounds['lo'].isoformat()}') "
+                f"TO ('{bounds['hi'].isoformat()}')"
+            ))
+            return 0
+        await conn.execute(text(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        result = await conn.execute(text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE {in_range} RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ), bounds)
+        await conn.execute(text(
+            f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES FROM ('{bounds['lo'].isoformat()}') "
+            f"TO ('{bounds['hi'].isoformat()}')"
+        ))
+        return result.rowcount
+
+    async def _detach(self, conn: AsyncConnection, month: datetime):
+        name = partition_name(month)
+        await conn.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {name}"))
+        # ключи сообщений секции, отметки о прочтении удаляются каскадом
+        await conn.execute(text(f"DELETE FROM message_keys k USING {name} m WHERE k.id = m.id"))
+        if self.drop_detached:
+            await conn.execute(text(f"DROP TABLE {name}"))
+
+
+partition_manager = PartitionManager()
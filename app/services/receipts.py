@@ -0,0 +1,97 @@
+"""
+Склейка уведомлений о прочтении.
+
+При чтении переписки клиент отмечает сообщения по одному, и на каждое уходило
+отдельное событие message_read всему чату. Агрегатор копит отметки короткое
+окно (TG_RECEIPT_FLUSH_INTERVAL) и отправляет одно событие на чат и читателя
+со списком message_ids. Если за окно пришла одна отметка, уходит прежнее
+событие message_read с одним message_id - старые клиенты его понимают.
+"""
+import asyncio
+import logging
+from typing import Dict, List, Set, Tuple
+from uuid import UUID
+
+from app.config import settings
+from app.services.websocket import ConnectionManager, connection_manager
+
+logger = logging.getLogger(__name__)
+
+# (чат, кто прочитал); None вместо читателя - "прочитали все" (read_by_all)
+ReceiptKey = Tuple[UUID, UUID | None]
+
+
+class ReceiptAggregator:
+    """
+    Отложенная рассылка уведомлений о прочтении.
+    Отметки копятся по ключу (чат, читатель) и уходят одним событием, когда прошло
+    flush_interval секунд с первой отметки в окне или по ключу набралось max_batch сообщений.
+    """
+
+    def __init__(self,
+                 manager: ConnectionManager = connection_manager,
+                 flush_interval: float = settings.TG_RECEIPT_FLUSH_INTERVAL,
+                 max_batch: int = settings.TG_RECEIPT_MAX_BATCH):
+        self.manager = manager
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._pending: Dict[ReceiptKey, Tuple[List[str], Set[UUID]]] = {}  # -> (message_ids, отправители)
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def add(self, chat_id: UUID, message_id: UUID, sender_id: UUID, read_by_user_id: UUID | None = None):
+        """
+        Отметить прочтение, событие уйдет не позже чем через flush_interval.
+        :param read_by_user_id: кто прочитал; None - сообщение прочитали все участники
+        """
+        key = (chat_id, read_by_user_id)
+        message_ids, senders = self._pending.setdefault(key, ([], set()))
+        if str(message_id) not in message_ids:
+            message_ids.append(str(message_id))
+        senders.add(sender_id)
+        if len(message_ids) >= self.max_batch:
+            self._spawn(self._send(key, *self._pending.pop(key)))
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        """Отправить все накопленные события, не дожидаясь отправки"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, {}
+        for key, (message_ids, senders) in pending.items():
+            self._spawn(self._send(key, message_ids, senders))
+
+    async def stop(self):
+        self.flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, key: ReceiptKey, message_ids: List[str], senders: Set[UUID]):
+        chat_id, read_by_user_id = key
+        event = {"action": "message_read", "chat_id": str(chat_id)}
+        if len(message_ids) == 1:
+            event["message_id"] = message_ids[0]
+        else:
+            event["action"] = "messages_read"
+            event["message_ids"] = message_ids
+        if read_by_user_id is None:
+            event["read_by_all"] = True
+        else:
+            event["read_by_user_id"] = str(read_by_user_id)
+        try:
+            await self.manager.send_message(event, chat_id)
+            # отправители узнают о прочтении, даже если этот чат у них сейчас не открыт
+            for sender_id in senders:
+                await self.manager.send_to_user(event, sender_id, exclude_chat_id=chat_id)
+        except Exception as e:
+            logger.error(f"🛑 receipts {chat_id=} {e=}")
+
+
+receipt_aggregator = ReceiptAggregator()
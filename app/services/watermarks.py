@@ -0,0 +1,134 @@
+"""
+Статус прочтения по водяным знакам участников (group_members.last_read_at, mark_read_until).
+
+Сообщение прочитано всеми получателями, когда самый отстающий из них (отправитель не в счет)
+дочитал до его timestamp. Для этого хватает двух самых низких водяных знаков чата:
+если самый низкий - у отправителя, решает второй. Так статус любого сообщения чата
+проверяется без загрузки всех участников и без строки на каждое прочтение.
+
+Водяной знак двигают все отметки о прочтении (message_read, messages_read, mark_read_until):
+прочитанное сообщение означает, что прочитано и все до него. Водяные знаки одного чата
+двигаются по очереди (advance блокирует строки участников), поэтому переход "прочитано всеми"
+вычисляется по согласованным значениям и уходит отправителям ровно один раз.
+"""
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from typing import List, Tuple
+from uuid import UUID
+
+from sqlalchemy import and_, false, func, or_, select, true, update
+
+from app.config import settings
+from app.models.models import GroupMember, Message
+
+# получателей нет: все сообщения считаются прочитанными
+EVERYTHING = datetime.max.replace(tzinfo=UTC)
+
+
+@dataclass(frozen=True)
+class ReadFloor:
+    """Два самых низких водяных знака чата: (user_id, last_read_at), None - участник ничего не отметил"""
+    lowest: Tuple[Tuple[UUID, datetime | None], ...]
+
+    def until(self, sender_id: UUID) -> datetime | None:
+        """До какого момента сообщения sender_id прочитаны всеми получателями; None - ни одно"""
+        for user_id, read_at in self.lowest:
+            if user_id != sender_id:
+                return read_at
+        return EVERYTHING
+
+    def read_by_all(self, message) -> bool:
+        until = self.until(message.sender_id)
+        return until is not None and message.timestamp <= until
+
+    def includes(self, user_id: UUID) -> bool:
+        """Может ли продвижение водяного знака user_id изменить статус сообщений"""
+        return any(member_id == user_id for member_id, _ in self.lowest)
+
+    def horizon(self) -> datetime | None:
+        """До какого момента прочитаны всеми хоть чьи-то сообщения (второй снизу водяной знак); None - ничьи"""
+        return self.lowest[1][1] if len(self.lowest) > 1 else EVERYTHING
+
+    def read_by_all_clause(self):
+        """read_by_all в виде условия SQL на messages"""
+        if not self.lowest:
+            return true()
+        (first_id, first_at), *rest = self.lowest
+        second_at = rest[0][1] if rest else EVERYTHING
+        clauses = []
+        if first_at is not None:
+            clauses.append(and_(Message.sender_id.is_distinct_from(first_id), Message.timestamp <= first_at))
+        if second_at is not None:
+            clauses.append(and_(Message.sender_id == first_id, Message.timestamp <= second_at))
+        return or_(false(), *clauses)
+
+
+@dataclass
+class Advance:
+    """Результат advance"""
+    read_until: datetime | None = None  # новый водяной знак; None - он уже был не раньше
+    read_by_all: List = field(default_factory=list)  # (id, sender_id, timestamp) ставших прочитанными всеми
+
+
+async def read_floor(chat_id: UUID, session) -> ReadFloor:
+    result = await session.execute(
+        select(GroupMember.user_id, GroupMember.last_read_at)
+        .where(GroupMember.chat_id == chat_id)
+        .order_by(GroupMember.last_read_at.asc().nulls_first())
+        .limit(2)
+    )
+    return ReadFloor(lowest=tuple((user_id, read_at) for user_id, read_at in result.all()))
+
+
+async def advance(chat_id: UUID,
+                  user_id: UUID,
+                  timestamp: datetime,
+                  session,
+                  read_by_all: bool = True,
+                  limit: int = settings.TG_READ_BY_ALL_MAX) -> Advance:
+    """
+    Сдвинуть водяной знак участника вперед до timestamp. Коммит - за вызывающим:
+    до него строки участников чата остаются заблокированными.
+    :param read_by_all: найти сообщения, которые этим сдвигом стали прочитанными всеми (для групп).
+        Такие сообщения - только между прежним и новым водяным знаком читателя, берутся не больше limit самых новых
+    """
+    if read_by_all:
+        # FOR UPDATE на всех участниках в одном порядке: параллельные сдвиги одного чата идут по очереди
+        await session.execute(select(func.count()).select_from(
+            select(GroupMember.user_id)
+            .where(GroupMember.chat_id == chat_id)
+            .order_by(GroupMember.user_id)
+            .with_for_update()
+            .subquery()
+        ))
+    previous = await session.scalar(
+        select(GroupMember.last_read_at).where(GroupMember.chat_id == chat_id, GroupMember.user_id == user_id)
+    )
+    read_until = await session.scalar(
+        update(GroupMember)
+        .where(GroupMember.chat_id == chat_id,
+               GroupMember.user_id == user_id,
+               or_(GroupMember.last_read_at.is_(None), GroupMember.last_read_at < timestamp))
+        .values(last_read_at=timestamp)
+        .returning(GroupMember.last_read_at)
+    )
+    if read_until is None or not read_by_all:
+        return Advance(read_until=read_until)
+
+    floor = await read_floor(chat_id, session)
+    horizon = floor.horizon()
+    if horizon is None or (previous is not None and horizon <= previous):
+        return Advance(read_until=read_until)
+    stmt = (
+        select(Message.id, Message.sender_id, Message.timestamp)
+        .where(Message.chat_id == chat_id,
+               Message.sender_id.is_distinct_from(user_id),
+               Message.timestamp <= min(read_until, horizon),
+               floor.read_by_all_clause())
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .limit(limit)
+    )
+    if previous is not None:
+        stmt = stmt.where(Message.timestamp > previous)
+    rows = (await session.execute(stmt)).all()
+    return Advance(read_until=read_until, read_by_all=rows[::-1])
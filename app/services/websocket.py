@@ -1,53 +1,378 @@
+import asyncio
+import json
 import logging
-from typing import Dict, Set
-from uuid import UUID
+from collections import deque
+from dataclasses import dataclass, field
+from enum import Enum, unique
+from typing import Deque, Dict, List, Set, Tuple
+from uuid import UUID, uuid4
 
 from fastapi import WebSocket
 
+from app.config import settings
+from app.services.broker import Broker, InProcessBroker, create_broker
+from app.tools import json_dumps
+
 logger = logging.getLogger(__name__)
 
 
+@unique
+class OverflowPolicy(str, Enum):
+    """Что делать, когда очередь исходящих сообщений соединения заполнена"""
+    DROP_OLDEST = 'drop_oldest'  # выбросить самое старое сообщение
+    COALESCE_RECEIPTS = 'coalesce_receipts'  # склеить уведомления о прочтении, если не помогло - drop_oldest
+    DISCONNECT = 'disconnect'  # отключить медленного клиента
+
+
+@dataclass
+class BroadcastResult:
+    """Итог рассылки: сколько сообщений поставлено в очереди и какие сокеты были отключены"""
+    queued: int = 0
+    dropped: List[Tuple[UUID, WebSocket]] = field(default_factory=list)
+
+
+class Connection:
+    """
+    Соединение пользователя: один сокет, подписанный на один или несколько чатов.
+    Исходящие сообщения складываются в ограниченную очередь, в сокет их пишет отдельная задача,
+    поэтому отправитель никогда не ждет чужую сеть, а память на медленного клиента ограничена.
+    В очереди лежат пары (сообщение, уже сериализованный текст): при рассылке текст
+    один на всех получателей, словарь нужен только для склейки уведомлений о прочтении.
+    """
+
+    def __init__(self,
+                 websocket: WebSocket,
+                 user_id: UUID,
+                 manager: "ConnectionManager"):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.chat_ids: Set[UUID] = set()  # чаты, события которых идут в этот сокет
+        self._manager = manager
+        self._queue: Deque[Tuple[dict, str]] = deque()
+        self._ready = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._overflowed = False
+        self.closed = False
+
+    @property
+    def pending(self) -> int:
+        """Сколько сообщений ждут отправки"""
+        return len(self._queue)
+
+    def start(self):
+        self._task = asyncio.create_task(self._writer())
+
+    def stop(self):
+        self.closed = True
+        if self._task and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    def put(self, message: dict, text: str | None = None) -> bool:
+        """
+        Поставить сообщение в очередь, не дожидаясь отправки.
+        :param message: сообщение
+        :param text: сообщение, уже сериализованное json_dumps (чтобы не кодировать его для каждого сокета)
+        :return: False, если соединение закрыто или отключается из-за переполнения
+        """
+        if self.closed or self._overflowed:
+            return False
+        if len(self._queue) >= self._manager.queue_size and not self._make_room():
+            self._overflowed = True
+            self._ready.set()  # writer увидит флаг и отключит клиента
+            return False
+        self._queue.append((message, text if text is not None else json_dumps(message)))
+        self._ready.set()
+        return True
+
+    def _make_room(self) -> bool:
+        policy = self._manager.overflow_policy
+        if policy == OverflowPolicy.DISCONNECT:
+            return False
+        if policy == OverflowPolicy.COALESCE_RECEIPTS:
+            self._coalesce_receipts()
+        if len(self._queue) >= self._manager.queue_size:
+            self._queue.popleft()
+        return True
+
+    def _coalesce_receipts(self):
+        """Склеить уведомления о прочтении одного читателя в одном чате в одно событие messages_read"""
+        merged: Dict[tuple, dict] = {}
+        queue: Deque[Tuple[dict, str]] = deque()
+        for message, text in self._queue:
+            if message.get("action") not in ("message_read", "messages_read"):
+                queue.append((message, text))
+                continue
+            key = (message.get("chat_id"), message.get("read_by_user_id"), message.get("read_by_all"))
+            if key not in merged:
+                merged[key] = {k: v for k, v in message.items() if k not in ("message_id", "message_ids")}
+                merged[key].update(action="messages_read", message_ids=[])
+                queue.append((merged[key], ""))
+            merged[key]["message_ids"].extend(message.get("message_ids", []))
+            if "message_id" in message:
+                merged[key]["message_ids"].append(message["message_id"])
+        # склеенные события сериализуем заново, когда они собраны целиком
+        self._queue = deque((message, text or json_dumps(message)) for message, text in queue)
+
+    async def _writer(self):
+        manager = self._manager
+        while not self.closed:
+            await self._ready.wait()
+            while self._queue and not self._overflowed:
+                _, text = self._queue.popleft()
+                try:
+                    async with manager._semaphore:
+                        await asyncio.wait_for(self.websocket.send_text(text), timeout=manager.send_timeout)
+                except asyncio.TimeoutError:
+                    logger.warning(f"🐢 {self.user_id=} не принял сообщение за {manager.send_timeout} c, отключаем")
+                    await manager._drop(self)
+                    return
+                except Exception as e:
+                    logger.warning(f"🛑 {self.user_id=} ошибка отправки {e=}, отключаем")
+                    await manager._drop(self)
+                    return
+            # очередь могла переполниться и до запуска писателя, и пока он ждал отправки
+            if self._overflowed:
+                logger.warning(f"🐢 {self.user_id=} очередь переполнена, отключаем")
+                await manager._drop(self)
+                return
+            self._ready.clear()
+
+
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self,
+                 send_timeout: float = settings.TG_WS_SEND_TIMEOUT,
+                 max_concurrency: int = settings.TG_WS_FANOUT_CONCURRENCY,
+                 queue_size: int = settings.TG_WS_QUEUE_SIZE,
+                 overflow_policy: OverflowPolicy | str = settings.TG_WS_OVERFLOW_POLICY,
+                 broker: Broker | None = None):
         # Храним соединения: {chat_id: {user_id: set(websocket)}}
         self.active_connections: Dict[UUID, Dict[UUID, Set[WebSocket]]] = {}
+        # Все сокеты пользователя во всех чатах: {user_id: set(websocket)}
+        self.user_connections: Dict[UUID, Set[WebSocket]] = {}
+        # Очереди и задачи-писатели соединений: {websocket: Connection}
+        self.connections: Dict[WebSocket, Connection] = {}
+        self.send_timeout = send_timeout
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.overflow_policy = OverflowPolicy(overflow_policy)
+        # общий на все задачи-писатели предел одновременных отправок
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # брокер доставляет сообщения сокетам других процессов
+        self.broker = broker or InProcessBroker()
+        self.broker.set_handler(self._on_broker_message)
+        self.node_id = uuid4().hex  # свои же сообщения, вернувшиеся из брокера, пропускаем
+        self._subscription_lock = asyncio.Lock()
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def start(self):
+        await self.broker.start()
+
+    async def stop(self):
+        await self.broker.stop()
+
+    @staticmethod
+    def chat_channel(chat_id: UUID) -> str:
+        return f"chat:{chat_id}"
+
+    @staticmethod
+    def user_channel(user_id: UUID) -> str:
+        return f"user:{user_id}"
 
     async def connect(self,
                       websocket: WebSocket,
                       chat_id: UUID,
                       user_id: UUID):
+        """Принять сокет одного чата (/ws/{chat_id})"""
+        await self.register(websocket, user_id)
+        await self.subscribe(websocket, chat_id)
+
+    async def register(self,
+                       websocket: WebSocket,
+                       user_id: UUID) -> Connection:
+        """Принять сокет пользователя без чатов: чаты добавляются subscribe (/ws)"""
         await websocket.accept()
-        if chat_id not in self.active_connections:
-            self.active_connections[chat_id] = {}
-        if user_id not in self.active_connections[chat_id]:
-            self.active_connections[chat_id][user_id] = set()
-        self.active_connections[chat_id][user_id].add(websocket)
-
-    def disconnect(self,
-                   websocket: WebSocket,
-                   chat_id: UUID,
-                   user_id: UUID):
+        connection = Connection(websocket, user_id, self)
+        self.connections[websocket] = connection
+        self.user_connections.setdefault(user_id, set()).add(websocket)
+        connection.start()
+        await self._sync_subscription(self.user_channel(user_id), self.user_connections, user_id)
+        return connection
+
+    async def subscribe(self,
+                        websocket: WebSocket,
+                        chat_id: UUID):
+        """Направлять события чата в этот сокет"""
+        connection = self.connections[websocket]
+        connection.chat_ids.add(chat_id)
+        self.active_connections.setdefault(chat_id, {}).setdefault(connection.user_id, set()).add(websocket)
+        await self._sync_subscription(self.chat_channel(chat_id), self.active_connections, chat_id)
+
+    def unsubscribe(self,
+                    websocket: WebSocket,
+                    chat_id: UUID):
+        """Перестать направлять события чата в этот сокет"""
+        if (connection := self.connections.get(websocket)) is None:
+            return
+        connection.chat_ids.discard(chat_id)
+        user_id = connection.user_id
         if chat_id in self.active_connections and user_id in self.active_connections[chat_id]:
             self.active_connections[chat_id][user_id].discard(websocket)
             if not self.active_connections[chat_id][user_id]:
                 del self.active_connections[chat_id][user_id]
             if not self.active_connections[chat_id]:
                 del self.active_connections[chat_id]
+                # последний локальный сокет чата: отписываемся от канала в фоне
+                self._spawn(self._sync_subscription(self.chat_channel(chat_id), self.active_connections, chat_id))
+
+    def disconnect(self, websocket: WebSocket):
+        """Убрать сокет из всех чатов и остановить его задачу-писателя"""
+        if (connection := self.connections.get(websocket)) is None:
+            return
+        for subscribed_chat_id in list(connection.chat_ids):
+            self.unsubscribe(websocket, subscribed_chat_id)
+        user_id = connection.user_id
+        if user_id in self.user_connections:
+            self.user_connections[user_id].discard(websocket)
+            if not self.user_connections[user_id]:
+                del self.user_connections[user_id]
+                self._spawn(self._sync_subscription(self.user_channel(user_id), self.user_connections, user_id))
+        del self.connections[websocket]
+        connection.stop()
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _sync_subscription(self, channel: str, index: dict, key: UUID):
+        """Подписка на канал есть, пока в процессе есть сокеты этого чата (пользователя)"""
+        async with self._subscription_lock:
+            wanted = key in index
+            try:
+                if wanted and channel not in self.broker.channels:
+                    await self.broker.subscribe(channel)
+                elif not wanted and channel in self.broker.channels:
+                    await self.broker.unsubscribe(channel)
+            except Exception as e:
+                logger.error(f"🛑 broker subscription {channel=} {e=}")
 
     async def send_message(self,
                            message: dict,
                            chat_id: UUID,
-                           recipient_id: UUID | None = None):
+                           recipient_id: UUID | None = None) -> BroadcastResult:
+        """
+        Разослать сообщение всем сокетам чата (или только сокетам recipient_id в этом чате).
+        Сообщение только кладется в очереди соединений, в сеть его пишут их задачи-писатели:
+        не более max_concurrency сокетов одновременно, с таймаутом send_timeout на отправку.
+        Сокеты, отключаемые из-за переполнения очереди, попадают в BroadcastResult.dropped.
+        Сообщение сериализуется один раз, все получатели отправляют один и тот же текст.
+        Сокетам других процессов сообщение уходит через брокер, в результат они не входят.
+        """
+        if recipient_id is not None:
+            return await self.send_to_user(message, recipient_id, chat_id=chat_id)
+        text = json_dumps(message)
+        result = self._deliver_to_chat(message, text, chat_id)
+        await self._publish(self.chat_channel(chat_id), {"chat_id": str(chat_id)}, text)
+        return result
+
+    async def send_to_user(self,
+                           message: dict,
+                           user_id: UUID | str,
+                           chat_id: UUID | None = None,
+                           exclude_chat_id: UUID | None = None) -> BroadcastResult:
+        """
+        Отправить сообщение всем сокетам пользователя, в каких бы чатах они ни были открыты.
+        :param chat_id: только сокетам этого чата
+        :param exclude_chat_id: кроме сокетов этого чата (например, они уже получили рассылку по чату)
+        """
+        user_id = as_uuid(user_id)
+        text = json_dumps(message)
+        result = self._deliver_to_user(message, text, user_id, chat_id, exclude_chat_id)
+        await self._publish(self.user_channel(user_id),
+                            {"user_id": str(user_id),
+                             "chat_id": str(chat_id) if chat_id else None,
+                             "exclude_chat_id": str(exclude_chat_id) if exclude_chat_id else None},
+                            text)
+        return result
+
+    async def _publish(self, channel: str, envelope: dict, text: str):
+        if not self.broker.shared:
+            return  # других процессов нет: конверт не нужен, текст уже разослан своим сокетам
+        envelope.update(origin=self.node_id, text=text)
+        try:
+            await self.broker.publish(channel, json_dumps(envelope))
+        except Exception as e:
+            logger.error(f"🛑 broker publish {channel=} {e=}")
+
+    async def _on_broker_message(self, channel: str, data: str):
+        """Сообщение из брокера: доставить локальным сокетам чата или пользователя"""
+        envelope = json.loads(data)
+        if envelope["origin"] == self.node_id:
+            return
+        text = envelope["text"]
+        message = json.loads(text)
+        if envelope.get("user_id"):
+            self._deliver_to_user(message, text, as_uuid(envelope["user_id"]),
+                                  as_uuid(envelope["chat_id"]), as_uuid(envelope["exclude_chat_id"]))
+        else:
+            self._deliver_to_chat(message, text, as_uuid(envelope["chat_id"]))
+
+    async def send_to_socket(self, message: dict, websocket: WebSocket) -> bool:
+        """Ответ в конкретный сокет (например, подтверждение подписки)"""
+        connection = self.connections.get(websocket)
+        return connection is not None and connection.put(message)
+
+    def _deliver_to_chat(self, message: dict, text: str, chat_id: UUID) -> BroadcastResult:
+        """Поставить сообщение в очереди локальных сокетов чата"""
+        result = BroadcastResult()
         if chat_id not in self.active_connections:
             logger.info(f"🛑🛑 {chat_id=} not in self.active_connections!")
-            return
+            return result
         for user_id, websockets in self.active_connections[chat_id].items():
-            if not (recipient_id is None or str(user_id) == str(recipient_id)):
-                logger.info(f"🛑🛑 not (recipient_id is None or user_id == recipient_id)")
-                continue
-            for websocket in websockets:
-                await websocket.send_json(message)
-                logger.info(f"✅✅ {message=} Отправлено!")
+            self._put(message, text, user_id, websockets, result)
+        logger.info(f"✅✅ {chat_id=} в очереди {result.queued}, отключено {len(result.dropped)}")
+        return result
+
+    def _deliver_to_user(self,
+                         message: dict,
+                         text: str,
+                         user_id: UUID,
+                         chat_id: UUID | None = None,
+                         exclude_chat_id: UUID | None = None) -> BroadcastResult:
+        """Поставить сообщение в очереди локальных сокетов пользователя"""
+        result = BroadcastResult()
+        websockets = self.user_connections.get(user_id, ())
+        if chat_id is not None or exclude_chat_id is not None:
+            websockets = [
+                ws for ws in websockets
+                if (connection := self.connections.get(ws)) is None
+                or ((chat_id is None or chat_id in connection.chat_ids)
+                    and (exclude_chat_id is None or exclude_chat_id not in connection.chat_ids))
+            ]
+        self._put(message, text, user_id, websockets, result)
+        return result
+
+    def _put(self, message: dict, text: str, user_id: UUID, websockets, result: BroadcastResult):
+        for websocket in websockets:
+            connection = self.connections.get(websocket)
+            if connection is not None and connection.put(message, text):
+                result.queued += 1
+            else:
+                result.dropped.append((user_id, websocket))
+
+    async def _drop(self, connection: Connection):
+        """Убрать медленный или мертвый сокет из рассылки и закрыть его"""
+        self.disconnect(connection.websocket)
+        try:
+            await asyncio.wait_for(connection.websocket.close(code=1011), timeout=self.send_timeout)
+        except Exception as e:
+            logger.info(f"🛑 close {connection.user_id=} {e=}")
+
+
+def as_uuid(value: UUID | str | None) -> UUID | None:
+    if value is None or isinstance(value, UUID):
+        return value
+    return UUID(str(value))
 
 
-connection_manager = ConnectionManager()
+connection_manager = ConnectionManager(broker=create_broker())
@@ -1,8 +1,18 @@
+import base64
+import binascii
+import json
 import uuid
+from datetime import date, datetime, time
+from typing import Any
 
 from starlette import status
 from starlette.exceptions import HTTPException
 
+try:
+    import orjson
+except ImportError:  # orjson необязателен, без него работает стандартный json
+    orjson = None
+
 
 def validate_uuid(item_id: str,
                   er_status=status.HTTP_400_BAD_REQUEST,
@@ -22,3 +32,44 @@ def validate_uuid(item_id: str,
         return uuid.UUID(item_id)
     except ValueError:
         raise HTTPException(status_code=er_status, detail=er_msg)
+
+
+def json_dumps(data: Any) -> str:
+    """
+    Сериализовать данные для отправки в веб-сокет текстовым фреймом.
+    Формат совпадает с WebSocket.send_json: без пробелов, не-ASCII символы как есть.
+    Если установлен orjson, используется он; стандартный json пишет UUID и даты так же, как orjson.
+    """
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False, default=_json_default)
+
+
+def _json_default(value: Any):
+    """Типы, которые orjson сериализует сам: UUID строкой, даты в ISO 8601"""
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def encode_cursor(timestamp: datetime, item_id: uuid.UUID) -> str:
+    """
+    Непрозрачный курсор пагинации по ключу (timestamp, id).
+    Клиент не разбирает курсор, а только передает его обратно.
+    """
+    raw = f"{timestamp.isoformat()}|{item_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str,
+                  er_status=status.HTTP_400_BAD_REQUEST,
+                  er_msg="Некорректный курсор") -> tuple[datetime, uuid.UUID]:
+    """Разобрать курсор encode_cursor, при ошибке - HTTPException"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, item_id = raw.split("|")
+        return datetime.fromisoformat(timestamp), uuid.UUID(item_id)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        raise HTTPException(status_code=er_status, detail=er_msg)
@@ -0,0 +1,97 @@
+"""
+Бенчмарк авторизованных запросов.
+
+Клиенты параллельно шлют запросы с одним и тем же access-токеном в роут,
+который только получает пользователя через get_current_user. Сравнивает
+проверку каждого запроса заново (подпись, отзыв, пользователь из базы) с кешем
+проверенных токенов. Выводит запросов в секунду и p99.
+
+Нужна рабочая база из .env. Тестовый пользователь удаляется в конце.
+
+Запуск: python -m benchmarks.bench_auth --requests 20000 --clients 100
+"""
+import argparse
+import asyncio
+import logging
+import time
+from uuid import uuid4
+
+from fastapi import Depends, FastAPI
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import delete
+
+import app.auth.auth as auth
+from app.auth.cache import TokenCache
+from app.auth.service import AuthService
+from app.database import AsyncSessionLocal, engine
+from app.models.base import Base
+from app.models.models import IssuedJWTToken, User
+from benchmarks.bench_broadcast import percentile
+
+
+def make_app() -> FastAPI:
+    bench_app = FastAPI()
+
+    @bench_app.get("/me/")
+    async def me(user: User = Depends(auth.get_current_user)):
+        return {"id": str(user.id)}
+
+    return bench_app
+
+
+async def run(token: str, requests: int, clients: int) -> tuple[float, list[float]]:
+    latencies = []
+    transport = ASGITransport(app=make_app())
+    headers = {"Authorization": f"Bearer {token}"}
+
+    async def client(count: int, ac: AsyncClient):
+        for _ in range(count):
+            started = time.perf_counter()
+            response = await ac.get("/me/", headers=headers)
+            assert response.status_code == 200, response.text
+            latencies.append(time.perf_counter() - started)
+
+    async with AsyncClient(transport=transport, base_url="http://bench") as ac:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(requests // clients, ac) for _ in range(clients)))
+        return time.perf_counter() - started, latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--clients", type=int, default=100, help="сколько клиентов шлют запросы параллельно")
+    args = parser.parse_args()
+    logging.getLogger("app").setLevel(logging.ERROR)
+    engine.echo = False
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as session:
+        user = await User.create(session=session, username=f"bench-{uuid4().hex[:8]}",
+                                 email=f"bench-{uuid4().hex[:8]}@example.com", password="-")
+        access_token, _, notes = AuthService()._issue_tokens_for_user(user, str(uuid4()))
+        session.add_all(notes)
+        await session.commit()
+
+    cases = [
+        ("no cache", TokenCache(maxsize=0)),  # запись вытесняется сразу - каждый запрос проверяется заново
+        ("cached", TokenCache()),
+    ]
+    try:
+        print(f"requests={args.requests} clients={args.clients} pool={engine.pool.status()}")
+        for name, cache in cases:
+            auth.token_cache = cache
+            elapsed, latencies = await run(access_token, args.requests, args.clients)
+            print(f"{name:>8}: {len(latencies) / elapsed:9.0f} req/s  "
+                  f"p99={percentile(latencies, 0.99) * 1000:8.1f} ms")
+    finally:
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(IssuedJWTToken).where(IssuedJWTToken.user_id == user.id))
+            await session.execute(delete(User).where(User.id == user.id))
+            await session.commit()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
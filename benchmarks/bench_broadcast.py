@@ -0,0 +1,121 @@
+"""
+Бенчмарк рассылки сообщения в большой чат.
+
+Сравнивает последовательную отправку (как было: await send_json по очереди)
+с рассылкой ConnectionManager.send_message через очереди соединений. Часть получателей
+искусственно медленные. Выводит p50/p99 времени, за которое сообщение доходит
+до всех остальных участников.
+
+Запуск: python -m benchmarks.bench_broadcast --members 1000 --slow 5 --rounds 50
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import statistics
+import time
+from uuid import uuid4
+
+from app.services.websocket import ConnectionManager
+
+
+class BenchWebSocket:
+    def __init__(self, delay: float, tracker: "DeliveryTracker"):
+        self.delay = delay
+        self.tracker = tracker
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, data):
+        await self.send_text(json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+
+    async def send_text(self, data):
+        await asyncio.sleep(self.delay)
+        self.tracker.delivered(self)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+class DeliveryTracker:
+    """Ждет, пока сообщение дойдет до всех быстрых получателей"""
+
+    def __init__(self):
+        self.fast: set = set()
+        self.done = asyncio.Event()
+
+    def delivered(self, websocket: BenchWebSocket):
+        self.fast.discard(websocket)
+        if not self.fast:
+            self.done.set()
+
+
+async def sequential_send(cm: ConnectionManager, message: dict, chat_id):
+    """Старое поведение: отправитель сам пишет в сокеты по одному"""
+    for websockets in list(cm.active_connections.get(chat_id, {}).values()):
+        for websocket in list(websockets):
+            await websocket.send_json(message)
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def fill_chat(cm: ConnectionManager, members: int, slow: int, slow_delay: float):
+    chat_id = uuid4()
+    tracker = DeliveryTracker()
+    slow_ids = set(random.sample(range(members), slow))
+    for i in range(members):
+        delay = slow_delay if i in slow_ids else random.uniform(0, 0.002)
+        websocket = BenchWebSocket(delay, tracker)
+        if i not in slow_ids:
+            tracker.fast.add(websocket)
+        await cm.connect(websocket, chat_id, uuid4())
+    return chat_id, tracker
+
+
+async def run(send, members: int, slow: int, slow_delay: float, rounds: int, timeout: float) -> list[float]:
+    latencies = []
+    for _ in range(rounds):
+        # чат заполняется заново: рассылка отключает медленных
+        cm = ConnectionManager(send_timeout=timeout)
+        chat_id, tracker = await fill_chat(cm, members, slow, slow_delay)
+        started = time.perf_counter()
+        await send(cm, {"text": "hello", "chat_id": str(chat_id)}, chat_id)
+        await tracker.done.wait()  # задержка = пока сообщение не получат все быстрые участники
+        latencies.append(time.perf_counter() - started)
+        for websocket in list(cm.connections):
+            cm.disconnect(websocket)
+    return latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=1000)
+    parser.add_argument("--slow", type=int, default=5, help="сколько медленных получателей")
+    parser.add_argument("--slow-delay", type=float, default=3.0, help="задержка медленного получателя, c")
+    parser.add_argument("--timeout", type=float, default=0.5, help="таймаут одной отправки, c")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--skip-sequential", action="store_true")
+    args = parser.parse_args()
+    logging.getLogger("app").setLevel(logging.ERROR)
+
+    cases = [("queued", lambda cm, m, c: cm.send_message(m, c))]
+    if not args.skip_sequential:
+        # последовательную рассылку гоняем меньше раз: каждый раунд ждет всех медленных
+        cases.insert(0, ("sequential", sequential_send))
+
+    print(f"members={args.members} slow={args.slow} slow_delay={args.slow_delay}s timeout={args.timeout}s")
+    for name, send in cases:
+        rounds = args.rounds if name == "queued" else max(1, args.rounds // 10)
+        latencies = await run(send, args.members, args.slow, args.slow_delay, rounds, args.timeout)
+        print(f"{name:>11}: rounds={rounds:<4} "
+              f"p50={statistics.median(latencies) * 1000:9.1f} ms  "
+              f"p99={percentile(latencies, 0.99) * 1000:9.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+"""
+Микро-бенчмарк сериализации при рассылке.
+
+Было: WebSocket.send_json вызывает json.dumps для каждого сокета чата.
+Стало: ConnectionManager.send_message сериализует сообщение один раз (json_dumps, orjson если установлен)
+и отправляет всем один и тот же текст.
+
+Запуск: python -m benchmarks.bench_encode --members 500 --rounds 200
+"""
+import argparse
+import json
+import time
+import uuid
+from datetime import UTC, datetime
+
+from app.tools import json_dumps, orjson
+
+
+def make_message() -> dict:
+    return {
+        "chat_id": str(uuid.uuid4()),
+        "sender_id": str(uuid.uuid4()),
+        "message_id": str(uuid.uuid4()),
+        "text": "Привет! Как дела? " * 10,
+        "timestamp_str": datetime.now(UTC).strftime("%d.%m.%Y %H:%M"),
+        "is_read": False,
+    }
+
+
+def per_socket(message: dict, members: int) -> int:
+    """Как send_json: json.dumps на каждого получателя"""
+    for _ in range(members):
+        json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+    return members
+
+
+def once_json(message: dict, members: int) -> int:
+    text = json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+    frames = [text] * members  # все получатели ссылаются на одну строку
+    return 1 if frames else 0
+
+
+def once_fast(message: dict, members: int) -> int:
+    text = json_dumps(message)
+    frames = [text] * members
+    return 1 if frames else 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    message = make_message()
+    cases = [("send_json per socket", per_socket), ("encode once (json)", once_json)]
+    if orjson is not None:
+        cases.append(("encode once (orjson)", once_fast))
+    print(f"members={args.members} rounds={args.rounds} payload={len(json_dumps(message).encode())} bytes")
+    for name, fn in cases:
+        encodes = 0
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            encodes += fn(message, args.members)
+        elapsed = time.perf_counter() - started
+        print(f"{name:>22}: encodes/broadcast={encodes // args.rounds:<5} "
+              f"{elapsed / args.rounds * 1e6:10.1f} us/broadcast")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Бенчмарк записи сообщений чата.
+
+Сравнивает запись по одному сообщению на транзакцию (как было: session.add + commit)
+с пакетной записью MessageIngest (один INSERT ... ON CONFLICT DO NOTHING на пакет).
+Отправители пишут параллельно, как сокеты разных пользователей. Выводит сообщений
+в секунду и p99 времени до подтверждения.
+
+Нужна рабочая база из .env. Тестовые пользователь, чат и сообщения удаляются в конце.
+
+Запуск: python -m benchmarks.bench_ingest --messages 10000 --senders 200
+"""
+import argparse
+import asyncio
+import logging
+import time
+from datetime import UTC, datetime
+from uuid import uuid4
+
+from sqlalchemy import delete
+
+from app.database import AsyncSessionLocal, engine
+from app.models.base import Base
+from app.models.models import Chat, Message, User
+from app.services.ingest import MessageIngest
+from benchmarks.bench_broadcast import percentile
+
+
+def new_message(chat_id, user_id) -> dict:
+    return {"id": uuid4(), "chat_id": chat_id, "sender_id": user_id, "text": "bench",
+            "timestamp": datetime.now(UTC), "is_read": False}
+
+
+async def commit_each(values: dict) -> bool:
+    """Старое поведение: транзакция на каждое сообщение"""
+    async with AsyncSessionLocal() as session:
+        session.add(Message(**values))
+        await session.commit()
+    return True
+
+
+async def run(submit, chat_id, user_id, messages: int, senders: int) -> tuple[float, list[float]]:
+    latencies = []
+
+    async def sender(count: int):
+        for _ in range(count):
+            started = time.perf_counter()
+            await submit(new_message(chat_id, user_id))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(sender(messages // senders) for _ in range(senders)))
+    return time.perf_counter() - started, latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--senders", type=int, default=200, help="сколько отправителей пишут параллельно")
+    parser.add_argument("--max-delay", type=float, default=0.005, help="сколько копить пакет, c")
+    parser.add_argument("--max-batch", type=int, default=500)
+    parser.add_argument("--skip-each", action="store_true")
+    args = parser.parse_args()
+    logging.getLogger("app").setLevel(logging.ERROR)
+    engine.echo = False
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as session:
+        user = await User.create(session=session, username=f"bench-{uuid4().hex[:8]}",
+                                 email=f"bench-{uuid4().hex[:8]}@example.com", password="-")
+        chat = await Chat.create(session=session, name="bench", is_group=True)
+
+    ingest = MessageIngest(max_delay=args.max_delay, max_batch=args.max_batch)
+    cases = [("batched", ingest.submit)]
+    if not args.skip_each:
+        cases.insert(0, ("commit each", commit_each))
+    try:
+        print(f"messages={args.messages} senders={args.senders} pool={engine.pool.status()}")
+        for name, submit in cases:
+            elapsed, latencies = await run(submit, chat.id, user.id, args.messages, args.senders)
+            print(f"{name:>11}: {len(latencies) / elapsed:9.0f} msg/s  "
+                  f"p99 ack={percentile(latencies, 0.99) * 1000:8.1f} ms")
+    finally:
+        await ingest.stop()
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(Message).where(Message.chat_id == chat.id))
+            await session.execute(delete(Chat).where(Chat.id == chat.id))
+            await session.execute(delete(User).where(User.id == user.id))
+            await session.commit()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+"""
+Бенчмарк задержки цикла событий во время шторма входов.
+
+Параллельно идут проверки паролей (как в AuthService.login) и "пульс" - задача,
+которая каждые 10 мс просыпается и замеряет, на сколько опоздала. Сравнивает
+проверку прямо в цикле событий (как было) с пулом потоков check_password.
+Задержка пульса - это то, насколько в это время отстают все сокеты воркера.
+
+База не нужна.
+
+Запуск: python -m benchmarks.bench_password --logins 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import time
+
+from app.auth.password import PasswordPool, get_password_hash, verify_password
+from benchmarks.bench_broadcast import percentile
+
+TICK = 0.01
+
+
+async def heartbeat(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - started - TICK)
+
+
+async def run(check, logins: int, concurrency: int, hashed: str) -> tuple[float, list[float]]:
+    lags = []
+    stop = asyncio.Event()
+    beat = asyncio.create_task(heartbeat(lags, stop))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def login():
+        async with semaphore:
+            assert await check("password", hashed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await beat
+    return elapsed, lags
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50, help="сколько входов идет одновременно")
+    parser.add_argument("--workers", type=int, default=4, help="потоков в пуле")
+    args = parser.parse_args()
+
+    hashed = get_password_hash("password")
+    pool = PasswordPool(workers=args.workers, queue_size=args.logins)
+
+    async def inline(plain, hashed_password):
+        return verify_password(plain, hashed_password)
+
+    async def pooled(plain, hashed_password):
+        return await pool.run(verify_password, plain, hashed_password)
+
+    print(f"logins={args.logins} concurrency={args.concurrency} workers={args.workers}")
+    for name, check in [("inline", inline), ("pool", pooled)]:
+        elapsed, lags = await run(check, args.logins, args.concurrency, hashed)
+        lags = lags or [0.0]
+        print(f"{name:>6}: {args.logins / elapsed:7.0f} logins/s  "
+              f"loop lag p99={percentile(lags, 0.99) * 1000:8.1f} ms  max={max(lags) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
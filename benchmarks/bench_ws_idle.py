@@ -0,0 +1,103 @@
+"""
+Нагрузочный тест: сколько соединений с базой занимают простаивающие веб-сокеты.
+
+Поднимает приложение в этом же процессе (uvicorn), создает пользователя и чат,
+открывает N сокетов и ничего в них не пишет. Выводит, сколько соединений взято
+из пула SQLAlchemy и сколько сессий PostgreSQL висит в состоянии "idle in transaction".
+Затем отправляет сообщения с части сокетов и снова снимает показания.
+
+Нужна рабочая база из .env. Тестовые пользователь и чат удаляются в конце.
+
+Запуск: python -m benchmarks.bench_ws_idle --sockets 2000 --active 50
+"""
+import argparse
+import asyncio
+import logging
+from uuid import uuid4
+
+import uvicorn
+from aiohttp import ClientSession
+from sqlalchemy import delete, text
+
+from app.auth.service import AuthService
+from app.database import AsyncSessionLocal, engine
+from app.dto import UserPwdDTO
+from app.models.models import Chat, GroupMember, Message, User
+from main import app
+
+
+async def pool_usage() -> dict:
+    """Соединения, взятые из пула приложения, и состояния сессий в PostgreSQL"""
+    usage = {"checked_out": engine.pool.checkedout()}
+    async with AsyncSessionLocal() as session:
+        rows = await session.execute(text(
+            "SELECT state, count(*) FROM pg_stat_activity "
+            "WHERE datname = current_database() AND pid <> pg_backend_pid() GROUP BY state"
+        ))
+        usage.update({state or "unknown": count for state, count in rows})
+    return usage
+
+
+async def create_chat() -> tuple[User, Chat, str]:
+    auth_service = AuthService()
+    async with AsyncSessionLocal() as session:
+        email = f"bench-{uuid4().hex[:8]}@example.com"
+        user, _ = await auth_service.register(UserPwdDTO(username="bench", email=email, password="bench123"),
+                                              session=session)
+        chat = await Chat.create(name="bench", is_group=True, session=session)
+        session.add(GroupMember(user_id=user.id, chat_id=chat.id, is_admin=True))
+        await session.commit()
+    token = auth_service._jwt_auth.generate_access_token(subject=str(user.id), payload={"device_id": str(uuid4())})
+    return user, chat, token
+
+
+async def cleanup(user: User, chat: Chat):
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(Message).where(Message.chat_id == chat.id))
+        await session.execute(delete(GroupMember).where(GroupMember.chat_id == chat.id))
+        await session.execute(delete(Chat).where(Chat.id == chat.id))
+        await session.execute(delete(User).where(User.id == user.id))
+        await session.commit()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sockets", type=int, default=1000, help="сколько простаивающих сокетов открыть")
+    parser.add_argument("--active", type=int, default=20, help="со скольких сокетов отправить по сообщению")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--idle", type=float, default=2.0, help="сколько секунд сокеты простаивают, c")
+    args = parser.parse_args()
+    logging.getLogger("app").setLevel(logging.ERROR)
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="error"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    user, chat, token = await create_chat()
+    uri = f"ws://127.0.0.1:{args.port}/ws/{chat.id}"
+    try:
+        async with ClientSession() as client:
+            print(f"до подключения:          {await pool_usage()}")
+            sockets = []
+            for _ in range(args.sockets):
+                sockets.append(await client.ws_connect(uri, headers={"Authorization": f"Bearer {token}"}))
+            await asyncio.sleep(args.idle)
+            print(f"{args.sockets} простаивающих сокетов: {await pool_usage()}")
+
+            for websocket in sockets[:args.active]:
+                await websocket.send_json({"action": "send_message", "chat_id": str(chat.id),
+                                           "text": "bench", "message_id": str(uuid4())})
+            await asyncio.sleep(args.idle)
+            print(f"после {args.active} сообщений:      {await pool_usage()}")
+
+            for websocket in sockets:
+                await websocket.close()
+    finally:
+        await cleanup(user, chat)
+        server.should_exit = True
+        await server_task
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
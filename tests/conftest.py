@@ -13,6 +13,8 @@ from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_asyn
 # Загружаем переменные окружения из .env
 load_dotenv()
 
+from app.auth.cache import token_cache
+from app.auth.revocation import revocation_index
 from app.auth.service import AuthService
 from app.database import get_db
 from app.dto import UserPwdDTO
@@ -42,6 +44,15 @@ def set_testing_mode():
     os.environ["TESTING"] = "false"  # Сбрасываем после теста
 
 
+# Индекс отозванных токенов приложение грузит из основной базы, а тесты работают с тестовой:
+# без загрузки индекса проверки отзыва идут в тестовую базу
+@pytest.fixture(autouse=True)
+def reset_auth_caches():
+    revocation_index.clear()
+    token_cache.clear()
+    yield
+
+
 # Тестовая база данных (SQLite в памяти)
 # TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "sqlite+aiosqlite:///test.sqlite")
 USER = os.getenv("TG_DB_USER")
@@ -0,0 +1,73 @@
+import uuid
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.models import Message, MessageArchive
+from app.routes.chat import history_totals
+from app.services import archive
+from app.services.archive import LocalArchiveStore, MessageArchiver, decode_chunk, encode_chunk
+from main import app
+
+
+def test_chunk_roundtrip():
+    """Строки переживают запись в файл по колонкам без изменений"""
+    rows = [
+        {"id": uuid.uuid4(), "chat_id": uuid.uuid4(), "sender_id": None, "text": f"текст {i}",
+         "timestamp": datetime(2025, 1, 1, tzinfo=UTC) + timedelta(seconds=i), "is_read": i % 2 == 0,
+         "read_count": i}
+        for i in range(3)
+    ]
+    assert decode_chunk(encode_chunk(rows)) == rows
+
+
+@pytest.mark.asyncio
+async def test_local_store(tmp_path):
+    """Файл пишется целиком, без временных файлов рядом"""
+    store = LocalArchiveStore(tmp_path)
+    await store.put("chat/chunk.json.gz", b"data")
+    assert await store.get("chat/chunk.json.gz") == b"data"
+    assert [path.name for path in (tmp_path / "chat").iterdir()] == ["chunk.json.gz"]
+
+
+@pytest.mark.asyncio
+async def test_history_reads_archive(client, auth_headers, personal_chat, test_user, db_session: AsyncSession,
+                                     tmp_path, monkeypatch):
+    """Старые сообщения уходят в файлы, а история листается через границу базы и архива без пропусков"""
+    base = datetime(2025, 1, 1, tzinfo=UTC)
+    for i in range(25):
+        db_session.add(Message(chat_id=personal_chat.id, sender_id=test_user.id, text=f"m{i}",
+                               timestamp=base + timedelta(minutes=i)))
+    await db_session.commit()
+
+    archiver = MessageArchiver(session_factory=lambda: db_session, store=LocalArchiveStore(tmp_path),
+                               after_days=1, chunk_size=4)
+    # старше суток на момент now - первые 12 сообщений, три файла по 4
+    assert await archiver.archive(now=base + timedelta(days=1, minutes=12)) == 12
+    # проход перенес все до cutoff: следующий старые секции не просматривает
+    assert archiver.archived_until == base + timedelta(minutes=12)
+    assert await archiver.archive(now=base + timedelta(days=1, minutes=12)) == 0
+    assert await db_session.scalar(select(func.count()).select_from(Message)
+                                   .filter_by(chat_id=personal_chat.id)) == 13
+    assert await db_session.scalar(select(func.count()).select_from(MessageArchive)) == 3
+    monkeypatch.setattr(archive.message_archiver, "store", archiver.store)
+    history_totals.clear()
+
+    url = f"/chat/{personal_chat.id}/history/"
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        pages = [(await ac.post(url, params={"limit": 10}, headers=auth_headers)).json()]
+        while pages[-1]["next_cursor"]:
+            pages.append((await ac.post(url, params={"limit": 10, "before": pages[-1]["next_cursor"],
+                                                     "with_total": False}, headers=auth_headers)).json())
+        newer = (await ac.post(url, params={"limit": 10, "after": pages[-1]["prev_cursor"]},
+                               headers=auth_headers)).json()
+
+    texts = [message["text"] for page in pages for message in page["messages"]]
+    assert texts == [f"m{i}" for i in range(24, -1, -1)]
+    assert pages[0]["total"] == 25
+    # из архива (m5..m11) и из базы (m12..m14)
+    assert [message["text"] for message in newer["messages"]] == [f"m{i}" for i in range(14, 4, -1)]
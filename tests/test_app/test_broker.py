@@ -0,0 +1,337 @@
+import asyncio
+import os
+from uuid import uuid4
+
+import pytest
+
+from app.services.broker import InProcessBroker, PostgresBroker, RedisBroker, encode_command, read_reply
+from app.services.websocket import ConnectionManager
+from tests.test_app.test_connection_manager import FakeWebSocket, wait_delivery
+
+
+class FakeRedisServer:
+    """Заглушка Redis: понимает PING, AUTH, PUBLISH, SUBSCRIBE, UNSUBSCRIBE"""
+
+    def __init__(self):
+        self.subscribers: dict[bytes, set[asyncio.StreamWriter]] = {}
+        self.server = None
+        self.port = None
+        self.loading = 0  # столько следующих SUBSCRIBE получат -LOADING, как сразу после рестарта Redis
+        self.auth_errors = 0  # столько следующих AUTH получат ошибку
+        self.clients: set[asyncio.StreamWriter] = set()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._client, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def drop_clients(self):
+        """Оборвать все соединения"""
+        for writer in self.clients:
+            writer.close()
+
+    async def _client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.clients.add(writer)
+        try:
+            while True:
+                command = await read_reply(reader)
+                name, args = command[0].upper(), command[1:]
+                if name == b"AUTH" and self.auth_errors:
+                    self.auth_errors -= 1
+                    writer.write(b"-WRONGPASS invalid username-password pair\r\n")
+                elif name == b"SUBSCRIBE" and self.loading:
+                    self.loading -= 1
+                    writer.write(b"-LOADING Redis is loading the dataset in memory\r\n")
+                elif name in (b"PING", b"AUTH"):
+                    writer.write(b"+OK\r\n")
+                elif name == b"PUBLISH":
+                    channel, data = args
+                    targets = self.subscribers.get(channel, set())
+                    for target in targets:
+                        target.write(encode_command(b"message", channel, data))
+                    writer.write(b":%d\r\n" % len(targets))
+                elif name in (b"SUBSCRIBE", b"UNSUBSCRIBE"):
+                    for channel in args:
+                        subscribers = self.subscribers.setdefault(channel, set())
+                        if name == b"SUBSCRIBE":
+                            subscribers.add(writer)
+                        else:
+                            subscribers.discard(writer)
+                        writer.write(encode_command(name.lower(), channel) + b":1\r\n")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.clients.discard(writer)
+            for subscribers in self.subscribers.values():
+                subscribers.discard(writer)
+
+
+@pytest.fixture
+async def redis_server():
+    server = FakeRedisServer()
+    await server.start()
+    yield server
+    await server.stop()
+
+
+def test_encode_command():
+    """Команда кодируется массивом bulk-строк RESP"""
+    assert encode_command("PUBLISH", "chat:1", "привет") == (
+        b"*3\r\n$7\r\nPUBLISH\r\n$6\r\nchat:1\r\n$12\r\n" + "привет".encode() + b"\r\n"
+    )
+
+
+@pytest.mark.asyncio
+async def test_in_process_bus_between_managers():
+    """Два менеджера с общей шиной доставляют сообщения друг другу, как два процесса"""
+    bus = {}
+    node1 = ConnectionManager(broker=InProcessBroker(bus))
+    node2 = ConnectionManager(broker=InProcessBroker(bus))
+    chat_id = uuid4()
+    ws1, ws2 = FakeWebSocket(), FakeWebSocket()
+    await node1.connect(ws1, chat_id, uuid4())
+    await node2.connect(ws2, chat_id, uuid4())
+
+    await node1.send_message({"text": "hi"}, chat_id)
+    await wait_delivery()
+
+    assert ws1.sent == [{"text": "hi"}]
+    assert ws2.sent == [{"text": "hi"}]
+
+
+@pytest.mark.asyncio
+async def test_subscription_follows_local_sockets():
+    """Процесс подписан на канал чата, только пока у него есть сокеты этого чата"""
+    cm = ConnectionManager()
+    chat_id, user_id = uuid4(), uuid4()
+    ws = FakeWebSocket()
+
+    await cm.connect(ws, chat_id, user_id)
+    assert cm.chat_channel(chat_id) in cm.broker.channels
+
+    cm.disconnect(ws)
+    await wait_delivery()
+    assert cm.chat_channel(chat_id) not in cm.broker.channels
+
+
+@pytest.mark.asyncio
+async def test_recipient_delivered_on_other_node():
+    """Личное сообщение доходит до пользователя, подключенного к другому процессу"""
+    bus = {}
+    node1 = ConnectionManager(broker=InProcessBroker(bus))
+    node2 = ConnectionManager(broker=InProcessBroker(bus))
+    chat_id, user_id = uuid4(), uuid4()
+    mine, other = FakeWebSocket(), FakeWebSocket()
+    await node1.connect(FakeWebSocket(), chat_id, uuid4())
+    await node2.connect(mine, chat_id, user_id)
+    await node2.connect(other, chat_id, uuid4())
+
+    await node1.send_message({"error": "x"}, chat_id, recipient_id=user_id)
+    await wait_delivery()
+
+    assert mine.sent == [{"error": "x"}]
+    assert other.sent == []
+
+
+@pytest.mark.asyncio
+async def test_redis_broker(redis_server):
+    """Два процесса обмениваются сообщениями через Redis, чужие чаты не получают"""
+    url = f"redis://127.0.0.1:{redis_server.port}"
+    node1 = ConnectionManager(broker=RedisBroker(url))
+    node2 = ConnectionManager(broker=RedisBroker(url))
+    await node1.start()
+    await node2.start()
+    try:
+        chat_id, other_chat_id = uuid4(), uuid4()
+        ws1, ws2, ws3 = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        await node1.connect(ws1, chat_id, uuid4())
+        await node2.connect(ws2, chat_id, uuid4())
+        await node2.connect(ws3, other_chat_id, uuid4())
+        await wait_delivery()
+
+        await node1.send_message({"text": "hi"}, chat_id)
+        await wait_delivery(0.2)
+
+        assert ws1.sent == [{"text": "hi"}]
+        assert ws2.sent == [{"text": "hi"}]
+        assert ws3.sent == []
+    finally:
+        await node1.stop()
+        await node2.stop()
+
+
+async def redis_nodes(redis_server, url: str):
+    node1 = ConnectionManager(broker=RedisBroker(url))
+    node2 = ConnectionManager(broker=RedisBroker(url))
+    node2.broker.RECONNECT_DELAY = 0.01
+    await node1.start()
+    await node2.start()
+    return node1, node2
+
+
+@pytest.mark.asyncio
+async def test_redis_subscribe_error_resubscribes(redis_server):
+    """-LOADING на SUBSCRIBE (Redis после рестарта) не теряет подписку: брокер переподключается"""
+    node1, node2 = await redis_nodes(redis_server, f"redis://127.0.0.1:{redis_server.port}")
+    try:
+        chat_id = uuid4()
+        ws = FakeWebSocket()
+        redis_server.loading = 1
+        await node2.connect(ws, chat_id, uuid4())
+        await wait_delivery(0.2)
+
+        await node1.send_message({"text": "hi"}, chat_id)
+        await wait_delivery(0.2)
+        assert ws.sent == [{"text": "hi"}]
+    finally:
+        await node1.stop()
+        await node2.stop()
+
+
+@pytest.mark.asyncio
+async def test_redis_auth_error_on_reconnect(redis_server):
+    """Ошибка AUTH при переподключении не останавливает задачу подписки: попытки повторяются"""
+    node1, node2 = await redis_nodes(redis_server, f"redis://:secret@127.0.0.1:{redis_server.port}")
+    try:
+        chat_id = uuid4()
+        ws = FakeWebSocket()
+        await node2.connect(ws, chat_id, uuid4())
+        await wait_delivery()
+        redis_server.auth_errors = 2
+        redis_server.drop_clients()
+        await wait_delivery(0.3)
+
+        await node1.send_message({"text": "hi"}, chat_id)
+        await wait_delivery(0.2)
+        assert ws.sent == [{"text": "hi"}]
+    finally:
+        await node1.stop()
+        await node2.stop()
+
+
+@pytest.mark.asyncio
+async def test_postgres_broker():
+    """Два процесса обмениваются сообщениями через LISTEN/NOTIFY тестовой базы"""
+    dsn = (f"postgresql://{os.getenv('TG_DB_USER')}:{os.getenv('TG_DB_PASSWORD')}@{os.getenv('TG_DB_HOST')}:"
+           f"{os.getenv('TG_DB_PORT')}/{os.getenv('TG_DB_TEST_NAME')}")
+    node1 = ConnectionManager(broker=PostgresBroker(dsn))
+    node2 = ConnectionManager(broker=PostgresBroker(dsn))
+    await node1.start()
+    await node2.start()
+    try:
+        chat_id = uuid4()
+        ws1, ws2 = FakeWebSocket(), FakeWebSocket()
+        await node1.connect(ws1, chat_id, uuid4())
+        await node2.connect(ws2, chat_id, uuid4())
+
+        await node1.send_message({"text": "hi"}, chat_id)
+        await wait_delivery(0.5)
+
+        assert ws1.sent == [{"text": "hi"}]
+        assert ws2.sent == [{"text": "hi"}]
+    finally:
+        await node1.stop()
+        await node2.stop()
+
+
+class FakeListenConnection:
+    """Заглушка соединения asyncpg для LISTEN: помнит каналы и умеет обрываться"""
+
+    def __init__(self):
+        self.listeners = {}
+        self.termination_listeners = []
+        self.alive = True
+
+    async def add_listener(self, channel, callback):
+        if not self.alive:
+            raise ConnectionError("closed")
+        self.listeners[channel] = callback
+
+    async def remove_listener(self, channel, callback):
+        self.listeners.pop(channel, None)
+
+    def add_termination_listener(self, callback):
+        self.termination_listeners.append(callback)
+
+    def remove_termination_listener(self, callback):
+        self.termination_listeners.remove(callback)
+
+    async def execute(self, query):
+        if not self.alive:
+            raise ConnectionError("closed")
+
+    def notify(self, channel, payload):
+        self.listeners[channel](self, 0, channel, payload)
+
+    def drop(self):
+        self.alive = False
+        for callback in self.termination_listeners:
+            callback(self)
+
+    def terminate(self):
+        self.alive = False
+
+    async def close(self):
+        self.alive = False
+
+
+@pytest.mark.asyncio
+async def test_postgres_broker_reconnects(monkeypatch):
+    """После обрыва соединения LISTEN брокер переподключается и снова слушает все свои каналы"""
+    import asyncpg
+    connections = []
+
+    async def connect(dsn):
+        connections.append(FakeListenConnection())
+        return connections[-1]
+
+    async def create_pool(dsn, **kwargs):
+        return None
+
+    monkeypatch.setattr(asyncpg, "connect", connect)
+    monkeypatch.setattr(asyncpg, "create_pool", create_pool)
+    broker = PostgresBroker("postgresql://test")
+    broker.RECONNECT_DELAY = 0.01
+    received = []
+
+    async def handler(channel, data):
+        received.append((channel, data))
+
+    broker.set_handler(handler)
+    await broker.start()
+    try:
+        await broker.subscribe("chat:1")
+        connections[0].drop()
+        await broker.subscribe("chat:2")  # во время обрыва: подпишется после переподключения
+        await wait_delivery(0.1)
+
+        assert len(connections) == 2
+        assert set(connections[1].listeners) == {"chat:1", "chat:2"}
+        connections[1].notify("chat:2", "hi")
+        await wait_delivery()
+        assert received == [("chat:2", "hi")]
+    finally:
+        await broker.stop()
+
+
+@pytest.mark.asyncio
+async def test_single_process_broker_not_published(monkeypatch):
+    """Брокер без других процессов не получает публикаций: рассылка остается локальной"""
+    cm = ConnectionManager()
+    published = []
+
+    async def publish(channel, data):
+        published.append(channel)
+
+    monkeypatch.setattr(cm.broker, "publish", publish)
+    chat_id, user_id = uuid4(), uuid4()
+    await cm.connect(FakeWebSocket(), chat_id, user_id)
+
+    await cm.send_message({"text": "hi"}, chat_id)
+    await cm.send_to_user({"event": "x"}, user_id)
+
+    assert published == []
@@ -0,0 +1,35 @@
+import time
+
+from app.services.cache import TTLCache
+
+
+def test_ttl_expire(monkeypatch):
+    """Запись пропадает по истечении ttl"""
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = TTLCache(ttl=10)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    now[0] += 11
+    assert cache.get("a") is None
+    assert "a" not in cache
+
+
+def test_lru_evicts_least_recently_used():
+    """При переполнении вытесняется давно не использованная запись"""
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert "a" in cache and "c" in cache
+    assert "b" not in cache
+
+
+def test_pop_invalidates():
+    """Явная инвалидация"""
+    cache = TTLCache()
+    cache.set("a", False)
+    assert cache.get("a", "нет") is False
+    assert cache.pop("a") is False
+    assert cache.get("a", "нет") == "нет"
@@ -1,4 +1,5 @@
 import uuid
+from datetime import UTC, datetime, timedelta
 
 import pytest
 from fastapi import status
@@ -204,6 +205,35 @@ async def test_chat_history(client, auth_headers, personal_chat, test_user, db_s
     assert messages[0]["text"] == "Hello"
 
 
+@pytest.mark.asyncio
+async def test_chat_history_cursor(client, auth_headers, personal_chat, test_user, db_session):
+    """История по курсору: от новых к старым, before листает назад, after - вперед, без пропусков и повторов"""
+    base = datetime(2025, 1, 1, tzinfo=UTC)
+    for i in range(25):
+        db_session.add(Message(chat_id=personal_chat.id, sender_id=test_user.id, text=f"m{i}",
+                               timestamp=base + timedelta(minutes=i)))
+    await db_session.commit()
+    url = f"/chat/{personal_chat.id}/history/"
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        pages = [(await ac.post(url, params={"limit": 10}, headers=auth_headers)).json()]
+        while pages[-1]["next_cursor"]:
+            pages.append((await ac.post(url, params={"limit": 10, "before": pages[-1]["next_cursor"],
+                                                     "with_total": False}, headers=auth_headers)).json())
+        newer = (await ac.post(url, params={"limit": 10, "after": pages[-1]["prev_cursor"]},
+                               headers=auth_headers)).json()
+        bad = await ac.post(url, params={"before": "мусор"}, headers=auth_headers)
+
+    texts = [message["text"] for page in pages for message in page["messages"]]
+    assert texts == [f"m{i}" for i in range(24, -1, -1)]
+    assert [len(page["messages"]) for page in pages] == [10, 10, 5]
+    assert pages[0]["total"] == 25 and pages[0]["prev_cursor"] is None
+    assert pages[1]["total"] is None
+    assert [message["text"] for message in newer["messages"]] == [f"m{i}" for i in range(14, 4, -1)]
+    assert bad.status_code == status.HTTP_400_BAD_REQUEST
+
+
 @pytest.mark.asyncio
 async def test_remove_members_from_group_chat_success(
         client, auth_headers, group_chat, test_user, test_user2, db_session
@@ -231,6 +261,27 @@ async def test_remove_members_from_group_chat_success(
     assert str(test_user.id) in [str(m.user_id) for m in members]
 
 
+@pytest.mark.asyncio
+async def test_remove_members_invalidates_membership_cache(
+        client, auth_headers, group_chat, test_user, test_user2, db_session
+):
+    """Удаленный участник сразу теряет доступ, хотя состав чата уже был в кеше"""
+    note = await GroupMember.first(chat_id=group_chat.id, user_id=test_user.id, session=db_session)
+    note.is_admin = True
+    db_session.add(note)
+    await db_session.commit()
+    assert await is_user_in_chat(test_user2, group_chat, db_session)  # состав попал в кеш
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        response = await ac.patch(f"/chat/{group_chat.id}/members/", json={"member_ids": [str(test_user2.id)]},
+                                  headers=auth_headers)
+    assert response.status_code == 200
+    with pytest.raises(HTTPException) as exc_info:
+        await is_user_in_chat(test_user2, group_chat, db_session)
+    assert exc_info.value.status_code == 403
+
+
 @pytest.mark.asyncio
 async def test_remove_members_from_personal_chat(
         client, auth_headers, personal_chat, test_user, test_user2
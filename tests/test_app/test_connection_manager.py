@@ -0,0 +1,333 @@
+import asyncio
+import json
+import time
+from uuid import uuid4
+
+import pytest
+
+from app.services.websocket import Connection, ConnectionManager, OverflowPolicy
+
+
+class FakeWebSocket:
+    """Заглушка веб-сокета: копит отправленные сообщения, умеет тормозить или падать"""
+
+    def __init__(self, delay: float = 0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.sent = []
+        self.accepted = False
+        self.closed_code = None
+
+    async def accept(self):
+        self.accepted = True
+
+    async def send_text(self, data):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("socket is dead")
+        self.sent.append(json.loads(data))
+
+    async def close(self, code: int = 1000):
+        self.closed_code = code
+
+
+async def wait_delivery(timeout: float = 0.05):
+    """Дать задачам-писателям разобрать очереди"""
+    await asyncio.sleep(timeout)
+
+
+@pytest.mark.asyncio
+async def test_send_message_all_members():
+    """Сообщение получают все сокеты чата"""
+    cm = ConnectionManager()
+    chat_id = uuid4()
+    sockets = [FakeWebSocket() for _ in range(5)]
+    for ws in sockets:
+        await cm.connect(ws, chat_id, uuid4())
+
+    result = await cm.send_message({"text": "hi"}, chat_id)
+    await wait_delivery()
+
+    assert result.queued == 5
+    assert result.dropped == []
+    assert all(ws.sent == [{"text": "hi"}] for ws in sockets)
+
+
+@pytest.mark.asyncio
+async def test_send_message_recipient_only():
+    """При recipient_id сообщение уходит только этому пользователю"""
+    cm = ConnectionManager()
+    chat_id, user_id = uuid4(), uuid4()
+    mine, other = FakeWebSocket(), FakeWebSocket()
+    await cm.connect(mine, chat_id, user_id)
+    await cm.connect(other, chat_id, uuid4())
+
+    result = await cm.send_message({"error": "x"}, chat_id, recipient_id=user_id)
+    await wait_delivery()
+
+    assert result.queued == 1
+    assert mine.sent == [{"error": "x"}]
+    assert other.sent == []
+
+
+@pytest.mark.asyncio
+async def test_send_message_unknown_chat():
+    """Рассылка в чат без соединений ничего не делает"""
+    cm = ConnectionManager()
+    result = await cm.send_message({"text": "hi"}, uuid4())
+    assert result.queued == 0
+    assert result.dropped == []
+
+
+@pytest.mark.asyncio
+async def test_send_message_does_not_wait_network():
+    """Отправитель не ждет сеть получателей: сообщение только ставится в очередь"""
+    cm = ConnectionManager()
+    chat_id = uuid4()
+    await cm.connect(FakeWebSocket(delay=5), chat_id, uuid4())
+
+    started = time.perf_counter()
+    result = await cm.send_message({"text": "hi"}, chat_id)
+
+    assert time.perf_counter() - started < 0.1
+    assert result.queued == 1
+
+
+@pytest.mark.asyncio
+async def test_slow_socket_dropped_without_blocking_others():
+    """Медленный сокет отключается по таймауту и не задерживает остальных"""
+    cm = ConnectionManager(send_timeout=0.1)
+    chat_id, slow_user = uuid4(), uuid4()
+    slow = FakeWebSocket(delay=5)
+    fast = [FakeWebSocket() for _ in range(10)]
+    await cm.connect(slow, chat_id, slow_user)
+    for ws in fast:
+        await cm.connect(ws, chat_id, uuid4())
+
+    await cm.send_message({"text": "hi"}, chat_id)
+    await wait_delivery()
+    assert all(ws.sent == [{"text": "hi"}] for ws in fast)
+
+    await wait_delivery(0.2)
+    assert slow.closed_code == 1011
+    assert slow_user not in cm.active_connections[chat_id]
+    assert slow not in cm.connections
+
+
+@pytest.mark.asyncio
+async def test_dead_socket_dropped():
+    """Сокет, упавший с ошибкой, отключается"""
+    cm = ConnectionManager()
+    chat_id, user_id = uuid4(), uuid4()
+    dead = FakeWebSocket(fail=True)
+    await cm.connect(dead, chat_id, user_id)
+
+    await cm.send_message({"text": "hi"}, chat_id)
+    await wait_delivery()
+
+    assert chat_id not in cm.active_connections
+    result = await cm.send_message({"text": "hi"}, chat_id)
+    assert result.queued == 0
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limit():
+    """Одновременно пишем не более чем в max_concurrency сокетов"""
+    cm = ConnectionManager(max_concurrency=3)
+    chat_id = uuid4()
+    in_flight = 0
+    peak = 0
+
+    class CountingWebSocket(FakeWebSocket):
+        async def send_text(self, data):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+    for _ in range(10):
+        await cm.connect(CountingWebSocket(), chat_id, uuid4())
+
+    result = await cm.send_message({"text": "hi"}, chat_id)
+    await wait_delivery(0.1)
+
+    assert result.queued == 10
+    assert peak == 3
+
+
+@pytest.mark.asyncio
+async def test_overflow_drop_oldest():
+    """При переполнении очереди выбрасываются самые старые сообщения"""
+    cm = ConnectionManager(queue_size=3, overflow_policy=OverflowPolicy.DROP_OLDEST)
+    chat_id = uuid4()
+    ws = FakeWebSocket(delay=0.01)
+    await cm.connect(ws, chat_id, uuid4())
+
+    for i in range(10):
+        await cm.send_message({"n": i}, chat_id)
+    assert cm.connections[ws].pending == 3
+    await wait_delivery(0.2)
+
+    assert ws.sent == [{"n": 7}, {"n": 8}, {"n": 9}]
+
+
+@pytest.mark.asyncio
+async def test_overflow_disconnect():
+    """При политике disconnect медленный клиент отключается и попадает в отчет"""
+    cm = ConnectionManager(queue_size=2, overflow_policy=OverflowPolicy.DISCONNECT)
+    chat_id, user_id = uuid4(), uuid4()
+    ws = FakeWebSocket(delay=0.5)
+    await cm.connect(ws, chat_id, user_id)
+
+    for i in range(2):
+        assert (await cm.send_message({"n": i}, chat_id)).queued == 1
+    result = await cm.send_message({"n": 2}, chat_id)
+    assert result.dropped == [(user_id, ws)]
+
+    await wait_delivery(0.7)
+    assert ws.closed_code == 1011
+    assert ws not in cm.connections
+
+
+@pytest.mark.asyncio
+async def test_overflow_disconnect_during_send():
+    """Очередь, переполненная, пока писатель ждет отправки, тоже отключает клиента"""
+    cm = ConnectionManager(queue_size=2, overflow_policy=OverflowPolicy.DISCONNECT)
+    chat_id, user_id = uuid4(), uuid4()
+    ws = FakeWebSocket(delay=0.1)
+    await cm.connect(ws, chat_id, user_id)
+
+    await cm.send_message({"n": 0}, chat_id)
+    await wait_delivery(0.01)  # писатель взял первое сообщение и ждет сокет
+    for i in range(1, 3):
+        assert (await cm.send_message({"n": i}, chat_id)).queued == 1
+    result = await cm.send_message({"n": 3}, chat_id)
+    assert result.dropped == [(user_id, ws)]
+
+    await wait_delivery(0.3)
+    assert ws.closed_code == 1011
+    assert ws not in cm.connections
+    assert (await cm.send_message({"n": 4}, chat_id)).queued == 0
+
+
+@pytest.mark.asyncio
+async def test_overflow_coalesce_receipts():
+    """При переполнении уведомления о прочтении склеиваются в одно событие messages_read"""
+    cm = ConnectionManager(queue_size=3, overflow_policy=OverflowPolicy.COALESCE_RECEIPTS)
+    chat_id, reader = str(uuid4()), str(uuid4())
+    # соединение без задачи-писателя: очередь никто не разбирает
+    connection = Connection(FakeWebSocket(), uuid4(), cm)
+
+    connection.put({"text": "hi"})
+    for message_id in ("m1", "m2", "m3"):
+        connection.put({"action": "message_read", "chat_id": chat_id,
+                        "message_id": message_id, "read_by_user_id": reader})
+
+    assert [message for message, _ in connection._queue] == [
+        {"text": "hi"},
+        {"action": "messages_read", "chat_id": chat_id, "read_by_user_id": reader,
+         "message_ids": ["m1", "m2"]},
+        {"action": "message_read", "chat_id": chat_id, "message_id": "m3", "read_by_user_id": reader},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_broadcast_encoded_once(monkeypatch):
+    """Сообщение сериализуется один раз на рассылку, а не на каждый сокет"""
+    from app.services import websocket as ws_module
+    encoded = []
+    original = ws_module.json_dumps
+
+    def counting_dumps(data):
+        encoded.append(data)
+        return original(data)
+
+    monkeypatch.setattr(ws_module, "json_dumps", counting_dumps)
+    cm = ConnectionManager()
+    chat_id = uuid4()
+    sockets = [FakeWebSocket() for _ in range(20)]
+    for ws in sockets:
+        await cm.connect(ws, chat_id, uuid4())
+
+    await cm.send_message({"text": "привет"}, chat_id)
+    await wait_delivery()
+
+    # брокер по умолчанию без других процессов: конверт для него не кодируется
+    assert encoded == [{"text": "привет"}]
+    assert all(ws.sent == [{"text": "привет"}] for ws in sockets)
+
+
+@pytest.mark.asyncio
+async def test_send_to_user_all_chats():
+    """Сообщение пользователю уходит во все его сокеты, в каком бы чате они ни были"""
+    cm = ConnectionManager()
+    user_id = uuid4()
+    in_chat1, in_chat2, stranger = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+    chat1, chat2 = uuid4(), uuid4()
+    await cm.connect(in_chat1, chat1, user_id)
+    await cm.connect(in_chat2, chat2, user_id)
+    await cm.connect(stranger, chat1, uuid4())
+
+    result = await cm.send_to_user({"event": "x"}, str(user_id))
+    await wait_delivery()
+
+    assert result.queued == 2
+    assert in_chat1.sent == [{"event": "x"}]
+    assert in_chat2.sent == [{"event": "x"}]
+    assert stranger.sent == []
+
+
+@pytest.mark.asyncio
+async def test_send_to_user_chat_filters():
+    """chat_id ограничивает доставку сокетами чата, exclude_chat_id исключает их"""
+    cm = ConnectionManager()
+    user_id, chat1, chat2 = uuid4(), uuid4(), uuid4()
+    in_chat1, in_chat2 = FakeWebSocket(), FakeWebSocket()
+    await cm.connect(in_chat1, chat1, user_id)
+    await cm.connect(in_chat2, chat2, user_id)
+
+    await cm.send_to_user({"only": 1}, user_id, chat_id=chat1)
+    await cm.send_to_user({"except": 1}, user_id, exclude_chat_id=chat1)
+    await wait_delivery()
+
+    assert in_chat1.sent == [{"only": 1}]
+    assert in_chat2.sent == [{"except": 1}]
+
+
+@pytest.mark.asyncio
+async def test_user_index_cleaned_on_disconnect():
+    """После отключения последнего сокета пользователь пропадает из индекса"""
+    cm = ConnectionManager()
+    user_id, chat_id = uuid4(), uuid4()
+    ws = FakeWebSocket()
+    await cm.connect(ws, chat_id, user_id)
+    assert cm.user_connections[user_id] == {ws}
+
+    cm.disconnect(ws)
+
+    assert user_id not in cm.user_connections
+
+
+@pytest.mark.asyncio
+async def test_one_socket_many_chats():
+    """Один сокет, подписанный на два чата, получает сообщения обоих, после отписки - только одного"""
+    cm = ConnectionManager()
+    user_id, chat1, chat2 = uuid4(), uuid4(), uuid4()
+    ws = FakeWebSocket()
+    await cm.register(ws, user_id)
+    await cm.subscribe(ws, chat1)
+    await cm.subscribe(ws, chat2)
+
+    await cm.send_message({"chat": 1}, chat1)
+    await cm.send_message({"chat": 2}, chat2)
+    await wait_delivery()
+    assert ws.sent == [{"chat": 1}, {"chat": 2}]
+
+    cm.unsubscribe(ws, chat2)
+    await cm.send_message({"chat": 2}, chat2)
+    await wait_delivery()
+    assert ws.sent == [{"chat": 1}, {"chat": 2}]
+    assert chat2 not in cm.active_connections
+    assert cm.connections[ws].chat_ids == {chat1}
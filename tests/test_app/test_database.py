@@ -0,0 +1,28 @@
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+
+from app.config import settings
+from app.database import DATABASE_URL, engine, engine_options
+
+
+def test_engine_defaults():
+    """По умолчанию SQL не выводится в лог, размер пула и таймауты - из настроек"""
+    assert engine.echo is False
+    assert isinstance(engine.pool, AsyncAdaptedQueuePool)
+    assert engine.pool.size() == settings.TG_DB_POOL_SIZE
+    options = engine_options()
+    assert options["pool_pre_ping"] is settings.TG_DB_POOL_PRE_PING
+    assert options["connect_args"]["command_timeout"] == settings.TG_DB_COMMAND_TIMEOUT
+
+
+def test_engine_pgbouncer_mode():
+    """Режим pgbouncer: без своего пула и без подготовленных выражений"""
+    pgbouncer = settings.model_copy(update={"TG_DB_PGBOUNCER": True, "TG_DB_POOL_SIZE": 50})
+    options = engine_options(pgbouncer)
+    assert "pool_size" not in options
+    assert options["connect_args"]["statement_cache_size"] == 0
+    name_func = options["connect_args"]["prepared_statement_name_func"]
+    assert name_func() != name_func()
+
+    bouncer_engine = create_async_engine(DATABASE_URL, **options)
+    assert isinstance(bouncer_engine.pool, NullPool)
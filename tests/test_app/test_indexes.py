@@ -0,0 +1,84 @@
+import uuid
+from datetime import UTC, datetime
+
+import pytest
+from sqlalchemy import func, join, select, text, tuple_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from app.models.models import Chat, GroupMember, IssuedJWTToken, Message, MessageRead, User
+
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN (FORMAT JSON) для запроса SQLAlchemy с обычной передачей параметров"""
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain, "postgresql")
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+def plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+CHAT_ID, USER_ID, MESSAGE_ID, JTI = uuid.uuid4(), uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+CURSOR = (datetime(2025, 1, 1, tzinfo=UTC), uuid.uuid4())
+
+# форма каждого горячего запроса: routes/chat.py, routes/websocket.py, handlers/ws_chat.py, auth
+HOT_QUERIES = {
+    "history": select(Message).filter(Message.chat_id == CHAT_ID)
+    .order_by(Message.timestamp.desc(), Message.id.desc()).limit(11),
+    "history_before": select(Message).filter(Message.chat_id == CHAT_ID)
+    .filter(tuple_(Message.timestamp, Message.id) < tuple_(*CURSOR))
+    .order_by(Message.timestamp.desc(), Message.id.desc()).limit(11),
+    "history_after": select(Message).filter(Message.chat_id == CHAT_ID)
+    .filter(tuple_(Message.timestamp, Message.id) > tuple_(*CURSOR))
+    .order_by(Message.timestamp.asc(), Message.id.asc()).limit(11),
+    "history_total": select(func.count()).select_from(Message).filter(Message.chat_id == CHAT_ID),
+    "unread_count": select(func.count()).select_from(Message)
+    .where(Message.chat_id == CHAT_ID, Message.sender_id != USER_ID, Message.timestamp > CURSOR[0]),
+    "message_by_id": select(Message).filter_by(id=MESSAGE_ID),
+    "chat_members": select(GroupMember).filter_by(chat_id=CHAT_ID),
+    "read_floor": select(GroupMember.user_id, GroupMember.last_read_at).where(GroupMember.chat_id == CHAT_ID)
+    .order_by(GroupMember.last_read_at.asc().nulls_first()).limit(2),
+    "read_by_all": select(Message.id, Message.sender_id, Message.timestamp)
+    .where(Message.chat_id == CHAT_ID, Message.sender_id.is_distinct_from(USER_ID),
+           Message.timestamp > CURSOR[0], Message.timestamp <= datetime(2025, 2, 1, tzinfo=UTC))
+    .order_by(Message.timestamp.desc(), Message.id.desc()).limit(500),
+    "chat_admins": select(GroupMember).filter_by(is_admin=True, chat_id=CHAT_ID),
+    "members_to_remove": select(GroupMember).where(GroupMember.chat_id == CHAT_ID,
+                                                   GroupMember.user_id.in_([USER_ID, uuid.uuid4()])),
+    "membership_load": select(Chat.name, Chat.is_group, GroupMember.user_id, GroupMember.is_admin)
+    .select_from(Chat).outerjoin(GroupMember, GroupMember.chat_id == Chat.id).where(Chat.id == CHAT_ID),
+    "membership_check": select(Chat).select_from(join(Chat, GroupMember, Chat.id == GroupMember.chat_id))
+    .where(Chat.id == CHAT_ID).where(GroupMember.user_id == USER_ID),
+    "message_read_exists": select(MessageRead).filter_by(message_id=MESSAGE_ID, user_id=USER_ID),
+    "message_read_count": select(func.count()).select_from(MessageRead).where(MessageRead.message_id == MESSAGE_ID),
+    "check_revoked": select(IssuedJWTToken).filter_by(jti=JTI, revoked=True),
+    # UPDATE ... WHERE при выходе с устройства ищет строки так же
+    "revoke_device": select(IssuedJWTToken).where(IssuedJWTToken.user_id == USER_ID,
+                                                  IssuedJWTToken.device_id == "device"),
+    "token_gc": select(IssuedJWTToken.jti).where(IssuedJWTToken.expired_time < CURSOR[0]).limit(1000),
+    "user_by_email": select(User).filter_by(email="test@example.com"),
+}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", HOT_QUERIES)
+async def test_hot_query_uses_index(db_session, name):
+    """
+    Горячие запросы идут по индексам. На пустых таблицах планировщик и так выбрал бы
+    полный просмотр, поэтому он запрещается: если подходящего индекса нет, в плане все равно будет Seq Scan.
+    """
+    await db_session.execute(text("SET enable_seqscan = off"))
+    result = await db_session.execute(Explain(HOT_QUERIES[name]))
+    plan = result.scalar_one()[0]["Plan"]
+    scans = [node for node in plan_nodes(plan) if node["Node Type"] == "Seq Scan"]
+    assert not scans, f"{name}: полный просмотр {[node['Relation Name'] for node in scans]}"
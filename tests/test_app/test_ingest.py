@@ -0,0 +1,113 @@
+import asyncio
+from uuid import uuid4
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app.services.ingest import MessageIngest
+
+
+class FakeIngest(MessageIngest):
+    """Пакетная запись без базы: запоминает пакеты, дубли определяет по уже записанным id"""
+
+    def __init__(self, delay: float = 0, fail: bool = False, **kwargs):
+        super().__init__(session_factory=None, **kwargs)
+        self.delay = delay
+        self.fail = fail
+        self.batches = []
+        self.stored = {}
+        self.committed = False
+
+    async def _write(self, rows):
+        self.batches.append(rows)
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("db is down")
+        if any(row.get("bad") for row in rows):
+            raise IntegrityError("INSERT INTO messages", {}, Exception("foreign key violation"))
+        existing = {row["id"]: self.stored[row["id"]] for row in rows if row["id"] in self.stored}
+        inserted = set()
+        for row in rows:
+            if row["id"] not in self.stored:
+                self.stored[row["id"]] = row
+                inserted.add(row["id"])
+        self.committed = True
+        return inserted, existing
+
+
+@pytest.mark.asyncio
+async def test_concurrent_messages_one_batch():
+    """Сообщения, пришедшие одновременно, пишутся одним пакетом"""
+    ingest = FakeIngest(max_delay=0.01)
+    results = await asyncio.gather(*(ingest.submit({"id": uuid4()}) for _ in range(100)))
+
+    assert all(result.created for result in results)
+    assert len(ingest.batches) == 1
+    assert len(ingest.batches[0]) == 100
+
+
+@pytest.mark.asyncio
+async def test_batch_size_limit():
+    """Пакет не больше max_batch, полный пакет пишется без ожидания таймера"""
+    ingest = FakeIngest(max_delay=10, max_batch=10)
+    await asyncio.wait_for(asyncio.gather(*(ingest.submit({"id": uuid4()}) for _ in range(30))), timeout=1)
+
+    assert [len(batch) for batch in ingest.batches] == [10, 10, 10]
+
+
+@pytest.mark.asyncio
+async def test_ack_after_commit():
+    """Отправитель получает ответ только после коммита своего пакета"""
+    ingest = FakeIngest(max_delay=0.001, delay=0.05)
+    task = asyncio.create_task(ingest.submit({"id": uuid4()}))
+    await asyncio.sleep(0.02)
+    assert not task.done()
+
+    assert (await task).created
+    assert ingest.committed
+
+
+@pytest.mark.asyncio
+async def test_duplicates():
+    """Повтор id - в том же пакете или позже - ничего не пишет и возвращает исходное сообщение"""
+    ingest = FakeIngest(max_delay=0.001)
+    message_id = uuid4()
+    first, second = await asyncio.gather(ingest.submit({"id": message_id, "text": "первое"}),
+                                         ingest.submit({"id": message_id, "text": "повтор"}))
+    assert (first.created, second.created) == (True, False)
+    assert second.values["text"] == "первое"
+
+    retry = await ingest.submit({"id": message_id, "text": "еще повтор"})
+    assert retry.created is False
+    assert retry.values["text"] == "первое"
+
+
+@pytest.mark.asyncio
+async def test_write_error_reaches_all_senders():
+    """Недоступная база: ошибка сразу доходит до каждого отправителя, без повторов по одной строке"""
+    ingest = FakeIngest(max_delay=0.001, fail=True)
+    results = await asyncio.gather(*(ingest.submit({"id": uuid4()}) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(ingest.batches) == 1
+
+
+@pytest.mark.asyncio
+async def test_bad_row_fails_only_its_sender():
+    """Пакет с плохой строкой делится пополам: остальные отправители получают подтверждение"""
+    ingest = FakeIngest(max_delay=0.001)
+    rows = [{"id": uuid4()}, {"id": uuid4(), "bad": True}, {"id": uuid4()}]
+    results = await asyncio.gather(*(ingest.submit(row) for row in rows), return_exceptions=True)
+    assert results[0].created and results[2].created
+    assert isinstance(results[1], IntegrityError)
+    assert set(ingest.stored) == {rows[0]["id"], rows[2]["id"]}
+    assert [len(batch) for batch in ingest.batches] == [3, 1, 2, 1, 1]
+
+
+@pytest.mark.asyncio
+async def test_stop_flushes_pending():
+    """При остановке накопленный пакет дописывается, не дожидаясь таймера"""
+    ingest = FakeIngest(max_delay=10)
+    task = asyncio.create_task(ingest.submit({"id": uuid4()}))
+    await asyncio.sleep(0)
+    await ingest.stop()
+    assert (await task).created
@@ -0,0 +1,129 @@
+import asyncio
+import time
+from uuid import uuid4
+
+import pytest
+
+from app.services.broker import InProcessBroker
+from app.services.membership import ChatMembership, MembershipCache
+
+
+class FakeMembershipCache(MembershipCache):
+    """Кеш без базы: состав чатов в словаре, считает обращения к "базе\""""
+
+    def __init__(self, chats: dict, delay: float = 0, **kwargs):
+        super().__init__(**kwargs)
+        self.chats = chats
+        self.delay = delay
+        self.loads = 0
+
+    async def _load(self, chat_id, session, replica_ok=False):
+        self.loads += 1
+        await asyncio.sleep(self.delay)
+        if chat_id not in self.chats:
+            return None
+        members, admins = self.chats[chat_id]
+        return ChatMembership(chat_id, "chat", True, frozenset(members), frozenset(admins))
+
+
+@pytest.mark.asyncio
+async def test_repeated_checks_hit_cache():
+    """Повторные проверки участия и прав администратора не ходят в базу"""
+    chat_id, admin, member, stranger = uuid4(), uuid4(), uuid4(), uuid4()
+    cache = FakeMembershipCache({chat_id: ({admin, member}, {admin})})
+
+    for _ in range(10):
+        assert await cache.is_member(chat_id, member, session=None)
+        assert not await cache.is_member(chat_id, stranger, session=None)
+        assert await cache.is_admin(chat_id, admin, session=None)
+        assert not await cache.is_admin(chat_id, member, session=None)
+    assert cache.loads == 1
+
+    membership = await cache.get(chat_id, session=None)
+    assert membership.chat().id == chat_id
+    assert {m.user_id: m.is_admin for m in membership.group_members()} == {admin: True, member: False}
+
+
+@pytest.mark.asyncio
+async def test_invalidate_reloads():
+    """После явного сброса состав читается заново"""
+    chat_id, user_id = uuid4(), uuid4()
+    chats = {chat_id: ({user_id}, set())}
+    cache = FakeMembershipCache(chats)
+    assert await cache.is_member(chat_id, user_id, session=None)
+
+    chats[chat_id] = (set(), set())
+    assert await cache.is_member(chat_id, user_id, session=None)  # до сброса - из кеша
+    await cache.invalidate(chat_id)
+    assert not await cache.is_member(chat_id, user_id, session=None)
+    assert cache.loads == 2
+
+
+@pytest.mark.asyncio
+async def test_load_racing_invalidate_not_cached():
+    """Загрузка, начатая до сброса, не кладет в кеш устаревший состав"""
+    chat_id, user_id = uuid4(), uuid4()
+    cache = FakeMembershipCache({chat_id: ({user_id}, set())}, delay=0.01)
+    loading = asyncio.create_task(cache.get(chat_id, session=None))
+    await asyncio.sleep(0)
+    await cache.invalidate(chat_id)
+    await loading
+
+    await cache.get(chat_id, session=None)
+    assert cache.loads == 2
+
+
+@pytest.mark.asyncio
+async def test_ttl_and_missing_chat(monkeypatch):
+    """Запись живет ttl секунд, отсутствующий чат не кешируется"""
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    chat_id = uuid4()
+    cache = FakeMembershipCache({chat_id: (set(), set())}, ttl=5, broker=InProcessBroker({}))
+
+    await cache.get(chat_id, session=None)
+    now[0] += 6
+    await cache.get(chat_id, session=None)
+    assert cache.loads == 2
+
+    assert await cache.get(uuid4(), session=None) is None
+
+
+@pytest.mark.asyncio
+async def test_invalidate_reaches_other_process():
+    """Сброс в одном процессе доходит через брокер до кеша другого процесса"""
+    chat_id, user_id = uuid4(), uuid4()
+    chats = {chat_id: ({user_id}, set())}
+    bus = {}
+    worker1 = FakeMembershipCache(chats, broker=InProcessBroker(bus))
+    worker2 = FakeMembershipCache(chats, broker=InProcessBroker(bus))
+    await worker1.start()
+    await worker2.start()
+    assert await worker2.is_member(chat_id, user_id, session=None)
+
+    chats[chat_id] = (set(), set())
+    await worker1.invalidate(chat_id)
+    assert not await worker2.is_member(chat_id, user_id, session=None)
+    assert worker2.loads == 2
+
+
+def test_local_broker_short_ttl():
+    """Без общего брокера сбросы до других воркеров не доходят, поэтому записи живут недолго"""
+    assert FakeMembershipCache({}, ttl=30, local_ttl=5)._cache.ttl == 5
+    assert FakeMembershipCache({}, ttl=30, local_ttl=5, broker=InProcessBroker({}))._cache.ttl == 30
+
+
+@pytest.mark.asyncio
+async def test_replica_load_short_ttl(monkeypatch):
+    """Состав, прочитанный с реплики, мог отстать от сброса: он живет не дольше local_ttl"""
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    chat_id = uuid4()
+    cache = FakeMembershipCache({chat_id: (set(), set())}, ttl=30, local_ttl=5, broker=InProcessBroker({}))
+
+    await cache.get(chat_id, session=None, replica_ok=True)
+    now[0] += 6
+    await cache.get(chat_id, session=None)
+    now[0] += 6
+    await cache.get(chat_id, session=None)
+    assert cache.loads == 2
@@ -0,0 +1,119 @@
+import uuid
+from datetime import UTC, datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.models import Chat, Message, MessageKey, MessageRead, User
+from app.services.ingest import MessageIngest
+from app.services.partitions import PartitionManager, add_months, month_start, partition_month, partition_name
+
+
+def test_month_helpers():
+    """Границы месяцев считаются в UTC и переходят через год"""
+    moment = datetime(2026, 1, 1, 2, 30, tzinfo=timezone(timedelta(hours=3)))  # 2025-12-31 23:30 UTC
+    assert month_start(moment) == datetime(2025, 12, 1, tzinfo=UTC)
+    assert add_months(datetime(2025, 12, 1, tzinfo=UTC), 1) == datetime(2026, 1, 1, tzinfo=UTC)
+    assert add_months(datetime(2026, 1, 1, tzinfo=UTC), -13) == datetime(2024, 12, 1, tzinfo=UTC)
+    assert partition_name(datetime(2026, 3, 1, tzinfo=UTC)) == "messages_p2026_03"
+    assert partition_month("messages_p2026_03") == datetime(2026, 3, 1, tzinfo=UTC)
+    assert partition_month("messages_default") is None
+
+
+def test_plan():
+    """Создаются недостающие секции на months_ahead вперед, отсоединяются старше retention_months"""
+    manager = PartitionManager(engine=None, months_ahead=2, retention_months=3)
+    month = lambda year, number: datetime(year, number, 1, tzinfo=UTC)
+    existing = {month(2025, 9), month(2025, 10), month(2025, 11), month(2026, 1)}
+    create, detach = manager.plan(existing, now=datetime(2026, 1, 20, tzinfo=UTC))
+    assert create == [month(2026, 2), month(2026, 3)]
+    assert detach == [month(2025, 9)]
+
+    _, detach = PartitionManager(engine=None, retention_months=0).plan(existing, now=datetime(2026, 1, 20, tzinfo=UTC))
+    assert detach == []
+
+
+async def partitions(db_session: AsyncSession) -> set[str]:
+    result = await db_session.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'messages'::regclass"
+    ))
+    return set(result.scalars())
+
+
+@pytest.mark.asyncio
+async def test_maintain(db_session: AsyncSession, db_engine):
+    """
+    Строки месяца без секции лежат в messages_default и переносятся при ее создании;
+    секции старше срока хранения отсоединяются и удаляются вместе с отметками о прочтении.
+    """
+    user = await User.create(username="test_partitions", email="test_partitions@y.ru", session=db_session)
+    chat = await Chat.create(name="partitions", session=db_session)
+    old = Message(chat_id=chat.id, sender_id=user.id, text="старое", timestamp=datetime(2020, 1, 15, tzinfo=UTC))
+    db_session.add(old)
+    await db_session.commit()
+    db_session.add(MessageRead(message_id=old.id, user_id=user.id))
+    await db_session.commit()
+    assert await db_session.scalar(text("SELECT count(*) FROM messages_default")) == 1
+    await db_session.commit()  # ATTACH и DETACH ждут, пока читающие транзакции отпустят секции
+
+    manager = PartitionManager(engine=db_engine, months_ahead=1, retention_months=2, drop_detached=True)
+    changes = await manager.maintain(now=datetime(2020, 1, 20, tzinfo=UTC))
+    assert changes.created == ["messages_p2020_01", "messages_p2020_02"]
+    assert changes.moved == 1
+    assert {"messages_p2020_01", "messages_p2020_02"} <= await partitions(db_session)
+    assert await db_session.scalar(text("SELECT count(*) FROM messages_default")) == 0
+    assert await db_session.scalar(text("SELECT count(*) FROM messages_p2020_01")) == 1
+    await db_session.commit()
+
+    assert (await manager.maintain(now=datetime(2020, 1, 25, tzinfo=UTC))).created == []
+
+    changes = await manager.maintain(now=datetime(2020, 4, 1, tzinfo=UTC))
+    assert changes.detached == changes.dropped == ["messages_p2020_01"]
+    assert "messages_p2020_01" not in await partitions(db_session)
+    assert await db_session.scalar(select(func.count()).select_from(Message).filter_by(id=old.id)) == 0
+    assert await db_session.scalar(select(func.count()).select_from(MessageKey).filter_by(id=old.id)) == 0
+    assert await db_session.scalar(select(func.count()).select_from(MessageRead).filter_by(message_id=old.id)) == 0
+
+
+@pytest.mark.asyncio
+async def test_detach_without_drop(db_session: AsyncSession, db_engine):
+    """Отсоединенная секция остается таблицей, а ключи ее сообщений и отметки о прочтении удаляются"""
+    user = await User.create(username="test_partitions", email="test_partitions@y.ru", session=db_session)
+    chat = await Chat.create(name="partitions", session=db_session)
+    manager = PartitionManager(engine=db_engine, months_ahead=0, retention_months=1, drop_detached=False)
+    await manager.maintain(now=datetime(2020, 1, 20, tzinfo=UTC))
+    old = Message(chat_id=chat.id, sender_id=user.id, text="старое", timestamp=datetime(2020, 1, 15, tzinfo=UTC))
+    db_session.add(old)
+    await db_session.commit()
+    db_session.add(MessageRead(message_id=old.id, user_id=user.id))
+    await db_session.commit()
+
+    try:
+        changes = await manager.maintain(now=datetime(2020, 3, 1, tzinfo=UTC))
+        assert changes.detached == ["messages_p2020_01"] and changes.dropped == []
+        assert await db_session.scalar(text("SELECT count(*) FROM messages_p2020_01")) == 1
+        assert await db_session.scalar(select(func.count()).select_from(MessageKey).filter_by(id=old.id)) == 0
+        assert await db_session.scalar(
+            select(func.count()).select_from(MessageRead).filter_by(message_id=old.id)) == 0
+    finally:
+        await db_session.execute(text("DROP TABLE IF EXISTS messages_p2020_01"))
+        await db_session.commit()
+
+
+@pytest.mark.asyncio
+async def test_ingest_duplicate_id_skipped(db_session: AsyncSession):
+    """Повтор id в секционированной messages пропускается триггером, а не обрывает пакет"""
+    user = await User.create(username="test_partitions", email="test_partitions@y.ru", session=db_session)
+    chat = await Chat.create(name="partitions", session=db_session)
+    ingest = MessageIngest(session_factory=lambda: db_session, max_delay=0.01)
+    message_id = uuid.uuid4()
+    first = await ingest.submit({"id": message_id, "chat_id": chat.id, "sender_id": user.id, "text": "раз",
+                                 "timestamp": datetime.now(UTC)})
+    # тот же id позже - строка попала бы в другую секцию, но ключ id уже занят
+    retry = await ingest.submit({"id": message_id, "chat_id": chat.id, "sender_id": user.id, "text": "два",
+                                 "timestamp": datetime.now(UTC) + timedelta(days=40)})
+    assert first.created and not retry.created
+    assert retry.values["text"] == "раз"
+    assert await db_session.scalar(select(func.count()).select_from(Message).filter_by(id=message_id)) == 1
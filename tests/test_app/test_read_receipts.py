@@ -0,0 +1,157 @@
+from datetime import UTC, datetime, timedelta
+from uuid import uuid4
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from app.handlers import ws_chat
+from app.models.models import GroupMember, Message, MessageRead
+from app.services.watermarks import ReadFloor
+from main import app
+
+
+@pytest.fixture
+def sent_events(monkeypatch):
+    """События, разосланные в чат"""
+    events = []
+
+    async def send_message(message, chat_id, recipient_id=None):
+        events.append(message)
+
+    async def send_to_user(message, user_id, chat_id=None, exclude_chat_id=None):
+        pass
+
+    monkeypatch.setattr(ws_chat.cm, "send_message", send_message)
+    monkeypatch.setattr(ws_chat.cm, "send_to_user", send_to_user)
+    return events
+
+
+@pytest.mark.asyncio
+async def test_group_read_counter(db_session, group_chat, test_user, test_user2, test_user3, sent_events):
+    """
+    Счетчик прочтений растет на одно прочтение участника, повтор не считается,
+    read_by_all уходит, когда прочитали все получатели.
+    """
+    db_session.add(GroupMember(user_id=test_user3.id, chat_id=group_chat.id))
+    await db_session.commit()
+    message = await Message.create(chat_id=group_chat.id, sender_id=test_user.id, text="Всем", session=db_session)
+
+    await ws_chat.read_in_group_chat(db_session, test_user2, message, group_chat)
+    await ws_chat.read_in_group_chat(db_session, test_user2, message, group_chat)  # повтор
+    await ws_chat.read_in_group_chat(db_session, test_user, message, group_chat)  # отправитель
+    await db_session.refresh(message)
+    await ws_chat.receipt_aggregator.stop()
+    assert message.read_count == 1
+    assert sent_events == []
+
+    await ws_chat.read_in_group_chat(db_session, test_user3, message, group_chat)
+    await db_session.refresh(message)
+    await ws_chat.receipt_aggregator.stop()
+    assert message.read_count == 2
+    assert len(await MessageRead.list(message_id=message.id, session=db_session)) == 2
+    # отметка двигает водяной знак: статус в истории совпадает со счетчиком
+    member = await GroupMember.first(chat_id=group_chat.id, user_id=test_user3.id, session=db_session)
+    await db_session.refresh(member)
+    assert member.last_read_at == message.timestamp
+    assert sent_events == [{"action": "message_read", "message_id": str(message.id),
+                            "chat_id": str(group_chat.id), "read_by_all": True}]
+
+
+@pytest.mark.asyncio
+async def test_mark_read_until(client, auth_headers, db_session, group_chat, test_user, test_user2, sent_events):
+    """
+    Водяной знак двигается только вперед, одно событие на продвижение,
+    непрочитанные считаются по водяному знаку.
+    """
+    base = datetime(2025, 1, 1, tzinfo=UTC)
+    messages = [Message(chat_id=group_chat.id, sender_id=test_user2.id, text=f"m{i}",
+                        timestamp=base + timedelta(minutes=i)) for i in range(5)]
+    db_session.add_all(messages)
+    await db_session.commit()
+
+    async def unread() -> dict:
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            response = await ac.get(f"/chat/{group_chat.id}/unread/", headers=auth_headers)
+        assert response.status_code == 200
+        return response.json()
+
+    assert (await unread())["unread"] == 5
+    data = {"chat_id": str(group_chat.id), "message_id": str(messages[2].id)}
+    assert await ws_chat.mark_read_until(None, db_session, test_user, data, group_chat) is True
+    assert (await unread())["unread"] == 2
+
+    # назад водяной знак не двигается
+    data = {"chat_id": str(group_chat.id), "message_id": str(messages[0].id)}
+    assert await ws_chat.mark_read_until(None, db_session, test_user, data, group_chat) is False
+    assert (await unread())["unread"] == 2
+    await ws_chat.receipt_aggregator.stop()
+    # test_user - единственный получатель: его водяной знак делает m0..m2 прочитанными всеми
+    assert sent_events == [
+        {"action": "read_until", "chat_id": str(group_chat.id), "message_id": str(messages[2].id),
+         "read_until": messages[2].timestamp.isoformat(), "read_by_user_id": str(test_user.id)},
+        {"action": "messages_read", "chat_id": str(group_chat.id), "read_by_all": True,
+         "message_ids": [str(message.id) for message in messages[:3]]},
+    ]
+
+
+def test_read_floor():
+    """Статус по водяным знакам: решает самый отстающий получатель, отправитель не в счет"""
+    sender, reader, slow = uuid4(), uuid4(), uuid4()
+    base = datetime(2025, 1, 1, tzinfo=UTC)
+    message = Message(sender_id=sender, timestamp=base + timedelta(minutes=1))
+
+    assert not ReadFloor(lowest=((slow, None), (sender, base))).read_by_all(message)
+    assert not ReadFloor(lowest=((sender, None), (slow, base))).read_by_all(message)
+    assert ReadFloor(lowest=((sender, None), (reader, base + timedelta(minutes=1)))).read_by_all(message)
+    assert ReadFloor(lowest=((sender, None),)).read_by_all(message)  # получателей нет
+    assert ReadFloor(lowest=((slow, None), (reader, base))).includes(slow)
+    assert ReadFloor(lowest=((slow, None), (reader, base))).horizon() == base  # сообщения slow
+    assert ReadFloor(lowest=((slow, None), (reader, None))).horizon() is None
+    assert not ReadFloor(lowest=((slow, None), (reader, base))).includes(sender)
+
+
+@pytest.fixture
+def user_events(monkeypatch):
+    """События, отправленные конкретным пользователям: [(user_id, event)]"""
+    events = []
+
+    async def send_to_user(message, user_id, chat_id=None, exclude_chat_id=None):
+        events.append((user_id, message))
+
+    monkeypatch.setattr(ws_chat.cm, "send_to_user", send_to_user)
+    return events
+
+
+@pytest.mark.asyncio
+async def test_messages_read_batch_group(db_session, group_chat, test_user, test_user2, sent_events, user_events):
+    """
+    messages_read: все отметки одним запросом, повторы и чужие id пропускаются,
+    одно событие на отправителя и одно read_by_all на пачку.
+    """
+    own = await Message.create(chat_id=group_chat.id, sender_id=test_user2.id, text="Свое", session=db_session)
+    messages = [await Message.create(chat_id=group_chat.id, sender_id=test_user.id, text=f"m{i}", session=db_session)
+                for i in range(3)]
+    ids = [str(message.id) for message in messages]
+    data = {"chat_id": str(group_chat.id), "message_ids": ids + [str(own.id), str(uuid4())]}
+
+    assert await ws_chat.read_messages(None, db_session, test_user2, data, group_chat) is True
+    assert await ws_chat.read_messages(None, db_session, test_user2, data, group_chat) is False  # повтор
+
+    assert len(await MessageRead.list(user_id=test_user2.id, session=db_session)) == 3
+    for message in messages:
+        await db_session.refresh(message)
+        assert message.read_count == 1
+    [(sender_id, event)] = user_events
+    assert sender_id == test_user.id
+    assert sorted(event["message_ids"]) == sorted(ids)
+    assert [sorted(event["message_ids"]) for event in sent_events if event.get("read_by_all")] == [sorted(ids)]
+
+
+@pytest.mark.asyncio
+async def test_messages_read_invalid(db_session, group_chat, test_user2, user_events):
+    """Пустой список и некорректные id отклоняются без записи"""
+    for message_ids in ([], "not-a-list", ["not-a-uuid"]):
+        data = {"chat_id": str(group_chat.id), "message_ids": message_ids}
+        assert await ws_chat.read_messages(None, db_session, test_user2, data, group_chat) is False
+    assert all("error" in event for _, event in user_events)
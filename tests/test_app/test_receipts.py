@@ -0,0 +1,77 @@
+import asyncio
+from uuid import uuid4
+
+import pytest
+
+from app.services.receipts import ReceiptAggregator
+
+
+class FakeManager:
+    """Менеджер соединений без сокетов: запоминает разосланные события"""
+
+    def __init__(self):
+        self.chat_events = []
+        self.user_events = []
+
+    async def send_message(self, message, chat_id, recipient_id=None):
+        self.chat_events.append((chat_id, message))
+
+    async def send_to_user(self, message, user_id, chat_id=None, exclude_chat_id=None):
+        self.user_events.append((user_id, message))
+
+
+@pytest.mark.asyncio
+async def test_receipts_coalesced_in_window():
+    """Отметки одного читателя за окно уходят одним событием messages_read"""
+    manager = FakeManager()
+    receipts = ReceiptAggregator(manager=manager, flush_interval=0.01, max_batch=100)
+    chat_id, sender_id, reader_id = uuid4(), uuid4(), uuid4()
+    message_ids = [uuid4() for _ in range(20)]
+    for message_id in message_ids:
+        receipts.add(chat_id, message_id, sender_id, read_by_user_id=reader_id)
+    receipts.add(chat_id, message_ids[0], sender_id, read_by_user_id=reader_id)  # повтор
+    assert manager.chat_events == []
+
+    await asyncio.sleep(0.05)
+    assert manager.chat_events == [(chat_id, {
+        "action": "messages_read", "chat_id": str(chat_id),
+        "message_ids": [str(message_id) for message_id in message_ids],
+        "read_by_user_id": str(reader_id),
+    })]
+    assert manager.user_events == [(sender_id, manager.chat_events[0][1])]
+
+
+@pytest.mark.asyncio
+async def test_single_receipt_keeps_message_read():
+    """Одна отметка за окно - прежнее событие message_read, отдельно по каждому читателю и чату"""
+    manager = FakeManager()
+    receipts = ReceiptAggregator(manager=manager, flush_interval=10, max_batch=100)
+    chat_id, sender_id, message_id = uuid4(), uuid4(), uuid4()
+    reader_id = uuid4()
+    receipts.add(chat_id, message_id, sender_id, read_by_user_id=reader_id)
+    receipts.add(chat_id, message_id, sender_id)  # прочитали все
+    await receipts.stop()
+
+    assert [event for _, event in manager.chat_events] == [
+        {"action": "message_read", "chat_id": str(chat_id), "message_id": str(message_id),
+         "read_by_user_id": str(reader_id)},
+        {"action": "message_read", "chat_id": str(chat_id), "message_id": str(message_id),
+         "read_by_all": True},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_max_batch_flushes_early():
+    """Набралось max_batch отметок - событие уходит, не дожидаясь окна"""
+    manager = FakeManager()
+    receipts = ReceiptAggregator(manager=manager, flush_interval=10, max_batch=3)
+    chat_id, sender_id, reader_id = uuid4(), uuid4(), uuid4()
+    for _ in range(4):
+        receipts.add(chat_id, uuid4(), sender_id, read_by_user_id=reader_id)
+    await asyncio.sleep(0)
+    assert len(manager.chat_events) == 1
+    assert len(manager.chat_events[0][1]["message_ids"]) == 3
+
+    await receipts.stop()
+    assert len(manager.chat_events) == 2
+    assert manager.chat_events[1][1]["action"] == "message_read"
@@ -0,0 +1,91 @@
+import uuid
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.database import READ_ONLY, read_only_session, routing_sessionmaker
+from app.models.models import User
+
+
+@pytest.fixture
+async def engines(tmp_path):
+    """Две базы SQLite вместо основной базы и реплики: в каждой свой пользователь с email = имя базы"""
+    primary = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'primary.sqlite'}")
+    replica = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'replica.sqlite'}")
+    for name, engine in (("primary", primary), ("replica", replica)):
+        async with engine.begin() as conn:
+            await conn.run_sync(User.__table__.create)
+            await conn.execute(User.__table__.insert().values(id=uuid.uuid4(), username=name, email=name))
+    yield primary, replica
+    await primary.dispose()
+    await replica.dispose()
+
+
+async def source(session, **kwargs) -> str:
+    """Из какой базы прочитан список пользователей"""
+    return [user.email for user in await User.list(session=session, **kwargs)][0]
+
+
+@pytest.mark.asyncio
+async def test_replica_is_opt_in(engines):
+    """
+    Base.first/list/list_rows и обычные запросы читают с основной базы (проверки перед записью,
+    авторизация), на реплику идут только вызовы с replica_ok и сессии только для чтения
+    """
+    session_factory = routing_sessionmaker(*engines)
+    async with session_factory() as session:
+        assert await source(session) == "primary"
+        assert (await User.first(session=session)).email == "primary"
+        assert (await User.list_rows(session=session))[0]["email"] == "primary"
+        # чтение с реплики включается на месте вызова
+        assert (await User.first(session=session, replica_ok=True)).email == "replica"
+        assert await source(session, replica_ok=True) == "replica"
+        assert (await User.list_rows(session=session, replica_ok=True))[0]["email"] == "replica"
+        assert await session.scalar(select(User.email).execution_options(replica_ok=True)) == "replica"
+        assert await session.scalar(select(User.email).with_for_update()) == "primary"
+
+    async with session_factory() as session:
+        session.info[READ_ONLY] = True
+        assert (await User.first(session=session)).email == "replica"
+        assert (await User.list_rows(session=session))[0]["email"] == "replica"
+
+
+@pytest.mark.asyncio
+async def test_read_only_session_sticks_to_primary_after_write(engines):
+    """Сессия только для чтения читает с реплики, пока в ней не было записи (read-your-writes)"""
+    session_factory = routing_sessionmaker(*engines)
+    async with session_factory() as session:
+        session.info[READ_ONLY] = True
+        assert await session.scalar(select(User.email)) == "replica"
+
+        session.add(User(id=uuid.uuid4(), username="new", email="new"))
+        await session.commit()
+        assert await session.scalar(select(User.email).where(User.email == "new")) == "new"
+        assert await source(session) == "primary"
+
+
+@pytest.mark.asyncio
+async def test_read_only_session_is_separate(engines):
+    """
+    Сессия get_read_db - отдельная: сессия запроса (авторизация, проверки) остается на основной базе,
+    а после записи в ней сессия только для чтения тоже переходит на основную базу
+    """
+    session_factory = routing_sessionmaker(*engines)
+    async with session_factory() as session:
+        async with read_only_session(session) as read_db:
+            assert await source(read_db) == "replica"
+            assert await source(session) == "primary"
+
+            session.add(User(id=uuid.uuid4(), username="new", email="new"))
+            await session.commit()
+            assert await read_db.scalar(select(User.email).where(User.email == "new")) == "new"
+
+
+@pytest.mark.asyncio
+async def test_no_replica_reads_primary(engines):
+    """Без реплики все запросы идут в основную базу"""
+    session_factory = routing_sessionmaker(engines[0])
+    async with session_factory() as session:
+        session.info[READ_ONLY] = True
+        assert await source(session) == "primary"
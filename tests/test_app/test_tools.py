@@ -0,0 +1,40 @@
+import uuid
+from datetime import UTC, date, datetime
+
+import pytest
+from starlette.exceptions import HTTPException
+
+from app import tools
+from app.tools import decode_cursor, encode_cursor, json_dumps
+
+
+def test_cursor_roundtrip():
+    """Курсор восстанавливает (timestamp, id) без потерь, вплоть до микросекунд и часового пояса"""
+    timestamp, item_id = datetime(2025, 5, 26, 13, 4, 36, 320218, tzinfo=UTC), uuid.uuid4()
+    cursor = encode_cursor(timestamp, item_id)
+    assert "|" not in cursor and "=" not in cursor
+    assert decode_cursor(cursor) == (timestamp, item_id)
+
+
+@pytest.mark.parametrize("cursor", ["", "мусор", "bm90LWEtY3Vyc29y", encode_cursor(datetime.now(UTC), uuid.uuid4())[:-3]])
+def test_cursor_invalid(cursor):
+    """Испорченный курсор - 400"""
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor(cursor)
+    assert exc.value.status_code == 400
+
+
+@pytest.mark.parametrize("with_orjson", [True, False])
+def test_json_dumps_same_without_orjson(monkeypatch, with_orjson):
+    """С orjson и без него UUID и даты сериализуются одинаково, неизвестный тип - TypeError"""
+    if not with_orjson:
+        monkeypatch.setattr(tools, "orjson", None)
+    elif tools.orjson is None:
+        pytest.skip("orjson не установлен")
+    item_id = uuid.UUID("12345678-1234-5678-1234-567812345678")
+    data = {"id": item_id, "at": datetime(2025, 5, 26, 13, 4, 36, 320218, tzinfo=UTC),
+            "day": date(2025, 5, 26), "text": "привет"}
+    assert json_dumps(data) == ('{"id":"12345678-1234-5678-1234-567812345678",'
+                                '"at":"2025-05-26T13:04:36.320218+00:00","day":"2025-05-26","text":"привет"}')
+    with pytest.raises(TypeError):
+        json_dumps({"x": object()})
@@ -12,10 +12,11 @@ from sqlalchemy.exc import ProgrammingError
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
 from app.auth.service import AuthService
-from app.database import get_db
+from app.database import get_db, get_session_factory
 from app.dto import UserPwdDTO
 from app.models.models import Chat, GroupMember, MessageRead, User
 from app.models.models import Message
+from app.services.ingest import message_ingest
 from main import app
 
 logger = logging.getLogger(__name__)
@@ -23,6 +24,9 @@ logger = logging.getLogger(__name__)
 
 def run_server():
     os.environ["TESTING"] = "true"
+    # пакетная запись сообщений идет мимо зависимостей FastAPI, направляем ее в тестовую базу
+    message_ingest.session_factory = async_sessionmaker(create_async_engine(TEST_DATABASE_URL), class_=AsyncSession,
+                                                        expire_on_commit=False)
     uvicorn.run(app, host="127.0.0.1", port=8000, log_level="info")
     os.environ["TESTING"] = "false"
 
@@ -102,6 +106,7 @@ async def override_get_db(db_session_factory):
 @pytest.fixture(autouse=True)
 def override_dependency(db_session_factory):
     app.dependency_overrides[get_db] = lambda: override_get_db(db_session_factory)
+    app.dependency_overrides[get_session_factory] = lambda: db_session_factory
     yield
     app.dependency_overrides.clear()
 
@@ -236,6 +241,35 @@ async def test_websocket_send_message(start_server, ws_db_session, db_session_fa
             await websocket.close()
 
 
+@pytest.mark.asyncio
+async def test_websocket_send_message_retry(
+        start_server, ws_db_session, db_session_factory, ws_auth_headers, ws_personal_chat, ws_test_user
+):
+    """
+    Повторные отправки с тем же message_id подтверждаются
+    исходным сообщением, в базе остается одна запись.
+    """
+    uri = f"ws://{TEST_HOST}/ws/{ws_personal_chat.id}"
+    async with ClientSession() as session:
+        async with session.ws_connect(uri, headers=ws_auth_headers) as websocket:
+            message_uuid = uuid4()
+            for text in ("Оригинал", "Повтор 1", "Повтор 2"):
+                await websocket.send_json({
+                    "action": "send_message",
+                    "text": text,
+                    "message_id": str(message_uuid),
+                    "chat_id": str(ws_personal_chat.id),
+                })
+            responses = [await asyncio.wait_for(websocket.receive_json(), timeout=2.0) for _ in range(3)]
+            assert all(response["message_id"] == str(message_uuid) for response in responses)
+            assert all(response["text"] == "Оригинал" for response in responses)
+
+            async with db_session_factory() as check_session:
+                messages = await Message.list(id=message_uuid, session=check_session)
+                assert len(messages) == 1
+            await websocket.close()
+
+
 @pytest.mark.asyncio
 async def test_websocket_read_message_personal_chat(
         start_server, ws_db_session, db_session_factory, ws_auth_headers, ws_personal_chat, ws_test_user, ws_test_user2
@@ -494,3 +528,105 @@ async def test_websocket_send_multiple_messages(
 
             await websocket.close()
             print(f"🔴 Соединение закрыто")
+
+
+@pytest.mark.asyncio
+async def test_websocket_multiplexed(
+        start_server, ws_db_session, db_session_factory, ws_auth_headers, ws_personal_chat, ws_group_chat, ws_test_user
+):
+    """
+    Один сокет /ws: подписка на два чата, отправка сообщения в каждый, отписка.
+    """
+    uri = f"ws://{TEST_HOST}/ws"
+    async with ClientSession() as session:
+        async with session.ws_connect(uri, headers=ws_auth_headers) as websocket:
+            for chat in (ws_personal_chat, ws_group_chat):
+                await websocket.send_json({"action": "subscribe", "chat_id": str(chat.id)})
+                response = await asyncio.wait_for(websocket.receive_json(), timeout=2.0)
+                assert response == {"action": "subscribed", "chat_id": str(chat.id)}
+
+            message_uuids = {}
+            for chat in (ws_personal_chat, ws_group_chat):
+                message_uuids[str(chat.id)] = uuid4()
+                await websocket.send_json({
+                    "action": "send_message",
+                    "text": f"Сообщение в {chat.id}",
+                    "message_id": str(message_uuids[str(chat.id)]),
+                    "chat_id": str(chat.id),
+                })
+                response = await asyncio.wait_for(websocket.receive_json(), timeout=2.0)
+                assert response["chat_id"] == str(chat.id)
+                assert response["message_id"] == str(message_uuids[str(chat.id)])
+
+            await websocket.send_json({"action": "unsubscribe", "chat_id": str(ws_group_chat.id)})
+            response = await asyncio.wait_for(websocket.receive_json(), timeout=2.0)
+            assert response == {"action": "unsubscribed", "chat_id": str(ws_group_chat.id)}
+
+            await websocket.send_json({
+                "action": "send_message",
+                "text": "После отписки",
+                "message_id": str(uuid4()),
+                "chat_id": str(ws_group_chat.id),
+            })
+            response = await asyncio.wait_for(websocket.receive_json(), timeout=2.0)
+            assert response["error"] == "Нет подписки на этот чат"
+
+            async with db_session_factory() as check_session:
+                for message_uuid in message_uuids.values():
+                    assert await Message.first(id=message_uuid, session=check_session) is not None
+            await websocket.close()
+
+
+@pytest.mark.asyncio
+async def test_websocket_multiplexed_not_member(
+        start_server, ws_db_session, ws_group_chat, ws_test_user
+):
+    """Подписка на чужой чат отклоняется, соединение остается открытым"""
+    auth_service = AuthService()
+    user, _ = await auth_service.register(
+        UserPwdDTO(username="outsider", email="outsider@example.com", password="test123"), session=ws_db_session)
+    token = auth_service._jwt_auth.generate_access_token(subject=str(user.id), payload={"device_id": str(uuid4())})
+    uri = f"ws://{TEST_HOST}/ws"
+    async with ClientSession() as session:
+        async with session.ws_connect(uri, headers={"Authorization": f"Bearer {token}"}) as websocket:
+            await websocket.send_json({"action": "subscribe", "chat_id": str(ws_group_chat.id)})
+            response = await asyncio.wait_for(websocket.receive_json(), timeout=2.0)
+            assert response == {"error": "Вы не участник этого чата", "chat_id": str(ws_group_chat.id)}
+            assert websocket.closed is False
+            await websocket.close()
+
+
+@pytest.mark.asyncio
+async def test_idle_websockets_hold_no_db_sessions(
+        start_server, ws_db_session, db_session_factory, ws_auth_headers, ws_group_chat, ws_test_user
+):
+    """
+    Простаивающие сокеты не держат сессий БД: сокетов больше, чем размер пула,
+    все подключаются, ни одна сессия не висит в транзакции, сообщения проходят.
+    """
+    sockets_count = 40  # больше pool_size + max_overflow движка по умолчанию (5 + 10)
+    uri = f"ws://{TEST_HOST}/ws/{ws_group_chat.id}"
+    async with ClientSession() as session:
+        sockets = [await session.ws_connect(uri, headers=ws_auth_headers) for _ in range(sockets_count)]
+        await asyncio.sleep(1)
+
+        async with db_session_factory() as check_session:
+            in_transaction = await check_session.scalar(text(
+                "SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() "
+                "AND state = 'idle in transaction' AND pid <> pg_backend_pid()"
+            ))
+        assert in_transaction == 0
+        assert all(websocket.closed is False for websocket in sockets)
+
+        message_uuid = uuid4()
+        await sockets[-1].send_json({
+            "action": "send_message",
+            "text": "Сообщение при 40 сокетах",
+            "message_id": str(message_uuid),
+            "chat_id": str(ws_group_chat.id),
+        })
+        response = await asyncio.wait_for(sockets[0].receive_json(), timeout=5.0)
+        assert response["message_id"] == str(message_uuid)
+
+        for websocket in sockets:
+            await websocket.close()
@@ -6,8 +6,9 @@ from starlette import status
 from jose import jwt
 from app.config import settings
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.auth.auth import get_current_user, get_current_ws_user, get_admin_user
+from app.auth.auth import get_current_user, get_current_user_and_device, get_current_ws_user, get_admin_user
 from app.auth.password import get_password_hash
+from app.auth.service import AuthService
 from app.models.models import User
 
 
@@ -63,7 +64,7 @@ async def test_get_current_ws_user_success(test_user, db_session: AsyncSession):
     Проверяет получение пользователя по валидному токену для WebSocket.
     """
     token = jwt.encode({"sub": str(test_user.id)}, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
-    user = await get_current_ws_user(token=token, session=db_session)
+    user = await get_current_ws_user(token=token, session_factory=lambda: db_session)
     assert user is not None
     assert user.id == test_user.id
     assert user.email == "test@example.com"
@@ -75,7 +76,7 @@ async def test_get_current_ws_user_invalid_token(db_session: AsyncSession):
     Проверяет, что невалидный токен для WebSocket вызывает 401.
     """
     with pytest.raises(HTTPException) as exc:
-        await get_current_ws_user(token="invalid_token", session=db_session)
+        await get_current_ws_user(token="invalid_token", session_factory=lambda: db_session)
     assert exc.value.status_code == status.HTTP_401_UNAUTHORIZED
     assert exc.value.detail == "Токен не валидный!"
 
@@ -124,3 +125,41 @@ async def test_get_admin_user_invalid_token(db_session: AsyncSession):
         await get_admin_user(token="invalid_token")
     assert exc.value.status_code == status.HTTP_401_UNAUTHORIZED
     assert exc.value.detail == "Токен не валидный!"
+
+
+@pytest.mark.asyncio
+async def test_get_current_user_cached(test_user, db_session: AsyncSession, monkeypatch):
+    """
+    Повторная проверка того же токена не ходит в базу за пользователем,
+    а пользователь из кеша привязан к сессии запроса.
+    """
+    token = jwt.encode({"sub": str(test_user.id)}, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+    await get_current_user(token=token, session=db_session)
+
+    async def get_or_404(*args, **kwargs):
+        raise AssertionError("пользователь должен браться из кеша")
+
+    monkeypatch.setattr(User, "get_or_404", get_or_404)
+    user = await get_current_user(token=token, session=db_session)
+    assert user.id == test_user.id
+    assert user in db_session
+    assert (await get_current_ws_user(token=token, session_factory=None)).id == test_user.id
+
+
+@pytest.mark.asyncio
+async def test_get_current_user_after_logout(test_user, db_session: AsyncSession):
+    """Выход с устройства сбрасывает кеш: токен этого устройства больше не принимается"""
+    auth_service = AuthService()
+    device_id = str(uuid.uuid4())
+    access_token, _, notes = auth_service._issue_tokens_for_user(test_user, device_id)
+    db_session.add_all(notes)
+    await db_session.commit()
+
+    user, device = await get_current_user_and_device(token=access_token, session=db_session)
+    assert (user.id, device) == (test_user.id, device_id)
+
+    await auth_service.logout(user=test_user, device_id=device_id, session=db_session)
+    with pytest.raises(HTTPException) as exc:
+        await get_current_user(token=access_token, session=db_session)
+    assert exc.value.status_code == status.HTTP_401_UNAUTHORIZED
+    assert exc.value.detail == "Токен отозван"
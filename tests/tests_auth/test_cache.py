@@ -0,0 +1,49 @@
+import time
+import uuid
+
+from app.auth.cache import TokenCache
+from app.models.models import User
+
+
+def make_user() -> User:
+    return User(id=uuid.uuid4(), username="cached", email="cached@example.com", password="-", is_admin=False)
+
+
+def test_token_cache_roundtrip():
+    """Из кеша возвращаются claims и пользователь без сессии, но в состоянии "загружен" """
+    cache = TokenCache()
+    user = make_user()
+    payload = {"sub": str(user.id), "device_id": "d1", "exp": time.time() + 60}
+    cache.set("token", payload, user)
+
+    cached = cache.get("token")
+    assert cached.payload == payload
+    restored = cached.user()
+    assert (restored.id, restored.email, restored.is_admin) == (user.id, user.email, False)
+    assert cache.get("other") is None
+
+
+def test_token_cache_expired():
+    """Запись не переживает exp токена"""
+    cache = TokenCache()
+    user = make_user()
+    cache.set("token", {"sub": str(user.id), "exp": time.time() - 1}, user)
+    assert cache.get("token") is None
+
+
+def test_token_cache_invalidate():
+    """Выход сбрасывает токены одного устройства, отзыв всех токенов - все токены пользователя"""
+    cache = TokenCache()
+    user, other = make_user(), make_user()
+    cache.set("d1", {"sub": str(user.id), "device_id": "d1"}, user)
+    cache.set("d2", {"sub": str(user.id), "device_id": "d2"}, user)
+    cache.set("other", {"sub": str(other.id), "device_id": "d1"}, other)
+
+    cache.invalidate_device(user.id, "d1")
+    assert cache.get("d1") is None
+    assert cache.get("d2") is not None
+    assert cache.get("other") is not None
+
+    cache.invalidate_user(user.id)
+    assert cache.get("d2") is None
+    assert cache.get("other") is not None
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+
+import pytest
+from passlib.context import CryptContext
+from starlette import status
+from starlette.exceptions import HTTPException
+
+from app.auth.password import PasswordPool, check_and_update_password, check_password, hash_password
+from app.config import settings
+
+
+@pytest.mark.asyncio
+async def test_hash_and_check_in_pool():
+    """Хеш, посчитанный в пуле, проверяется в пуле"""
+    hashed = await hash_password("secret")
+    assert await check_password("secret", hashed) is True
+    assert await check_password("wrong", hashed) is False
+
+
+@pytest.mark.asyncio
+async def test_pool_does_not_block_loop():
+    """Пока поток считает, цикл событий продолжает работать"""
+    pool = PasswordPool(workers=1, queue_size=0)
+    release = threading.Event()
+    task = asyncio.create_task(pool.run(release.wait, 5))
+    await asyncio.sleep(0.01)  # цикл событий не стоит
+    assert not task.done()
+    release.set()
+    assert await task is True
+
+
+@pytest.mark.asyncio
+async def test_pool_queue_full():
+    """Сверх workers + queue_size запрос сразу получает 503"""
+    pool = PasswordPool(workers=1, queue_size=1)
+    release = threading.Event()
+    tasks = [asyncio.create_task(pool.run(release.wait, 5)) for _ in range(2)]
+    await asyncio.sleep(0)
+    with pytest.raises(HTTPException) as exc:
+        await pool.run(release.wait, 5)
+    assert exc.value.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    release.set()
+    assert await asyncio.gather(*tasks) == [True, True]
+    assert pool.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_check_and_update_password():
+    """Устаревшая схема или стоимость дают новый хеш, актуальный хеш и неверный пароль - нет"""
+    legacy = CryptContext(schemes=["django_pbkdf2_sha256"]).hash("secret")
+    cheap = CryptContext(schemes=["pbkdf2_sha256"], pbkdf2_sha256__default_rounds=1000).hash("secret")
+    for old_hash in (legacy, cheap):
+        valid, new_hash = await check_and_update_password("secret", old_hash)
+        assert valid is True
+        assert new_hash.startswith(f"$pbkdf2-sha256${settings.TG_PASSWORD_ROUNDS}$")
+        assert await check_and_update_password("secret", new_hash) == (True, None)
+    assert await check_and_update_password("wrong", legacy) == (False, None)
@@ -0,0 +1,82 @@
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.auth import utils
+from app.auth.cache import token_cache
+from app.auth.revocation import RevocationIndex
+from app.models.models import User
+from app.services.broker import InProcessBroker
+
+
+class CountingSession:
+    """Сессия без базы: считает запросы, отозванных токенов в ней нет"""
+
+    def __init__(self):
+        self.queries = 0
+
+    async def execute(self, statement):
+        self.queries += 1
+        return self
+
+    def scalar_one_or_none(self):
+        return None
+
+
+async def make_index(bus: dict) -> RevocationIndex:
+    """Индекс "процесса" на общей шине, как будто уже загруженный из базы"""
+    index = RevocationIndex(broker=InProcessBroker(bus), session_factory=None)
+    await index.broker.subscribe(RevocationIndex.CHANNEL)
+    index.loaded = True
+    return index
+
+
+@pytest.mark.asyncio
+async def test_revocation_synced_between_processes():
+    """Отзыв в одном процессе виден в другом и сбрасывает там кеш проверенных токенов"""
+    bus = {}
+    first, second = await make_index(bus), await make_index(bus)
+    jti = uuid.uuid4()
+    user = User(id=uuid.uuid4(), username="u", email="u@example.com", password="-", is_admin=False)
+    token_cache.set("token", {"sub": str(user.id), "jti": str(jti)}, user)
+
+    await first.revoke([(jti, datetime.now(timezone.utc) + timedelta(hours=1))])
+    assert first.is_revoked(jti)
+    assert second.is_revoked(jti)
+    assert not second.is_revoked(uuid.uuid4())
+    assert token_cache.get("token") is None
+
+
+@pytest.mark.asyncio
+async def test_check_revoked_uses_index(monkeypatch):
+    """С загруженным индексом проверка не ходит в базу, без него и для истекших токенов - ходит"""
+    index = await make_index({})
+    monkeypatch.setattr(utils, "revocation_index", index)
+    jti = uuid.uuid4()
+    await index.revoke([(jti, datetime.now(timezone.utc) + timedelta(hours=1))])
+
+    session = CountingSession()
+    assert await utils.check_revoked(jti, session=session) is True
+    assert await utils.check_revoked(str(uuid.uuid4()), session=session) is False
+    assert session.queries == 0
+
+    # истекший токен из индекса уже выброшен - спрашиваем базу
+    await utils.check_revoked(jti, session=session, exp=time.time() - 1)
+    assert session.queries == 1
+    index.clear()
+    assert await utils.check_revoked(jti, session=session) is False
+    assert session.queries == 2
+
+
+@pytest.mark.asyncio
+async def test_check_revoked_single_process_broker(monkeypatch):
+    """С брокером без других процессов (TG_BROKER=memory) индекс не знает об отзывах соседних воркеров"""
+    index = RevocationIndex(broker=InProcessBroker(), session_factory=None)
+    index.loaded = True
+    monkeypatch.setattr(utils, "revocation_index", index)
+
+    session = CountingSession()
+    assert await utils.check_revoked(uuid.uuid4(), session=session) is False
+    assert session.queries == 1
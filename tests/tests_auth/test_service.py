@@ -2,6 +2,7 @@ import datetime as dt
 import uuid
 
 import pytest
+from passlib.context import CryptContext
 from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
@@ -9,7 +10,7 @@ from starlette.exceptions import HTTPException
 
 from app.auth.service import AuthService
 from app.dto import UserPwdDTO
-from app.models.models import IssuedJWTToken
+from app.models.models import IssuedJWTToken, User
 
 
 @pytest.fixture
@@ -72,6 +73,21 @@ async def test_login_invalid_password(auth_service, db_session: AsyncSession, te
     assert exc.value.detail == "HTTP_401_UNAUTHORIZED"
 
 
+@pytest.mark.asyncio
+async def test_login_rehashes_legacy_password(auth_service, db_session: AsyncSession):
+    """Вход с хешем устаревшей схемы пересчитывает и сохраняет хеш"""
+    legacy = CryptContext(schemes=["django_pbkdf2_sha256"]).hash("test123")
+    user = User(id=uuid.uuid4(), username="legacy", email="legacy@example.com", password=legacy)
+    db_session.add(user)
+    await db_session.commit()
+
+    user_data = UserPwdDTO(username="legacy", email="legacy@example.com", password="test123")
+    assert await auth_service.login(data=user_data, session=db_session)
+    await db_session.refresh(user)
+    assert user.password.startswith("$pbkdf2-sha256$")
+    assert await auth_service.login(data=user_data, session=db_session)  # новый хеш подходит
+
+
 @pytest.mark.asyncio
 async def test_login_invalid_email(auth_service, db_session: AsyncSession):
     """Проверяет вход с несуществующим email."""
@@ -0,0 +1,78 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.auth.sweeper import TokenSweeper
+from app.models.models import IssuedJWTToken, User
+
+
+class FakeSweeper(TokenSweeper):
+    """Уборщик без базы: удаляет из счетчика "истекших" строк"""
+
+    def __init__(self, expired: int, **kwargs):
+        super().__init__(session_factory=None, **kwargs)
+        self.expired = expired
+        self.batches = []
+
+    async def _delete_batch(self, cutoff):
+        count = min(self.expired, self.batch_size)
+        self.expired -= count
+        self.batches.append(count)
+        return count
+
+
+@pytest.mark.asyncio
+async def test_sweep_in_batches():
+    """Токены удаляются пакетами, проход ограничен max_batches, остаток - в следующий проход"""
+    sweeper = FakeSweeper(expired=25, batch_size=10, max_batches=2)
+    assert await sweeper.sweep() == 20
+    assert sweeper.batches == [10, 10]
+    assert await sweeper.sweep() == 5
+    assert sweeper.batches == [10, 10, 5]
+    assert sweeper.stats.runs == 2
+    assert sweeper.stats.deleted_total == 25
+    assert (sweeper.stats.last_deleted, sweeper.stats.last_batches) == (5, 1)
+
+
+@pytest.mark.asyncio
+async def test_sweeper_schedule():
+    """Задача убирает по расписанию, пока не остановлена; interval=0 - уборка выключена"""
+    sweeper = FakeSweeper(expired=0, interval=0.01, batch_size=10)
+    sweeper.start()
+    await asyncio.sleep(0.05)
+    await sweeper.stop()
+    runs = sweeper.stats.runs
+    assert runs >= 2
+    await asyncio.sleep(0.02)
+    assert sweeper.stats.runs == runs
+
+    disabled = FakeSweeper(expired=0, interval=0)
+    disabled.start()
+    await asyncio.sleep(0.01)
+    assert disabled.stats.runs == 0
+
+
+@pytest.mark.asyncio
+async def test_sweep_deletes_expired_tokens(db_session: AsyncSession):
+    """Удаляются только токены, истекшие раньше запаса grace"""
+    user = await User.create(id=uuid.uuid4(), username="test_sweep", email="test_sweep@y.ru", session=db_session)
+    now = datetime.now(timezone.utc)
+    expired = [uuid.uuid4() for _ in range(5)]
+    kept = [uuid.uuid4(), uuid.uuid4()]
+    db_session.add_all(
+        [IssuedJWTToken(user_id=user.id, jti=jti, device_id="d", expired_time=now - timedelta(days=2))
+         for jti in expired]
+        + [IssuedJWTToken(user_id=user.id, jti=kept[0], device_id="d", expired_time=now + timedelta(hours=1)),
+           IssuedJWTToken(user_id=user.id, jti=kept[1], device_id="d", expired_time=now - timedelta(minutes=1))]
+    )
+    await db_session.commit()
+
+    sweeper = TokenSweeper(session_factory=lambda: db_session, batch_size=2, grace=3600)
+    assert await sweeper.sweep() == 5
+    assert sweeper.stats.last_batches == 3
+    left = (await db_session.execute(select(IssuedJWTToken.jti).where(IssuedJWTToken.user_id == user.id))).scalars()
+    assert set(left) == set(kept)
@@ -11,10 +11,12 @@ from starlette.requests import Request
 
 from app.config import settings
 from app.auth.my_jwt import JWTAuth
+from app.auth.revocation import RevocationIndex
 from app.auth.types import TokenType
 from app.auth.utils import __try_to_get_clear_token, check_access_token, check_revoked, convert_to_timestamp, \
     generate_device_id, get_sha256_hash
 from app.models.models import IssuedJWTToken, User
+from app.services.broker import InProcessBroker
 from app.tools import validate_uuid
 
 
@@ -329,3 +331,27 @@ async def test_check_access_token_revoked(mock_request, revoked_token, db_sessio
 #         validate_uuid(invalid_uuid, er_status=custom_status, er_msg=custom_msg)
 #     assert exc.value.status_code == custom_status
 #     assert exc.value.detail == custom_msg
+
+
+async def test_revocation_index_load(db_session: AsyncSession):
+    """Индекс загружает из базы только отозванные и еще не истекшие токены"""
+    user = await User.create(id=uuid.uuid4(), username="test_revocation_index_load",
+                             email="test_revocation_index_load@y.ru", session=db_session)
+    now = datetime.now(timezone.utc)
+    revoked, expired, active = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    db_session.add_all([
+        IssuedJWTToken(user_id=user.id, jti=revoked, device_id="d", revoked=True,
+                       expired_time=now + timedelta(hours=1)),
+        IssuedJWTToken(user_id=user.id, jti=expired, device_id="d", revoked=True,
+                       expired_time=now - timedelta(hours=1)),
+        IssuedJWTToken(user_id=user.id, jti=active, device_id="d", revoked=False,
+                       expired_time=now + timedelta(hours=1)),
+    ])
+    await db_session.commit()
+
+    index = RevocationIndex(broker=InProcessBroker(), session_factory=lambda: db_session)
+    await index.load()
+    assert index.loaded
+    assert index.is_revoked(revoked)
+    assert not index.is_revoked(expired)
+    assert not index.is_revoked(active)